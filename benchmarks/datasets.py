@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+'''
+Synthetic W-drive-like datasets for the benchmark suite: a
+denormalized contract list, where every line carries a contract,
+the company that holds it, the company's contact and a few
+lookup values, written out as a CSV file and an Excel workbook.
+'''
+
+import os
+import csv
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+# the most rows an .xls sheet can hold, less one for the header
+SHEET_ROWS = 65535
+
+CONTRACT_COLUMNS = (
+    ('description', 'TEXT'),
+    ('contract_number', 'VARCHAR(255)'),
+    ('expiration', 'TIMESTAMP'),
+    ('controller_number', 'INTEGER'),
+    ('commcode', 'INTEGER'),
+)
+
+COMPANY_COLUMNS = (
+    ('company', 'VARCHAR(255)'),
+    ('bus_type', 'VARCHAR(255)'),
+)
+
+CONTACT_COLUMNS = (
+    ('contact_name', 'VARCHAR(255)'),
+    ('address_1', 'VARCHAR(255)'),
+    ('phone_number', 'VARCHAR(255)'),
+    ('email', 'VARCHAR(255)'),
+)
+
+def build_schema(columns=10, related_tables=2):
+    '''
+    Returns a PostgresLoader schema shaped like the contract,
+    company and company_contact example in the README. The
+    contract table gets extra TEXT columns until it has columns
+    columns. related_tables counts the tables besides contract:
+    the first two are company and company_contact and any more
+    are lookup tables that contract rows point at.
+    '''
+    contract_columns = CONTRACT_COLUMNS[:columns] + tuple(
+        ('field_{number}'.format(number=number), 'TEXT')
+        for number in range(len(CONTRACT_COLUMNS), columns)
+    )
+
+    contract = {
+        'table_name': 'contract',
+        'pkey': None,
+        'columns': contract_columns,
+        'to_relations': [],
+        'from_relations': [],
+    }
+    schema = [contract]
+
+    if related_tables >= 1:
+        contract['from_relations'].append('company')
+        company = {
+            'table_name': 'company',
+            'pkey': None,
+            'columns': COMPANY_COLUMNS,
+            'to_relations': ['contract'],
+            'from_relations': [],
+        }
+
+        if related_tables >= 2:
+            company['to_relations'].insert(0, 'company_contact')
+            schema.append({
+                'table_name': 'company_contact',
+                'pkey': None,
+                'columns': CONTACT_COLUMNS,
+                'to_relations': [],
+                'from_relations': ['company'],
+            })
+
+        schema.append(company)
+
+    for number in range(2, related_tables):
+        name = 'lookup_{number}'.format(number=number)
+        contract['from_relations'].append(name)
+        schema.append({
+            'table_name': name,
+            'pkey': None,
+            'columns': ((name + '_name', 'VARCHAR(255)'), (name + '_code', 'INTEGER')),
+            'to_relations': ['contract'],
+            'from_relations': [],
+        })
+
+    return schema
+
+def schema_header(schema):
+    '''
+    Returns the column names of a schema in file order, along
+    with the python type each should be extracted as
+    '''
+    header, dtypes = [], []
+
+    for table in schema:
+        for name, column_type in table['columns']:
+            header.append(name)
+            dtypes.append(int if column_type == 'INTEGER' else unicode)
+
+    return header, dtypes
+
+def column_value(name, number):
+    '''
+    Returns a deterministic value for a column of the numberth
+    distinct row of its table
+    '''
+    if name == 'expiration':
+        return '20{year:02d}-{month:02d}-01 00:00:00'.format(year=number % 20, month=number % 12 + 1)
+    elif name in ('controller_number', 'commcode') or name.endswith('_code'):
+        return number
+    elif name == 'email':
+        return 'contact{number}@example.com'.format(number=number)
+    elif name == 'phone_number':
+        return '412-555-{number:04d}'.format(number=number % 10000)
+    return '{name} {number}'.format(name=name.replace('_', ' '), number=number)
+
+def generate_lines(rows, columns=10, duplication=0.2, related_tables=2, seed=0):
+    '''
+    Returns rows lines for build_schema(columns, related_tables).
+    About a duplication share of the lines repeat an earlier
+    line exactly. Every twentieth contract, on average, belongs
+    to a new company, and lookup tables hold 50 values each.
+    '''
+    rng = random.Random(seed)
+    schema = build_schema(columns, related_tables)
+
+    table_sizes = {
+        'contract': rows,
+        'company': max(1, rows / 20),
+        'company_contact': max(1, rows / 20),
+    }
+
+    lines, contracts = [], 0
+
+    for i in xrange(rows):
+        if lines and rng.random() < duplication:
+            lines.append(lines[rng.randrange(len(lines))])
+            continue
+
+        company = rng.randrange(table_sizes['company'])
+        line = {}
+
+        for table in schema:
+            name = table['table_name']
+            if name == 'contract':
+                number = contracts
+            elif name in ('company', 'company_contact'):
+                # each company has exactly one contact
+                number = company
+            else:
+                number = rng.randrange(50)
+
+            for column, column_type in table['columns']:
+                line[column] = column_value(column, number)
+
+        contracts += 1
+        lines.append(line)
+
+    return lines
+
+def write_csv(path, lines, header):
+    with open(path, 'wb') as output:
+        writer = csv.writer(output)
+        writer.writerow(header)
+        for line in lines:
+            writer.writerow([line[column] for column in header])
+
+    return path
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def xlsx_cell(reference, value):
+    if isinstance(value, (int, long, float)):
+        return '<c r="{reference}"><v>{value}</v></c>'.format(reference=reference, value=value)
+    return '<c r="{reference}" t="inlineStr"><is><t>{value}</t></is></c>'.format(
+        reference=reference, value=escape(value)
+    )
+
+XLSX_CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+{overrides}
+</Types>'''
+
+XLSX_ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+XLSX_WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets>{sheets}</sheets>
+</workbook>'''
+
+XLSX_WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+{relationships}
+</Relationships>'''
+
+def write_xlsx(path, sheets, header):
+    '''
+    Writes a minimal .xlsx workbook with inline strings, which
+    is all xlrd needs to read one. Used when xlwt isn't installed.
+    '''
+    names = range(1, len(sheets) + 1)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES.format(overrides='\n'.join(
+            '<Override PartName="/xl/worksheets/sheet{name}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(name=name)
+            for name in names
+        )))
+        workbook.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(sheets=''.join(
+            '<sheet name="Sheet{name}" sheetId="{name}" r:id="rId{name}"/>'.format(name=name)
+            for name in names
+        )))
+        workbook.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS.format(relationships='\n'.join(
+            '<Relationship Id="rId{name}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{name}.xml"/>'.format(name=name)
+            for name in names
+        )))
+
+        letters = [column_letter(index) for index in range(len(header))]
+
+        for name, lines in zip(names, sheets):
+            rows = []
+            for row_number, values in enumerate([header] + [
+                [line[column] for column in header] for line in lines
+            ]):
+                rows.append('<row r="{number}">{cells}</row>'.format(
+                    number=row_number + 1, cells=''.join(
+                        xlsx_cell(letter + str(row_number + 1), value)
+                        for letter, value in zip(letters, values)
+                    )
+                ))
+
+            workbook.writestr('xl/worksheets/sheet{name}.xml'.format(name=name), (
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>{rows}</sheetData></worksheet>'
+            ).format(rows=''.join(rows)))
+
+    return path
+
+def write_xls(path, sheets, header):
+    workbook = xlwt.Workbook()
+
+    for number, lines in enumerate(sheets):
+        sheet = workbook.add_sheet('Sheet{number}'.format(number=number + 1))
+
+        for column, name in enumerate(header):
+            sheet.write(0, column, name)
+
+        for row_number, line in enumerate(lines):
+            for column, name in enumerate(header):
+                sheet.write(row_number + 1, column, line[name])
+
+    workbook.save(path)
+    return path
+
+def write_workbook(path, lines, header):
+    '''
+    Writes lines to an Excel workbook, SHEET_ROWS lines to a
+    sheet, each with a header row. Writes an .xls file with xlwt
+    if it is installed and an .xlsx file otherwise; path's
+    extension is replaced to match. Returns the path written.
+    '''
+    sheets = [lines[start:start + SHEET_ROWS] for start in xrange(0, len(lines), SHEET_ROWS)] or [[]]
+    base = os.path.splitext(path)[0]
+
+    if xlwt is not None:
+        return write_xls(base + '.xls', sheets, header)
+    return write_xlsx(base + '.xlsx', sheets, header)
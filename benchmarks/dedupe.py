@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+Times PostgresLoader.simple_dedupe and measures its peak memory
+on synthetic, heavily duplicated input. Run from the repository
+root with:
+
+    PYTHONPATH=. python benchmarks/dedupe.py --rows 1000000 --distinct 0.05
+
+Pass --spill with a memory limit in megabytes to time the
+out-of-core SpillingDeduper instead.
+'''
+
+import gc
+import time
+import random
+import resource
+import argparse
+
+from wextractor.loaders.postgres import PostgresLoader
+
+SCHEMA = [
+    {
+        'table_name': 'contract',
+        'pkey': None,
+        'columns': (
+            ('description', 'TEXT'),
+            ('contract_number', 'VARCHAR(255)'),
+            ('expiration', 'TIMESTAMP'),
+        ),
+        'to_relations': [],
+        'from_relations': ['company'],
+    },
+    {
+        'table_name': 'company',
+        'pkey': None,
+        'columns': (
+            ('company', 'VARCHAR(255)'),
+            ('bus_type', 'VARCHAR(255)'),
+        ),
+        'to_relations': ['contract'],
+        'from_relations': [],
+    }
+]
+
+def generate_lines(rows, distinct, seed=0):
+    '''
+    Returns rows lines drawn from a pool of rows * distinct
+    distinct lines
+    '''
+    rng = random.Random(seed)
+    pool_size = max(1, int(rows * distinct))
+
+    pool = [{
+        'description': 'contract description {0}'.format(i),
+        'contract_number': 'C-{0:08d}'.format(i),
+        'expiration': '2015-{0:02d}-01 00:00:00'.format(i % 12 + 1),
+        'company': 'company {0}'.format(i % (pool_size / 10 + 1)),
+        'bus_type': 'type {0}'.format(i % 7),
+    } for i in xrange(pool_size)]
+
+    return [pool[rng.randrange(pool_size)] for i in xrange(rows)]
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--distinct', type=float, default=0.05)
+    parser.add_argument('--spill', type=float, default=None, metavar='MB')
+    args = parser.parse_args()
+
+    loader = PostgresLoader({'database': 'bench', 'user': 'bench'}, SCHEMA)
+
+    tables = [list() for table in SCHEMA]
+    for line in generate_lines(args.rows, args.distinct):
+        for ix, row in enumerate(loader.transform_line(line, True)):
+            tables[ix].append(row)
+
+    for ix, table in enumerate(tables):
+        gc.collect()
+        rss_before = max_rss_mb()
+        started = time.time()
+
+        if args.spill is None:
+            output = loader.simple_dedupe(ix, table)
+        else:
+            deduper = loader.table_deduper(
+                loader.plan[ix], True, spill=True, memory_limit=int(args.spill * 1024 * 1024)
+            )
+            for row in table:
+                deduper.add(row)
+            output = list(deduper.dedupe())
+
+        elapsed = time.time() - started
+        print '{table}: {rows_in} rows -> {rows_out} rows in {elapsed:.2f}s, peak memory +{memory:.0f}MB'.format(
+            table=SCHEMA[ix]['table_name'], rows_in=len(table), rows_out=len(output),
+            elapsed=elapsed, memory=max_rss_mb() - rss_before
+        )
+
+if __name__ == '__main__':
+    main()
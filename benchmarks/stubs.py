@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+'''
+Stand-ins for a psycopg2 connection and cursor, so that the
+database stage of the benchmark suite can run without Postgres.
+COPY data is read out of its stream the way psycopg2 reads it,
+so formatting it is still timed; everything else is recorded
+and dropped.
+'''
+
+class StubCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        self.connection.statements.append(query)
+
+    def fetchone(self):
+        # nothing exists yet, e.g. no stored digests or indexes
+        return None
+
+    def fetchall(self):
+        return []
+
+    def consume(self, stream, size):
+        while True:
+            data = stream.read(size)
+            if not data:
+                break
+            self.connection.bytes_copied += len(data)
+
+    def copy_from(self, stream, table, sep='\t', null='\\N', size=8192, columns=None):
+        self.connection.statements.append('COPY {table}'.format(table=table))
+        self.consume(stream, size)
+
+    def copy_expert(self, query, stream, size=8192):
+        self.connection.statements.append(query)
+        self.consume(stream, size)
+
+    def close(self):
+        pass
+
+class StubConnection(object):
+    def __init__(self):
+        '''
+        Pass to PostgresLoader(connection=...). statements holds
+        every query that was run and bytes_copied the amount of
+        COPY data that was sent.
+        '''
+        self.statements = []
+        self.bytes_copied = 0
+        self.autocommit = False
+        self.closed = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
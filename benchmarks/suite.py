@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+'''
+Times each stage of an extract and load on synthetic W-drive-like
+data (see benchmarks/datasets.py): CsvExtractor, ExcelExtractor,
+transform_to_schema, simple_dedupe ('dedupe'),
+generate_data_tempfile ('tempfile') and a full load. Reports
+rows/sec and peak memory for every stage and saves them as JSON,
+so that runs can be compared across commits.
+Run from the repository root with:
+
+    PYTHONPATH=. python benchmarks/suite.py --rows 100000 --duplication 0.2
+
+and compare two runs with:
+
+    PYTHONPATH=. python benchmarks/suite.py --compare old.json new.json
+
+The load runs against a stub connection, which formats and reads
+all of the COPY data but sends nothing, unless --database and
+--user are given. NOTE: against a real database the load drops
+and recreates the benchmark's tables.
+
+Excel workbooks are written as .xls if xlwt is installed and as
+.xlsx otherwise, which xlrd parses more slowly, so only compare
+runs that used the same format. See benchmarks/dedupe.py to time
+the out-of-core deduplication.
+'''
+
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+
+from wextractor.extractors import CsvExtractor, ExcelExtractor
+from wextractor.loaders.postgres import PostgresLoader
+from wextractor.instrumentation import Instrumentation
+
+from benchmarks.datasets import build_schema, schema_header, generate_lines, write_csv, write_workbook
+from benchmarks.stubs import StubConnection
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=open(os.devnull, 'w'),
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Suite(object):
+    def __init__(self, repeat=1):
+        '''
+        Runs benchmark stages and collects their results. Each
+        stage is run repeat times and the fastest run is kept.
+        '''
+        self.repeat = repeat
+        self.instrumentation = Instrumentation(log_level=None)
+        self.results = []
+
+    def measure(self, stage, function, label=None, rows_in=None, count=len):
+        '''
+        Times function() as a stage. count turns its output into
+        the stage's rows_out, or None to leave rows_out empty.
+        Returns the output of the last run.
+        '''
+        best = None
+
+        for run in range(self.repeat):
+            output = None
+            gc.collect()
+
+            with self.instrumentation.stage(stage, label, rows_in) as stats:
+                output = function()
+                if count is not None:
+                    stats.rows_out = count(output)
+
+            if best is None or stats.seconds < best.seconds:
+                best = stats
+
+        self.results.append(best)
+
+        print '{stage:<24} {label:<20} {seconds:>8.3f}s {rate:>12} rows/s  peak {peak:>7.1f}MB (+{growth:.1f}MB)'.format(
+            stage=stage, label=label or '', seconds=best.seconds,
+            rate='{rate:.0f}'.format(rate=best.rows_per_second) if best.rows_per_second else '-',
+            peak=(best.peak_memory or 0) / (1024.0 * 1024),
+            growth=(best.memory_growth or 0) / (1024.0 * 1024),
+        )
+
+        return output
+
+def run(args):
+    schema = build_schema(args.columns, args.related_tables)
+    header, dtypes = schema_header(schema)
+
+    directory = args.directory or tempfile.mkdtemp(prefix='wextractor-benchmark-')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    suite = Suite(args.repeat)
+
+    try:
+        lines = generate_lines(args.rows, args.columns, args.duplication, args.related_tables, args.seed)
+        csv_path = write_csv(os.path.join(directory, 'contracts.csv'), lines, header)
+        workbook_path = None if args.skip_excel else write_workbook(
+            os.path.join(directory, 'contracts.xls'), lines, header
+        )
+        del lines
+
+        rows = suite.measure('csv_extract', lambda: CsvExtractor(
+            csv_path, url=False, dtypes=dtypes
+        ).extract(), os.path.basename(csv_path))
+
+        if workbook_path is not None:
+            suite.measure('excel_extract', lambda: ExcelExtractor(
+                workbook_path, dtypes=dtypes
+            ).extract(), os.path.basename(workbook_path))
+
+        loader = PostgresLoader(
+            {'database': 'benchmark', 'user': 'benchmark'}, schema,
+            instrumentation=Instrumentation(log_level=None)
+        )
+
+        suite.measure(
+            'transform_to_schema', lambda: loader.transform_to_schema(rows, True),
+            rows_in=len(rows), count=lambda tables: sum(len(table) for table in tables)
+        )
+
+        tables = [list() for table in schema]
+        loader.transform_rows(rows, True, [table.append for table in tables])
+
+        deduped = []
+        for ix, table in enumerate(tables):
+            deduped.append(suite.measure(
+                'dedupe', lambda: loader.simple_dedupe(ix, table, True),
+                schema[ix]['table_name'], rows_in=len(table)
+            ))
+        del tables
+
+        for ix, table in enumerate(deduped):
+            tmp_file = suite.measure(
+                'tempfile', lambda: loader.generate_data_tempfile(table)[0],
+                schema[ix]['table_name'], rows_in=len(table), count=None
+            )
+            suite.results[-1].bytes_written = os.fstat(tmp_file.fileno()).st_size
+            tmp_file.close()
+        del deduped
+
+        if args.database:
+            connection_params = {'database': args.database, 'user': args.user}
+            if args.host:
+                connection_params['host'] = args.host
+            loader = PostgresLoader(connection_params, schema, instrumentation=Instrumentation(log_level=None))
+            target = 'postgres'
+        else:
+            loader = PostgresLoader(
+                {'database': 'benchmark', 'user': 'benchmark'}, schema, connection=StubConnection(),
+                instrumentation=Instrumentation(log_level=None)
+            )
+            target = 'stub'
+
+        suite.measure('load', lambda: loader.load(rows, True), target, rows_in=len(rows), count=None)
+        suite.results[-1].bytes_written = loader.instrumentation.totals()['copy'].bytes_written
+
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    return {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'rows': args.rows,
+            'columns': args.columns,
+            'duplication': args.duplication,
+            'related_tables': args.related_tables,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'workbook': os.path.splitext(workbook_path)[1][1:] if workbook_path else None,
+            'database': 'postgres' if args.database else 'stub',
+        },
+        'stages': [stats.as_dict() for stats in suite.results],
+    }
+
+def compare(old, new):
+    '''
+    Prints the change in rows/sec and peak memory of every stage
+    that two result files have in common
+    '''
+    old_stages = dict(((stage['stage'], stage['label']), stage) for stage in old['stages'])
+
+    print 'comparing {old} with {new}'.format(old=old.get('revision'), new=new.get('revision'))
+
+    for stage in new['stages']:
+        before = old_stages.get((stage['stage'], stage['label']))
+        if before is None or not before['rows_per_second'] or not stage['rows_per_second']:
+            continue
+
+        print '{stage:<24} {label:<20} {old:>12.0f} -> {new:>12.0f} rows/s ({change:+.1f}%), peak {old_peak:.1f}MB -> {new_peak:.1f}MB'.format(
+            stage=stage['stage'], label=stage['label'] or '',
+            old=before['rows_per_second'], new=stage['rows_per_second'],
+            change=(stage['rows_per_second'] / before['rows_per_second'] - 1) * 100,
+            old_peak=(before['peak_memory'] or 0) / (1024.0 * 1024),
+            new_peak=(stage['peak_memory'] or 0) / (1024.0 * 1024),
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=10, help='number of columns in the contract table')
+    parser.add_argument('--duplication', type=float, default=0.2, help='share of lines that repeat an earlier line')
+    parser.add_argument('--related-tables', type=int, default=2, help='number of tables besides contract')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the fastest is kept')
+    parser.add_argument('--skip-excel', action='store_true')
+    parser.add_argument('--directory', help='keep the generated files here')
+    parser.add_argument('--database')
+    parser.add_argument('--user')
+    parser.add_argument('--host')
+    parser.add_argument('--output', help='defaults to benchmarks/results/<revision>.json')
+    parser.add_argument('--compare', nargs='+', metavar='RESULTS', help='compare a results file with a new run, or two results files')
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare takes one or two results files')
+    elif args.compare and len(args.compare) == 2:
+        compare(*[json.load(open(path)) for path in args.compare])
+        return
+
+    if args.database and not args.user:
+        parser.error('--database needs a --user')
+
+    results = run(args)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, '{revision}.json'.format(
+        revision=results['revision'] or time.strftime('%Y%m%d%H%M%S')
+    ))
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+    print 'saved results to {output}'.format(output=output)
+
+    if args.compare:
+        compare(json.load(open(args.compare[0])), results)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,7 +25,7 @@ setup(
     description='Extract flat data and load it as relational data',
     long_description=long_description,
 
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks*']),
     install_requires=required,
     classifiers=[
         'Development Status :: 3 - Alpha',
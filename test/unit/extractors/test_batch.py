@@ -0,0 +1,67 @@
+import unittest
+import datetime
+import cPickle
+from StringIO import StringIO
+from mock import patch
+
+from wextractor.extractors import CsvExtractor, ExcelExtractor, extract_many, ExtractionError
+
+class TestExtractMany(unittest.TestCase):
+    def setUp(self):
+        self.csv = CsvExtractor('./test/mock/csv/file.csv', url=False)
+        self.excel = ExcelExtractor(
+            './test/mock/excel/excel.xlsx', dtypes=[int, unicode, datetime.datetime, bool]
+        )
+
+    def test_extract_many(self):
+        '''
+        Tests that every source is extracted and paired with its own rows
+        '''
+        results = dict(extract_many([self.csv, self.excel], workers=2))
+
+        self.assertEquals(results[self.csv], self.csv.extract())
+        self.assertEquals(results[self.excel], self.excel.extract())
+
+    def test_errors_are_captured(self):
+        '''
+        Tests that a failing source doesn't stop the rest of the batch
+        '''
+        missing = CsvExtractor('./test/mock/csv/missing.csv', url=False)
+        results = dict(extract_many([missing, self.csv]))
+
+        self.assertEquals(results[self.csv], self.csv.extract())
+        self.assertTrue(isinstance(results[missing], ExtractionError))
+        self.assertTrue(results[missing].message.startswith('IOError'))
+        self.assertTrue(results[missing].source is missing)
+
+    def test_unpicklable_sources(self):
+        '''
+        Tests that a source that can't be sent to a worker process
+        is reported as an error instead of hanging the batch
+        '''
+        unpicklable = CsvExtractor('./test/mock/csv/file.csv', url=False, dtypes=[lambda x: x] * 3)
+        results = dict(extract_many([unpicklable, self.csv], workers=2))
+
+        self.assertEquals(results[self.csv], self.csv.extract())
+        self.assertTrue(isinstance(results[unpicklable], ExtractionError))
+        self.assertTrue(results[unpicklable].message.startswith('PicklingError'))
+
+    @patch('wextractor.extractors.csv_extractor.open_url')
+    def test_urls_use_threads(self, open_url):
+        '''
+        Tests that url sources are extracted in this process
+        '''
+        open_url.return_value = (StringIO('foo,bar\n1,2\n'), None)
+        remote = CsvExtractor('http://example.com/file.csv', url=True)
+
+        results = list(extract_many([remote]))
+
+        self.assertEquals(results, [(remote, [{'foo': '1', 'bar': '2'}])])
+        assert open_url.called
+
+    def test_extraction_error_pickles(self):
+        '''
+        Tests that errors survive being sent between processes
+        '''
+        error = cPickle.loads(cPickle.dumps(ExtractionError('source', 'IOError: nope', 'details'), 2))
+        self.assertEquals((error.source, error.message, error.details), ('source', 'IOError: nope', 'details'))
@@ -0,0 +1,177 @@
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import unittest
+from hashlib import md5
+from StringIO import StringIO
+from mock import patch, Mock
+
+from wextractor.extractors import CsvExtractor, ExcelExtractor, ExtractionCache
+from wextractor.extractors.cache import stable_repr
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ExtractionCache(os.path.join(self.directory, 'cache'))
+
+        self.source = os.path.join(self.directory, 'file.csv')
+        shutil.copy('./test/mock/csv/file.csv', self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unchanged_sources_hit(self):
+        '''
+        Tests that a second extraction comes from the cache
+        '''
+        extractor = CsvExtractor(self.source, dtypes=[str, int, int])
+        expected = extractor.extract()
+
+        self.assertEquals(self.cache.extract(extractor), expected)
+        with patch.object(extractor, 'extract') as extract:
+            self.assertEquals(self.cache.extract(extractor), expected)
+            assert not extract.called
+
+        self.assertEquals((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_file_url_fingerprints(self):
+        '''
+        Tests that file:// urls are fingerprinted like the path they point to
+        '''
+        self.assertEquals(
+            self.cache.source_fingerprint(CsvExtractor('file://' + self.source)),
+            self.cache.source_fingerprint(CsvExtractor(self.source))
+        )
+
+    def test_changes_miss(self):
+        '''
+        Tests that changed files and different settings are extracted again
+        '''
+        self.cache.extract(CsvExtractor(self.source))
+
+        self.cache.extract(CsvExtractor(self.source, dtypes=[str, int, int]))
+        self.assertEquals(self.cache.misses, 2)
+
+        with open(self.source, 'ab') as source:
+            source.write('quuuux,1000,2000\n')
+        rows = self.cache.extract(CsvExtractor(self.source))
+
+        self.assertEquals(self.cache.misses, 3)
+        self.assertEquals(rows[-1]['foo'], 'quuuux')
+
+    def test_excel_arguments(self):
+        '''
+        Tests that extract arguments that change the output are part of the key
+        '''
+        extractor = ExcelExtractor('./test/mock/excel/excel.xlsx')
+        self.assertEquals(self.cache.key(extractor), self.cache.key(extractor, workers=2))
+        self.assertNotEqual(self.cache.key(extractor), self.cache.key(extractor, sheets=0))
+
+    def test_stable_repr(self):
+        '''
+        Tests that dtypes are represented by name
+        '''
+        self.assertEquals(
+            stable_repr([int, unicode, datetime.datetime]),
+            '[__builtin__.int, __builtin__.unicode, datetime.datetime]'
+        )
+        self.assertEquals(stable_repr({'b': 1, 'a': (2,)}), "{'a': [2], 'b': 1}")
+
+    def test_stable_repr_callables(self):
+        '''
+        Tests that callables with the same name but different code or
+        closures are told apart, and that the same function isn't
+        '''
+        def scale(factor):
+            return lambda value: value * factor
+
+        first, second = lambda value: value, lambda value: value.strip()
+        self.assertEquals(first.__name__, second.__name__)
+        self.assertNotEqual(stable_repr(first), stable_repr(second))
+        self.assertNotEqual(stable_repr(scale(2)), stable_repr(scale(3)))
+        self.assertEquals(stable_repr(scale(2)), stable_repr(scale(2)))
+        self.assertEquals(stable_repr(datetime.datetime.strptime), stable_repr(datetime.datetime.strptime))
+
+    def test_different_callables_miss(self):
+        '''
+        Tests that two dtypes lambdas aren't served each other's rows
+        '''
+        self.cache.extract(CsvExtractor(self.source, dtypes=[lambda value: value, int, int]))
+        rows = self.cache.extract(CsvExtractor(self.source, dtypes=[lambda value: value.upper(), int, int]))
+
+        self.assertEquals(self.cache.misses, 2)
+        self.assertEquals(rows[0]['foo'], 'QUX')
+
+    @patch('wextractor.extractors.cache.CACHE_FORMAT', 2)
+    def test_cache_format_in_key(self):
+        extractor = CsvExtractor(self.source)
+        key = self.cache.key(extractor)
+
+        with patch('wextractor.extractors.cache.CACHE_FORMAT', 3):
+            self.assertNotEqual(self.cache.key(extractor), key)
+
+    @patch('wextractor.extractors.cache.http_request')
+    def test_url_fingerprints(self, http_request):
+        '''
+        Tests that urls are fingerprinted by their headers, or their content
+        '''
+        response = Mock()
+        response.getheader.side_effect = lambda name: {'etag': '"abc"'}.get(name)
+        http_request.return_value = (Mock(), response)
+
+        extractor = CsvExtractor('http://example.com/file.csv', url=True)
+        self.assertEquals(
+            self.cache.source_fingerprint(extractor),
+            ('url', 'http://example.com/file.csv', '"abc"', None)
+        )
+
+        response.getheader.side_effect = lambda name: None
+        with patch.object(extractor, 'open_stream', return_value=(StringIO('foo\n1\n'), None)):
+            self.assertEquals(
+                self.cache.source_fingerprint(extractor),
+                ('url', 'http://example.com/file.csv', md5('foo\n1\n').hexdigest())
+            )
+
+    def test_lru_eviction(self):
+        '''
+        Tests that the least recently used entries are evicted first
+        '''
+        extractors = []
+        for i in range(3):
+            path = os.path.join(self.directory, '{i}.csv'.format(i=i))
+            shutil.copy(self.source, path)
+            extractors.append(CsvExtractor(path))
+
+        self.cache.extract(extractors[0])
+        self.cache.extract(extractors[1])
+        entry_size = self.cache.size() // 2
+        self.cache.max_bytes = entry_size * 2
+
+        # use the first entry again so that the second is the oldest
+        old = time.time() - 100
+        for last_used, size, path in self.cache.entries():
+            os.utime(path, (old, old))
+        self.cache.extract(extractors[0])
+        self.cache.extract(extractors[2])
+
+        self.assertEquals(len(self.cache.entries()), 2)
+        self.cache.extract(extractors[0])
+        self.assertEquals(self.cache.hits, 2)
+        self.cache.extract(extractors[1])
+        self.assertEquals(self.cache.misses, 4)
+
+    def test_corrupt_entries(self):
+        '''
+        Tests that unreadable entries are treated as misses
+        '''
+        extractor = CsvExtractor(self.source)
+        self.cache.extract(extractor)
+
+        path = self.cache.entries()[0][2]
+        with open(path, 'wb') as entry:
+            entry.write('\x80\x02garbage')
+
+        self.assertEquals(self.cache.extract(extractor), extractor.extract())
+        self.assertEquals(self.cache.misses, 2)
@@ -0,0 +1,94 @@
+import unittest
+import datetime
+from nose.plugins.skip import SkipTest
+from wextractor.extractors import CsvExtractor, ExcelExtractor
+from wextractor.extractors import coercion
+from wextractor.extractors.coercion import (
+    ColumnarCoercer, compile_converter, compile_typed_converter, numpy_coerce
+)
+
+class TestCoercion(unittest.TestCase):
+    def test_converter_drops_failures(self):
+        '''
+        Tests that compiled converters return None on failure
+        '''
+        to_int = compile_converter(int)
+        self.assertEquals(to_int('10'), 10)
+        self.assertEquals(to_int(''), None)
+        self.assertEquals(to_int(None), None)
+
+    def test_typed_converter(self):
+        '''
+        Tests that typed converters keep matching types and never coerce bools
+        '''
+        to_bool = compile_typed_converter(bool)
+        self.assertEquals(to_bool(True), True)
+        self.assertEquals(to_bool(1.0), None)
+
+        to_date = compile_typed_converter(datetime.datetime)
+        self.assertEquals(to_date(1234.0), None)
+
+    def test_coerce_rows_matches_transform_row(self):
+        '''
+        Tests that the columnar path gives the same rows as the row path
+        '''
+        extractor = CsvExtractor('./test/mock/csv/file.csv', url=False, dtypes=[str, int, float])
+        header = ['foo', 'bar', 'baz']
+        rows = [['qux', '1', '2'], ['quux', '', 'x'], ['quuux', '1.5', '3e2']]
+
+        coercer = ColumnarCoercer(extractor.dtypes)
+        self.assertEquals(
+            coercer.coerce_rows(header, rows),
+            [extractor.transform_row(header, row) for row in rows]
+        )
+
+    def test_coerce_ragged_rows(self):
+        '''
+        Tests that rows of different lengths still coerce
+        '''
+        coercer = ColumnarCoercer([int, int])
+        self.assertEquals(
+            coercer.coerce_rows(['a', 'b'], [['1'], ['2', '3', '4']]),
+            [{'a': 1}, {'a': 2, 'b': 3}]
+        )
+
+    def test_numpy_coerce(self):
+        '''
+        Tests the vectorized int and float conversion and its fallbacks
+        '''
+        if coercion.numpy is None:
+            raise SkipTest('numpy is not installed')
+
+        self.assertEquals(numpy_coerce(int, ['1', '20']), [1, 20])
+        self.assertEquals(numpy_coerce(float, [1, 2]), [1.0, 2.0])
+        self.assertEquals(numpy_coerce(int, [1.7, float('nan')]), None)
+        self.assertEquals(numpy_coerce(int, ['1', '']), None)
+        self.assertEquals(numpy_coerce(int, ['1', 2]), None)
+
+        coercer = ColumnarCoercer([int, float], use_numpy=True)
+        self.assertEquals(
+            coercer.coerce_rows(['a', 'b'], [['1', ''], ['x', '2.5']]),
+            [{'a': 1, 'b': None}, {'a': None, 'b': 2.5}]
+        )
+
+    def test_columnar_csv_extract(self):
+        '''
+        Tests that columnar csv extraction matches the default path
+        '''
+        dtypes = [str, int, int]
+        extractor = CsvExtractor('./test/mock/csv/file.csv', url=False, dtypes=dtypes)
+        columnar = CsvExtractor(
+            './test/mock/csv/file.csv', url=False, dtypes=dtypes, columnar=True, block_size=3
+        )
+        self.assertEquals(columnar.extract(), extractor.extract())
+
+    def test_columnar_excel_extract(self):
+        '''
+        Tests that columnar excel extraction matches the default path
+        '''
+        dtypes = [int, unicode, datetime.datetime, bool]
+        extractor = ExcelExtractor('./test/mock/excel/excel.xlsx', dtypes=dtypes)
+        columnar = ExcelExtractor(
+            './test/mock/excel/excel.xlsx', dtypes=dtypes, columnar=True, block_size=2
+        )
+        self.assertEquals(columnar.extract(), extractor.extract())
@@ -0,0 +1,149 @@
+import os
+import bz2
+import gzip
+import shutil
+import zipfile
+import tempfile
+import unittest
+from StringIO import StringIO
+from mock import patch
+from nose.tools import raises
+
+from wextractor.extractors import CsvExtractor
+from wextractor.extractors.compression import detect_compression, open_decompressed, DecompressingStream
+
+class Unseekable(object):
+    '''
+    A stream that can only be read, like a url response
+    '''
+    def __init__(self, data):
+        self.data = StringIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(size)
+
+    def close(self):
+        pass
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = open('./test/mock/csv/file.csv', 'rb').read()
+        self.expected = CsvExtractor('./test/mock/csv/file.csv', url=False).extract()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_zip(self, name, members):
+        archive = zipfile.ZipFile(self.path(name), 'w', zipfile.ZIP_DEFLATED)
+        for member in members:
+            archive.writestr(member, self.data)
+        archive.close()
+        return self.path(name)
+
+    def test_detect_compression(self):
+        '''
+        Tests that magic bytes win over extensions, which are used for empty heads
+        '''
+        self.assertEquals(detect_compression('file.csv', '\x1f\x8b\x08'), 'gzip')
+        self.assertEquals(detect_compression('file.csv', 'BZh91AY&SY'), 'bz2')
+        self.assertEquals(detect_compression('file.csv', 'BZh9,foo'), None)
+        self.assertEquals(detect_compression('file.csv', 'PK\x03\x04'), 'zip')
+        self.assertEquals(detect_compression('file.csv.gz', 'foo,bar'), None)
+        self.assertEquals(detect_compression('http://example.com/file.CSV.BZ2?raw=1'), 'bz2')
+        self.assertEquals(detect_compression('file.csv'), None)
+
+    def test_gzip(self):
+        '''
+        Tests that gzipped files are extracted as they are read, in tiny chunks
+        '''
+        compressed = gzip.open(self.path('file.csv.gz'), 'wb')
+        compressed.write(self.data)
+        compressed.close()
+
+        extractor = CsvExtractor(self.path('file.csv.gz'), chunk_size=3)
+        self.assertEquals(extractor.extract(), self.expected)
+
+    def test_bz2(self):
+        '''
+        Tests that bz2 files are extracted without their extension
+        '''
+        compressed = bz2.BZ2File(self.path('export'), 'wb')
+        compressed.write(self.data)
+        compressed.close()
+
+        self.assertEquals(CsvExtractor(self.path('export')).extract(), self.expected)
+
+    def test_bz2_lookalike(self):
+        '''
+        Tests that a plain csv whose header starts with BZh isn't read as bz2
+        '''
+        with open(self.path('file.csv'), 'wb') as f:
+            f.write('BZh9,bar\n1,2\n')
+
+        extractor = CsvExtractor(self.path('file.csv'), chunk_size=3)
+        self.assertEquals(extractor.extract(), [{'BZh9': '1', 'bar': '2'}])
+
+    def test_concatenated_streams(self):
+        '''
+        Tests that files made of several compressed streams are read to the end
+        '''
+        for compress in (bz2.compress, lambda data: gzip_bytes(data)):
+            half = len(self.data) // 2
+            stream = StringIO(compress(self.data[:half]) + compress(self.data[half:]))
+            self.assertEquals(open_decompressed(stream, 'data', chunk_size=5).read(), self.data)
+
+    def test_zip_members(self):
+        '''
+        Tests that each file in a zip archive is its own source
+        '''
+        path = self.write_zip('bundle.zip', ['a.csv', 'b/c.csv', '__MACOSX/._a.csv'])
+
+        members = CsvExtractor(path, url=False).members()
+
+        self.assertEquals([member.member for member in members], ['a.csv', 'b/c.csv'])
+        for member in members:
+            self.assertEquals(member.target, path)
+            self.assertEquals(member.extract(), self.expected)
+
+    def test_single_member_zip(self):
+        '''
+        Tests that archives with one file can be extracted directly
+        '''
+        path = self.write_zip('one.zip', ['only.csv'])
+        self.assertEquals(CsvExtractor(path).extract(), self.expected)
+
+    @raises(Exception)
+    def test_ambiguous_zip(self):
+        '''
+        Tests that archives with several files need a member
+        '''
+        CsvExtractor(self.write_zip('two.zip', ['a.csv', 'b.csv'])).extract()
+
+    @patch('wextractor.extractors.csv_extractor.open_url')
+    def test_remote_zip(self, open_url):
+        '''
+        Tests that zip archives from urls are spooled so they can be read
+        '''
+        path = self.write_zip('remote.zip', ['a.csv', 'b.csv'])
+        open_url.side_effect = lambda url: (Unseekable(open(path, 'rb').read()), None)
+
+        extractor = CsvExtractor('http://example.com/remote.zip', url=True, member='b.csv')
+        self.assertEquals(extractor.extract(), self.expected)
+
+    def test_uncompressed_passthrough(self):
+        '''
+        Tests that plain data comes through untouched in any chunk size
+        '''
+        stream = DecompressingStream(StringIO(self.data[4:]), None, self.data[:4])
+        self.assertEquals(stream.read(2) + stream.read(), self.data)
+
+def gzip_bytes(data):
+    output = StringIO()
+    compressed = gzip.GzipFile(fileobj=output, mode='wb')
+    compressed.write(data)
+    compressed.close()
+    return output.getvalue()
@@ -1,8 +1,16 @@
+import os
+import socket
+import pstats
+import tempfile
 import unittest
 import datetime
+import types
+from StringIO import StringIO
 from wextractor.extractors import CsvExtractor
+from wextractor.extractors import csv_extractor
+from wextractor.instrumentation import Instrumentation
 from nose.tools import raises
-from mock import patch
+from mock import patch, Mock
 
 class TestCsvExtractor(unittest.TestCase):
     def setUp(self):
@@ -16,6 +24,13 @@ class TestCsvExtractor(unittest.TestCase):
         quuux | 100 | 200
         '''
         self.extractor = CsvExtractor('./test/mock/csv/file.csv', url=False)
+        csv_extractor._url_cache.clear()
+
+    def mock_response(self, status, body=''):
+        response = StringIO(body)
+        response.status = status
+        response.isclosed = lambda: response.tell() == len(body)
+        return response
 
     @raises(TypeError)
     def test_bad_url_arg(self):
@@ -30,10 +45,13 @@ class TestCsvExtractor(unittest.TestCase):
         '''
         self.assertEquals(self.extractor.url, False)
 
-    def test_detect_urls(self):
+    @patch('wextractor.extractors.csv_extractor.http_request')
+    def test_detect_urls(self, http_request):
         '''
         Tests if self.url is assigned properly
         '''
+        http_request.side_effect = lambda method, url: (Mock(), self.mock_response(200))
+
         url1 = 'github.com/codeforamerica/w-drive-extractor'
         url2 = 'http://github.com/codeforamerica/w-drive-extractor'
         url3 = '/path/to/a/file.csv'
@@ -42,14 +60,91 @@ class TestCsvExtractor(unittest.TestCase):
         self.assertTrue(CsvExtractor(url2).url)
         self.assertFalse(CsvExtractor(url3).url)
 
+        self.assertEquals(http_request.call_args_list[0][0], ('HEAD', 'http://' + url1))
+        # local paths never go to the network
+        self.assertEquals(http_request.call_count, 2)
+
+    @patch('wextractor.extractors.csv_extractor.http_request')
+    def test_local_paths_and_cache(self, http_request):
+        '''
+        Tests that local paths are recognized offline and that url checks are cached
+        '''
+        http_request.side_effect = lambda method, url: (Mock(), self.mock_response(404))
+
+        for target in ['./relative.csv', 'test/mock/csv/file.csv', 'file:///tmp/file.csv', 'C:\\data.csv']:
+            self.assertFalse(CsvExtractor(target).url)
+        self.assertFalse(http_request.called)
+
+        CsvExtractor('example.com/missing.csv')
+        CsvExtractor('example.com/missing.csv')
+        self.assertEquals(http_request.call_count, 1)
+
+    @patch('wextractor.extractors.csv_extractor.http_request')
+    def test_failed_url_checks_are_not_cached(self, http_request):
+        '''
+        Tests that network errors and server errors are checked again
+        '''
+        http_request.side_effect = socket.error('temporary failure in name resolution')
+        self.assertFalse(CsvExtractor('example.com/file.csv').url)
+
+        http_request.side_effect = lambda method, url: (Mock(), self.mock_response(503))
+        self.assertFalse(CsvExtractor('example.com/file.csv').url)
+
+        http_request.side_effect = lambda method, url: (Mock(), self.mock_response(200))
+        self.assertTrue(CsvExtractor('example.com/file.csv').url)
+        self.assertTrue(CsvExtractor('example.com/file.csv').url)
+        self.assertEquals(http_request.call_count, 3)
+
+    @patch('wextractor.extractors.csv_extractor.URL_CACHE_SIZE', 2)
+    @patch('wextractor.extractors.csv_extractor.http_request')
+    def test_url_cache_is_bounded(self, http_request):
+        http_request.side_effect = lambda method, url: (Mock(), self.mock_response(404))
+
+        for target in ['example.com/a.csv', 'example.com/b.csv', 'example.com/c.csv']:
+            CsvExtractor(target)
+
+        self.assertEquals(csv_extractor._url_cache.keys(), ['example.com/b.csv', 'example.com/c.csv'])
+
     @patch('urllib2.urlopen')
-    def test_urls_work(self, urlopen):
+    @patch('wextractor.extractors.csv_extractor.http_request')
+    def test_urls_work(self, http_request, urlopen):
         '''
         Tests to see if using a url arg works as expected
         '''
+        conn = Mock()
+        http_request.side_effect = lambda method, url: (conn, self.mock_response(200, 'foo,bar\n1,2\n'))
+
         extractor = CsvExtractor('github.com/codeforamerica/w-drive-extractor')
-        extractor.extract()
-        assert urlopen.called
+        self.assertEquals(extractor.extract(), [{'foo': '1', 'bar': '2'}])
+
+        # the HEAD and the GET go over the same keep-alive connection
+        self.assertEquals(
+            [call[0][0] for call in http_request.call_args_list], ['HEAD', 'GET']
+        )
+        assert not urlopen.called
+        assert not conn.close.called
+
+    @patch('urllib2.urlopen')
+    @patch('wextractor.extractors.csv_extractor.http_request')
+    def test_redirects_use_urllib2(self, http_request, urlopen):
+        '''
+        Tests that redirected urls are followed with urllib2
+        '''
+        http_request.return_value = (Mock(), self.mock_response(302))
+        urlopen.return_value = StringIO('foo,bar\n1,2\n')
+
+        extractor = CsvExtractor('http://example.com/moved.csv', url=True)
+        self.assertEquals(extractor.extract(), [{'foo': '1', 'bar': '2'}])
+        urlopen.assert_called_with('http://example.com/moved.csv')
+
+    def test_keep_alive_connections(self):
+        '''
+        Tests that connections are reused per host and scheme
+        '''
+        conn = csv_extractor.keep_alive_connection('https', 'example.com')
+        self.assertTrue(conn is csv_extractor.keep_alive_connection('https', 'example.com'))
+        self.assertFalse(conn is csv_extractor.keep_alive_connection('http', 'example.com'))
+        self.assertTrue(isinstance(conn, csv_extractor.httplib.HTTPSConnection))
 
     def test_csv_extract(self):
         '''
@@ -63,6 +158,49 @@ class TestCsvExtractor(unittest.TestCase):
                 ['bar', 'baz', 'foo']
             )
 
+    def test_file_urls(self):
+        '''
+        Tests that file:// urls are read from the path they point to
+        '''
+        path = os.path.abspath('./test/mock/csv/file.csv')
+        extractor = CsvExtractor('file://' + path)
+
+        self.assertFalse(extractor.url)
+        self.assertEquals(extractor.extract(), self.extractor.extract())
+        self.assertEquals(csv_extractor.local_path('file://' + path), path)
+        self.assertEquals(csv_extractor.local_path('./test/mock/csv/file.csv'), './test/mock/csv/file.csv')
+
+    def test_extract_is_instrumented(self):
+        '''
+        Tests that extract records an extract stage for its target
+        '''
+        callback = Mock()
+        extractor = CsvExtractor(
+            './test/mock/csv/file.csv', url=False,
+            instrumentation=Instrumentation([callback], log_level=None)
+        )
+        extractor.extract()
+
+        stats = callback.call_args[0][0]
+        self.assertEquals((stats.stage, stats.label, stats.rows_out), ('extract', './test/mock/csv/file.csv', 4))
+
+    def test_profiled_extract(self):
+        '''
+        Tests that extract(profile=path) writes a profile to that path
+        '''
+        handle, path = tempfile.mkstemp(suffix='.pstats')
+        os.close(handle)
+
+        try:
+            data = self.extractor.extract(profile=path)
+
+            self.assertEquals(len(data), 4)
+            assert 'iter_extract' in [key[2] for key in pstats.Stats(path).stats]
+            assert 'extract' in open(path[:-len('.pstats')] + '.txt').read()
+        finally:
+            os.remove(path)
+            os.remove(path[:-len('.pstats')] + '.txt')
+
     def test_csv_headers_work(self):
         '''
         Tests that csv extractors work when you have headers
@@ -100,3 +238,34 @@ class TestCsvExtractor(unittest.TestCase):
         self.assertEquals(data[0]['col2'], 'hello')
         self.assertEquals(data[0]['col3'], 'first name, last name')
         self.assertEquals(data[0]['col4'], 'world')
+
+    def test_iter_extract_is_lazy(self):
+        '''
+        Tests that iter_extract yields the same rows as extract
+        '''
+        rows = self.extractor.iter_extract()
+        self.assertTrue(isinstance(rows, types.GeneratorType))
+        self.assertEquals(list(rows), self.extractor.extract())
+
+    def test_iter_lines_line_endings(self):
+        '''
+        Tests that BOMs and mixed line endings are standardized,
+        including \\r\\n pairs that are split across chunks
+        '''
+        extractor = CsvExtractor('./test/mock/csv/file.csv', url=False, chunk_size=4)
+        stream = StringIO('\xef\xbb\xbfab\r\ncd\ref\r\r\ngh\r')
+        self.assertEquals(
+            list(extractor.iter_lines(stream)),
+            ['ab\n', 'cd\n', 'ef\n', '\n', 'gh\n']
+        )
+
+    def test_iter_lines_bom_in_small_chunks(self):
+        '''
+        Tests that a BOM read over one or more chunks doesn't end the file
+        '''
+        for chunk_size in (1, 2, 3):
+            extractor = CsvExtractor('./test/mock/csv/file.csv', url=False, chunk_size=chunk_size)
+            stream = StringIO('\xef\xbb\xbfab\ncd\n')
+            self.assertEquals(list(extractor.iter_lines(stream)), ['ab\n', 'cd\n'])
+        self.assertEquals(list(extractor.iter_lines(StringIO('\xef\xbb\xbf'))), [])
+        self.assertEquals(list(extractor.iter_lines(StringIO('a'))), ['a\n'])
@@ -1,6 +1,8 @@
 import unittest
 import datetime
+from mock import Mock, patch
 from wextractor.extractors import ExcelExtractor
+from wextractor.extractors.excel_extractor import extract_sheet_rows
 from nose.tools import raises
 
 class TestExcelExtractor(unittest.TestCase):
@@ -95,5 +97,54 @@ class TestExcelExtractor(unittest.TestCase):
                 ['bool_col', 'date_col', 'number_col', 'str_col']
             )
 
+    def test_parallel_extract(self):
+        '''
+        Tests that extracting with a pool of workers gives the same
+        output as the serial path, including when sheets are split
+        '''
+        self.assertEquals(self.extractor.extract(workers=2), self.data)
+        self.assertEquals(self.extractor.extract(workers=2, rows_per_task=1), self.data)
+
+        columnar = ExcelExtractor(
+            './test/mock/excel/excel.xlsx', dtypes=[int, unicode, datetime.datetime, bool],
+            columnar=True
+        )
+        self.assertEquals(columnar.extract(workers=2, rows_per_task=2), self.data)
+
+    def test_xlsx_tasks_are_whole_sheets(self):
+        '''
+        Tests that .xlsx workbooks, which are parsed in full on
+        every open, aren't split into row ranges
+        '''
+        tasks = self.extractor.parallel_tasks(rows_per_task=1)
+        self.assertEquals([task[1:] for task in tasks], [(u'Sheet1', tasks[0][2], 1, 4)])
+
+    @patch('xlrd.open_workbook')
+    def test_workers_release_workbooks(self, open_workbook):
+        '''
+        Tests that a worker releases its workbook, even when it fails
+        '''
+        extractor = Mock()
+        extractor.iter_sheet_rows.side_effect = ValueError
+
+        self.assertRaises(ValueError, extract_sheet_rows, (extractor, 'Sheet1', [], 1, 2))
+        assert open_workbook.return_value.release_resources.called
+
+    def test_iter_extract(self):
+        '''
+        Tests that lazy extraction yields the same rows and that
+        sheets can be selected by name or index
+        '''
+        self.assertEquals(list(self.extractor.iter_extract()), self.data)
+        self.assertEquals(list(self.extractor.iter_extract(sheets=0)), self.data)
+        self.assertEquals(self.extractor.extract(sheets=['Sheet1']), self.data)
+
+    @raises(Exception)
+    def test_bad_sheet_name(self):
+        '''
+        Tests that selecting a sheet that doesn't exist raises
+        '''
+        self.extractor.extract(sheets='not a sheet')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
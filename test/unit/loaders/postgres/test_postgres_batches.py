@@ -0,0 +1,58 @@
+import json
+import unittest
+from mock import patch
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresBatches(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    def test_iter_batches_dedupes_across_batches(self):
+        '''
+        Tests that streaming batches yield the same deduplicated
+        rows as transforming everything at once
+        '''
+        batches = list(self.loader.iter_batches(iter(self.data), True, 2))
+        self.assertEquals(len(batches), 3)
+
+        transformed = self.loader.transform_to_schema(self.data, True)
+        for ix, table in enumerate(transformed):
+            col_names = [i[0] for i in self.schema[ix]['columns']]
+            streamed = [row for batch in batches for row in batch[ix]]
+            self.assertEquals(len(streamed), len(table))
+            self.assertEquals(
+                sorted([row[i] for i in col_names] for row in streamed),
+                sorted([row[i] for i in col_names] for row in table)
+            )
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_batched_load_copies_incrementally(self, connect):
+        '''
+        Tests that a batched load issues one COPY per table per batch
+        '''
+        cursor = connect.return_value.cursor.return_value
+        self.loader.load(iter(self.data), True, batch_size=2)
+
+        # batches 1 and 2 have new rows for both tables, batch 3 only for foo
+        self.assertEquals(cursor.copy_from.call_count, 5)
+        assert connect.return_value.commit.called
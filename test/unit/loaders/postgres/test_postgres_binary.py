@@ -0,0 +1,56 @@
+import json
+import unittest
+from mock import patch
+from nose.tools import raises
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresBinary(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_binary_load(self, connect):
+        '''
+        Tests that binary loads COPY typed PGCOPY data with copy_expert
+        '''
+        cursor = connect.return_value.cursor.return_value
+        self.loader.load(self.data, True, format='binary')
+
+        self.assertFalse(cursor.copy_from.called)
+        queries = sorted(call[0][0] for call in cursor.copy_expert.call_args_list)
+        self.assertEquals(queries, [
+            'COPY baz (row_id, baz, baz_id) FROM STDIN WITH (FORMAT binary)',
+            'COPY foo (row_id, bar, baz_id, foo, foo_id) FROM STDIN WITH (FORMAT binary)',
+        ])
+        self.assertEquals(self.loader.column_types(self.loader.plan[0], True), [
+            'INTEGER', 'VARCHAR(32)', 'INTEGER', 'VARCHAR(32)'
+        ])
+
+    @raises(Exception)
+    def test_binary_load_unsupported_type(self):
+        '''
+        Tests that binary loads refuse column types they can't encode
+        '''
+        self.schema[1]['columns'] = (('baz', 'NUMERIC'),)
+        loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+        loader.load(self.data, True, format='binary')
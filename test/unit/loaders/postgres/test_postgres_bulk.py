@@ -0,0 +1,89 @@
+import json
+import unittest
+from mock import patch
+from nose.tools import raises
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresBulk(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_bulk_load_defers_constraints(self, connect):
+        '''
+        Tests that a bulk load creates bare tables, then adds keys,
+        indexes and foreign keys after the COPY and analyzes
+        '''
+        self.schema[0]['index'] = ['foo', ('foo', 'bar')]
+        loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        cursor = connect.return_value.cursor.return_value
+        events = []
+        cursor.execute.side_effect = lambda query, *args: events.append(query)
+        cursor.copy_from.side_effect = lambda stream, table, **kwargs: events.append('COPY ' + table)
+
+        loader.load(self.data, True, bulk=True, unlogged=True, session_settings={
+            'synchronous_commit': 'off', 'maintenance_work_mem': '1GB'
+        })
+
+        self.assertEquals(events[:2], [
+            'SET LOCAL maintenance_work_mem = %s', 'SET LOCAL synchronous_commit = %s'
+        ])
+        creates = [query for query in events if query.startswith('CREATE UNLOGGED TABLE')]
+        self.assertEquals(len(creates), 2)
+        self.assertFalse([query for query in creates if 'PRIMARY KEY' in query])
+
+        self.assertEquals(events[-8:], [
+            'ALTER TABLE foo ADD PRIMARY KEY (foo_id)',
+            'CREATE INDEX foo_foo_idx ON foo (foo)',
+            'CREATE INDEX foo_foo_bar_idx ON foo (foo, bar)',
+            'CREATE INDEX foo_baz_id_idx ON foo (baz_id)',
+            'ALTER TABLE baz ADD PRIMARY KEY (baz_id)',
+            'ALTER TABLE foo ADD FOREIGN KEY (baz_id) REFERENCES baz',
+            'ANALYZE foo',
+            'ANALYZE baz',
+        ])
+        self.assertEquals(events[-10:-8], ['COPY foo', 'COPY baz'])
+        assert connect.return_value.commit.called
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_parallel_bulk_load(self, connect):
+        '''
+        Tests that bulk parallel loads swap in staging tables without a key
+        '''
+        cursor = connect.return_value.cursor.return_value
+        self.loader.load(self.data, True, workers=2, bulk=True)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertFalse([query for query in executed if query.startswith('ALTER INDEX')])
+        self.assertTrue(
+            executed.index('ALTER TABLE foo_staging RENAME TO foo') <
+            executed.index('ALTER TABLE foo ADD PRIMARY KEY (foo_id)')
+        )
+
+    @raises(Exception)
+    def test_bulk_incremental_load(self):
+        '''
+        Tests that bulk loads can't be incremental
+        '''
+        self.loader.load(self.data, True, bulk=True, incremental=True)
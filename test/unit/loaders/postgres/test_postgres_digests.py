@@ -0,0 +1,116 @@
+import json
+import unittest
+from mock import patch
+from nose.tools import raises
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresDigests(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    def test_table_digests(self):
+        '''
+        Tests that digests ignore row order but not contents or relationships
+        '''
+        digests = self.loader.table_digests(self.loader.transform_to_schema(self.data, True), True)
+        self.assertEquals([digest[1] for digest in digests], [5, 3])
+
+        # rows are reordered, but duplicates are still first seen with the same relationships
+        reordered = self.loader.table_digests(self.loader.transform_to_schema(self.data[3:] + self.data[:3], True), True)
+        self.assertEquals(reordered, digests)
+
+        moved = [dict(self.data[0], baz='xyz')] + self.data[1:]
+        changed = self.loader.table_digests(self.loader.transform_to_schema(moved, True), True)
+        # foo's rows are the same, but one of them points at a new baz
+        self.assertNotEqual(changed[0][0], digests[0][0])
+        self.assertEquals(changed[0][1], digests[0][1])
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_skip_unchanged_tables(self, connect):
+        '''
+        Tests that unchanged tables get no DDL or COPY, and that
+        children of reloaded tables are reloaded too
+        '''
+        cursor = connect.return_value.cursor.return_value
+        digests = self.loader.table_digests(self.loader.transform_to_schema(self.data, True), True)
+
+        cursor.fetchall.return_value = [('foo',) + digests[0], ('baz',) + digests[1]]
+        self.loader.load(self.data, True, skip_unchanged=True)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertFalse([query for query in executed if query.startswith('DROP') or query.startswith('INSERT')])
+        self.assertFalse(cursor.copy_from.called)
+        assert connect.return_value.commit.called
+
+        # baz changed, and foo points at it
+        cursor.reset_mock()
+        cursor.fetchall.return_value = [('foo',) + digests[0], ('baz', 'stale', 3, digests[1][2])]
+        self.loader.load(self.data, True, skip_unchanged=True)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEquals(
+            [query for query in executed if query.startswith('DROP')],
+            ['DROP TABLE IF EXISTS foo CASCADE', 'DROP TABLE IF EXISTS baz CASCADE']
+        )
+        self.assertTrue('ALTER TABLE foo ADD FOREIGN KEY (baz_id) REFERENCES baz' in executed)
+        inserted = [call[0][1] for call in cursor.execute.call_args_list if call[0][0].startswith('INSERT')]
+        self.assertEquals(inserted, [('foo',) + digests[0], ('baz',) + digests[1]])
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_loads_forget_digests(self, connect):
+        '''
+        Tests that ordinary loads remove stale digests, and only
+        look for the digest table until they find it
+        '''
+        cursor = connect.return_value.cursor.return_value
+
+        def digest_queries():
+            return [
+                call[0] for call in cursor.execute.call_args_list
+                if call[0][0].startswith('DELETE') or call[0][0].startswith('SELECT 1 FROM pg_class')
+            ]
+        check = (
+            "SELECT 1 FROM pg_class WHERE relname = %s AND relkind = 'r' AND pg_table_is_visible(oid)",
+            ('wextractor_table_digests',)
+        )
+        delete = ('DELETE FROM wextractor_table_digests WHERE table_name = ANY(%s)', (['foo', 'baz'],))
+
+        cursor.fetchone.return_value = None
+        self.loader.load(self.data, True)
+        self.assertEquals(digest_queries(), [check])
+
+        cursor.reset_mock()
+        cursor.fetchone.return_value = (1,)
+        self.loader.load(self.data, True)
+        self.assertEquals(digest_queries(), [check, delete])
+
+        cursor.reset_mock()
+        self.loader.load(self.data, True)
+        self.assertEquals(digest_queries(), [delete])
+
+    @raises(Exception)
+    def test_skip_unchanged_needs_memory(self):
+        '''
+        Tests that skip_unchanged can't be used with batches
+        '''
+        self.loader.load(self.data, True, batch_size=2, skip_unchanged=True)
@@ -0,0 +1,125 @@
+import json
+import unittest
+from mock import patch
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresIncremental(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    def test_generate_upsert_queries(self):
+        '''
+        Tests the queries used by incremental loads
+        '''
+        table = self.loader.table_definition(self.schema[1], True)
+        self.assertEquals(
+            self.loader.generate_incoming_table_query(table),
+            'CREATE TEMP TABLE baz_incoming (LIKE baz INCLUDING DEFAULTS) ON COMMIT DROP'
+        )
+        self.assertEquals(
+            self.loader.generate_delete_vanished_query(table),
+            'DELETE FROM baz WHERE NOT EXISTS (SELECT 1 FROM baz_incoming WHERE baz_incoming.baz_id = baz.baz_id)'
+        )
+        self.assertEquals(
+            self.loader.generate_upsert_query(table, ['baz', 'baz_id']),
+            'INSERT INTO baz (baz, baz_id) SELECT baz, baz_id FROM baz_incoming ON CONFLICT (baz_id) DO NOTHING'
+        )
+
+        table = self.loader.table_definition(self.schema[0], True)
+        self.assertEquals(
+            self.loader.generate_upsert_query(table, ['foo', 'bar', 'foo_id', 'baz_id'], ['baz_id']),
+            'INSERT INTO foo (foo, bar, foo_id, baz_id) SELECT foo, bar, foo_id, baz_id FROM foo_incoming '
+            'ON CONFLICT (foo_id) DO UPDATE SET baz_id = EXCLUDED.baz_id '
+            'WHERE (foo.baz_id) IS DISTINCT FROM (EXCLUDED.baz_id)'
+        )
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_incremental_load(self, connect):
+        '''
+        Tests that an incremental load never drops tables, inserts
+        parents first and then deletes children first
+        '''
+        cursor = connect.return_value.cursor.return_value
+        # pretend the foreign key already exists
+        cursor.fetchone.return_value = (1,)
+
+        self.loader.load(self.data, True, incremental=True)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertFalse([query for query in executed if query.startswith('DROP')])
+        self.assertFalse([query for query in executed if query.startswith('ALTER')])
+
+        deletes = [
+            query.split()[2] for query in executed
+            if query.startswith('DELETE') and 'wextractor_table_digests' not in query
+        ]
+        inserts = [query.split()[2] for query in executed if query.startswith('INSERT')]
+        self.assertEquals(inserts, ['baz', 'foo'])
+        self.assertEquals(deletes, ['foo', 'baz'])
+        assert executed.index([query for query in executed if query.startswith('INSERT')][-1]) < \
+            executed.index([query for query in executed if query.startswith('DELETE FROM foo')][0])
+
+        # rows that aren't in the new data are deleted
+        self.assertEquals(
+            [query for query in executed if query.startswith('DELETE FROM foo') or query.startswith('DELETE FROM baz')],
+            [
+                self.loader.generate_delete_vanished_query(self.loader.table_definition(table, True))
+                for table in self.schema
+            ]
+        )
+
+        copied = sorted(call[0][1] for call in cursor.copy_from.call_args_list)
+        self.assertEquals(copied, ['baz_incoming', 'foo_incoming'])
+        assert connect.return_value.commit.called
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_incremental_load_moves_children(self, connect):
+        '''
+        Tests that a child that moves to a new parent keeps its id,
+        has its foreign key updated, and is repointed before the
+        old parent is deleted
+        '''
+        copied = {}
+        def copy_from(stream, table, columns=None, **kwargs):
+            copied[table] = dict(zip(columns, stream.read().rstrip('\n').split('\t')))
+
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = (1,)
+        cursor.copy_from.side_effect = copy_from
+
+        self.loader.load([{'foo': 1, 'bar': 2, 'baz': 'abc'}], True, incremental=True)
+        before = copied['foo_incoming']
+
+        cursor.execute.reset_mock()
+        self.loader.load([{'foo': 1, 'bar': 2, 'baz': 'def'}], True, incremental=True)
+        after = copied['foo_incoming']
+
+        self.assertEquals(before['foo_id'], after['foo_id'])
+        self.assertNotEquals(before['baz_id'], after['baz_id'])
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        upsert = [ix for ix, query in enumerate(executed) if query.startswith('INSERT INTO foo ')][0]
+        delete = executed.index(self.loader.generate_delete_vanished_query(self.loader.table_definition(self.schema[1], True)))
+
+        assert 'DO UPDATE SET baz_id = EXCLUDED.baz_id' in executed[upsert]
+        assert upsert < delete
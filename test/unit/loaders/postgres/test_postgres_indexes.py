@@ -0,0 +1,156 @@
+import json
+import unittest
+from mock import Mock, patch
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresIndexes(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'index': ['foo', 'bar'],
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'index': ['baz'],
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_invalid_indexes_are_rebuilt(self, connect):
+        '''
+        Tests that an index left invalid by a failed concurrent
+        build is dropped and built again, and valid ones are kept
+        '''
+        cursor = connect.return_value.cursor.return_value
+        validity = {'foo_foo_idx': (False,), 'foo_bar_idx': (True,)}
+        names = []
+        cursor.execute.side_effect = lambda query, *args: names.append(args[0][0] if args else None)
+        cursor.fetchone.side_effect = lambda: validity.get(names[-1])
+
+        self.loader.build_table_indexes(self.loader.table_definition(self.schema[0], True))
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEquals(
+            [query for query in executed if query.startswith('DROP') or query.startswith('CREATE')],
+            [
+                'DROP INDEX IF EXISTS foo_foo_idx',
+                'CREATE INDEX CONCURRENTLY foo_foo_idx ON foo (foo)',
+                'CREATE INDEX CONCURRENTLY foo_baz_id_idx ON foo (baz_id)',
+            ]
+        )
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_index_session_settings(self, connect):
+        '''
+        Tests that session settings are set for the session while
+        indexes are built, and reset afterwards
+        '''
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = None
+
+        self.loader.build_table_indexes(
+            self.loader.table_definition(self.schema[1], True), {'maintenance_work_mem': '1GB'}
+        )
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEquals(executed[0], 'SET maintenance_work_mem = %s')
+        self.assertEquals(cursor.execute.call_args_list[0][0][1], ('1GB',))
+        self.assertEquals(executed[-2:], ['CREATE INDEX CONCURRENTLY baz_baz_idx ON baz (baz)', 'RESET maintenance_work_mem'])
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_load_passes_session_settings_to_index_builds(self, connect):
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = None
+
+        self.loader.load(self.data, True, session_settings={'maintenance_work_mem': '1GB'})
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEquals(executed[0], 'SET LOCAL maintenance_work_mem = %s')
+        self.assertEquals(executed.count('SET maintenance_work_mem = %s'), 2)
+        self.assertEquals(executed.count('RESET maintenance_work_mem'), 2)
+
+    def test_injected_connection_builds_sequentially(self):
+        '''
+        Tests that index_workers don't share an injected connection
+        '''
+        conn = Mock()
+        conn.cursor.return_value.fetchone.return_value = None
+        loader = PostgresLoader({}, schema=self.schema, connection=conn)
+
+        with patch('wextractor.loaders.postgres.ThreadPool') as ThreadPool:
+            loader.build_indexes(self.schema, workers=4)
+            self.assertFalse(ThreadPool.called)
+
+        self.assertEquals(len(loader.index_timings), 4)
+
+    def test_table_indexes(self):
+        '''
+        Tests that declared indexes and foreign key indexes are generated
+        '''
+        self.schema[0]['index'] = ['bar', ('baz_id', 'foo')]
+        table = self.loader.table_definition(self.schema[0], True)
+
+        self.assertEquals(self.loader.table_indexes(table), [
+            ('foo_bar_idx', ('bar',)), ('foo_baz_id_foo_idx', ('baz_id', 'foo'))
+        ])
+
+        table['index'] = 'foo'
+        self.assertEquals(self.loader.generate_index_queries(table, concurrently=True), [
+            'CREATE INDEX CONCURRENTLY foo_foo_idx ON foo (foo)',
+            'CREATE INDEX CONCURRENTLY foo_baz_id_idx ON foo (baz_id)',
+        ])
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_load_builds_indexes_concurrently(self, connect):
+        '''
+        Tests that indexes are built after the commit on autocommit connections
+        '''
+        # only the foreign key index, so that the builds happen in order
+        for table_schema in self.schema:
+            del table_schema['index']
+        conn = connect.return_value
+        conn.autocommit = False
+        cursor = conn.cursor.return_value
+        cursor.fetchone.return_value = None
+
+        events = []
+        conn.commit.side_effect = lambda: events.append('COMMIT')
+        cursor.execute.side_effect = lambda query, *args: events.append(query)
+
+        self.loader.load(self.data, True)
+
+        self.assertEquals(events[-3:], [
+            'COMMIT',
+            'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+            'CREATE INDEX CONCURRENTLY foo_baz_id_idx ON foo (baz_id)',
+        ])
+        self.assertEquals(self.loader.index_timings.keys(), ['foo_baz_id_idx'])
+        self.assertFalse(conn.autocommit)
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_existing_indexes_are_skipped(self, connect):
+        '''
+        Tests that indexes are only built if they are missing
+        '''
+        cursor = connect.return_value.cursor.return_value
+        cursor.fetchone.return_value = (1,)
+
+        self.loader.load(self.data, True, incremental=True)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertFalse([query for query in executed if query.startswith('CREATE INDEX')])
+        self.assertEquals(self.loader.index_timings, {})
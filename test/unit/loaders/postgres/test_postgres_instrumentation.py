@@ -0,0 +1,94 @@
+import os
+import json
+import shutil
+import pstats
+import tempfile
+import unittest
+from mock import Mock, patch
+
+from wextractor.loaders.postgres import PostgresLoader
+from wextractor.instrumentation import Instrumentation
+from wextractor.profiling import Profiler
+
+class TestPostgresInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    def test_stages_are_instrumented(self):
+        '''
+        Tests that transforming, deduping and writing tempfiles are each recorded as stages
+        '''
+        callback = Mock()
+        self.loader.instrumentation = Instrumentation([callback], log_level=None)
+
+        transformed = self.loader.transform_to_schema(self.data, True)
+        self.loader.generate_data_tempfile(transformed[0])
+
+        stages = [call[0][0] for call in callback.call_args_list]
+
+        self.assertEquals(
+            [(stats.stage, stats.label) for stats in stages],
+            [('transform', None), ('dedupe', 'foo'), ('dedupe', 'baz'), ('tempfile', None)]
+        )
+        self.assertEquals((stages[0].rows_in, stages[0].rows_out), (len(self.data), 2 * len(self.data)))
+        self.assertEquals((stages[1].rows_in, stages[1].rows_out), (len(self.data), 5))
+        self.assertEquals((stages[2].rows_in, stages[2].rows_out), (len(self.data), 3))
+        self.assertEquals((stages[3].rows_in, stages[3].rows_out), (5, 5))
+        assert stages[3].bytes_written > 0
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_copy_is_instrumented(self, connect):
+        '''
+        Tests that every COPY records the rows and bytes it sent
+        '''
+        cursor = connect.return_value.cursor.return_value
+        sent = {}
+        cursor.copy_from.side_effect = lambda stream, table, **kwargs: sent.__setitem__(table, len(stream.read()))
+
+        self.loader.instrumentation = Instrumentation(log_level=None, history_size=None)
+        self.loader.load(self.data, True)
+
+        copies = [stats for stats in self.loader.instrumentation.history if stats.stage == 'copy']
+
+        self.assertEquals(
+            sorted((stats.label, stats.rows_out, stats.bytes_written) for stats in copies),
+            [('baz', 3, sent['baz']), ('foo', 5, sent['foo'])]
+        )
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_profiled_load(self, connect):
+        '''
+        Tests that a profiled load writes its stats and a summary of its stages
+        '''
+        directory = tempfile.mkdtemp()
+        profiler = Profiler(directory)
+
+        try:
+            self.loader.load(self.data, True, profile=profiler)
+
+            assert os.path.exists(profiler.pstats_path)
+            for stage in ('transform', 'dedupe', 'copy'):
+                assert stage in profiler.summary
+            # the summary only lists the top functions, which vary on a load this small
+            assert 'transform_line' in [key[2] for key in pstats.Stats(profiler.pstats_path).stats]
+        finally:
+            shutil.rmtree(directory)
@@ -100,4 +100,100 @@ class TestPostgresLoader(unittest.TestCase):
         self.loader_with_tables.hash_row = Mock(return_value='foo')
         self.loader_with_tables.load([{'id': 1}], True)
 
-        assert self.loader_with_tables.hash_row.called
\ No newline at end of file
+        assert self.loader_with_tables.hash_row.called
+
+    @patch('tempfile.TemporaryFile')
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_load_streams_without_tempfiles(self, connect, TemporaryFile):
+        '''
+        Tests that load hands COPY a stream instead of writing a tempfile
+        '''
+        cursor = connect.return_value.cursor.return_value
+        self.loader_with_tables.load([{'id': 1}, {'id': 2}], True)
+
+        assert not TemporaryFile.called
+        stream = cursor.copy_from.call_args[0][0]
+        self.assertEquals(cursor.copy_from.call_args[1]['columns'], ['row_id', 'id', 'test_id'])
+        self.assertEquals(len(stream.read().splitlines()), 2)
+
+    def test_transform_keeps_types(self):
+        '''
+        Tests that transformed rows keep their types and that only empty strings become None
+        '''
+        loader = PostgresLoader(
+            {'database': 'dummy_db', 'user': 'dummy_user'},
+            schema=[{'table_name': 'test', 'pkey': None, 'columns': (
+                ('num', 'INTEGER'), ('name', 'TEXT'), ('empty', 'TEXT')
+            )}]
+        )
+        row = loader.transform_line({'num': 1, 'name': u'caf\xe9', 'empty': ''}, True)[0]
+
+        self.assertEquals(row['num'], 1)
+        self.assertEquals(row['name'], u'caf\xe9')
+        self.assertEquals(row['empty'], None)
+
+    @patch('psycopg2.pool.ThreadedConnectionPool')
+    def test_pooled_loads_share_connections(self, ThreadedConnectionPool):
+        '''
+        Tests that pooled loads check connections in and out of one
+        pool, which is closed when the loader's context exits
+        '''
+        pool = ThreadedConnectionPool.return_value
+        pool.getconn.return_value.closed = 0
+
+        with PostgresLoader(
+            {'database': 'dummy_db', 'user': 'dummy_user'},
+            schema=[{'table_name': 'test', 'pkey': 'id', 'columns': (('id', 'INTEGER'),)}],
+            pool_size=2
+        ) as loader:
+            loader.load([{'id': 1}], True)
+            loader.load([{'id': 2}], True)
+
+            self.assertEquals(ThreadedConnectionPool.call_count, 1)
+            self.assertEquals(pool.getconn.call_count, 2)
+            self.assertEquals(pool.putconn.call_count, 2)
+            assert not pool.getconn.return_value.close.called
+            # table definitions are only prepared once
+            self.assertEquals(len(loader.prepared_tables), 1)
+
+        assert pool.closeall.called
+
+    def test_injected_connection(self):
+        '''
+        Tests that an injected connection is used and left open
+        '''
+        conn = Mock()
+        loader = PostgresLoader(
+            {}, schema=[{'table_name': 'test', 'pkey': 'id', 'columns': (('id', 'INTEGER'),)}],
+            connection=conn
+        )
+        loader.load([{'id': 1}], True)
+
+        assert conn.commit.called
+        assert not conn.close.called
+        self.assertRaises(Exception, loader.load, [{'id': 1}], True, workers=2)
+
+    def test_failed_loads_roll_back(self):
+        '''
+        Tests that errors that don't come from the database still
+        roll the injected connection back
+        '''
+        def lines():
+            for i in range(5):
+                yield {'id': i}
+            raise IOError('the source went away')
+
+        conn = Mock()
+        loader = PostgresLoader(
+            {}, schema=[{'table_name': 'test', 'pkey': 'id', 'columns': (('id', 'INTEGER'),)}],
+            connection=conn
+        )
+
+        self.assertRaises(IOError, loader.load, lines(), True, batch_size=3)
+        assert conn.rollback.called
+        assert not conn.commit.called
+
+        conn.reset_mock()
+        self.assertRaises(IOError, loader.load, lines(), True, incremental=True)
+        assert conn.rollback.called
+        assert not conn.commit.called
@@ -47,9 +47,28 @@ class TestPostgresLoaderOneRelationships(unittest.TestCase):
         Tests that both of our tables were properly deduped
         '''
         tables = self.loader.transform_to_schema(self.data, True)
-        self.assertEquals(len(tables[0]), 4)
+        # foo 1, bar 2 is kept once under baz abc and once under def
+        self.assertEquals(len(tables[0]), 5)
         self.assertEquals(len(tables[1]), 3)
 
+    def test_rows_under_several_parents(self):
+        '''
+        Tests that a row related to two parents keeps both
+        relationships, under two different ids
+        '''
+        data = [{'foo': 1, 'bar': 2, 'baz': 'abc'}, {'foo': 1, 'bar': 2, 'baz': 'def'}]
+
+        for tables in (
+                self.loader.transform_to_schema(data, True),
+                [list(table) for table in self.loader.spill_transform(data, True)]):
+            foos, bazes = tables
+            baz_ids = dict((row['baz'], row['baz_id']) for row in bazes)
+
+            self.assertEquals(
+                sorted(row['baz_id'] for row in foos), sorted([baz_ids['abc'], baz_ids['def']])
+            )
+            self.assertEquals(len(set(row['foo_id'] for row in foos)), 2)
+
     def test_transform_to_proper_schema(self):
         '''
         Tests to make sure the schema was properly transformed
@@ -77,4 +96,4 @@ class TestPostgresLoaderOneRelationships(unittest.TestCase):
             tmpfile, col_headers = self.loader.generate_data_tempfile(table)
 
             self.assertTrue('row_id' in col_headers)
-            self.assertTrue(len(tmpfile.read().split('\n')), len(table))
\ No newline at end of file
+            self.assertTrue(len(tmpfile.read().split('\n')), len(table))
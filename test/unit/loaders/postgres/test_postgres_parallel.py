@@ -0,0 +1,82 @@
+import json
+import unittest
+from mock import patch
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresParallel(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    def test_generate_swap_queries(self):
+        '''
+        Tests that staging tables are swapped in along with their index and sequence
+        '''
+        self.assertEquals(
+            self.loader.generate_swap_queries(self.schema[0], 'foo_staging'),
+            [
+                'DROP TABLE IF EXISTS foo CASCADE',
+                'ALTER TABLE foo_staging RENAME TO foo',
+                'ALTER INDEX foo_staging_pkey RENAME TO foo_pkey',
+                'ALTER SEQUENCE foo_staging_row_id_seq RENAME TO foo_row_id_seq',
+            ]
+        )
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_parallel_load(self, connect):
+        '''
+        Tests that a parallel load copies each table over its own
+        connection into staging tables, then swaps them in
+        '''
+        cursor = connect.return_value.cursor.return_value
+        # the workers share this mock, whose call records aren't
+        # thread safe, so collect the copies with a plain append
+        copied = []
+        cursor.copy_from.side_effect = lambda stream, table, **kwargs: copied.append(table)
+
+        self.loader.load(self.data, True, workers=2)
+
+        # one connection for the ddl and swap, one per table, and
+        # one to index the foreign key on foo
+        self.assertEquals(connect.call_count, 4)
+        self.assertEquals(sorted(copied), ['baz_staging', 'foo_staging'])
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertTrue('ALTER TABLE foo_staging RENAME TO foo' in executed)
+        self.assertTrue(
+            executed.index('ALTER TABLE baz_staging RENAME TO baz') <
+            executed.index('ALTER TABLE foo ADD FOREIGN KEY (baz_id) REFERENCES baz')
+        )
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_parallel_load_failure_drops_staging(self, connect):
+        '''
+        Tests that a failed COPY leaves the live tables alone
+        '''
+        cursor = connect.return_value.cursor.return_value
+        cursor.copy_from.side_effect = Exception('COPY failed')
+
+        self.assertRaises(Exception, self.loader.load, self.data, True, workers=2)
+
+        executed = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertFalse('ALTER TABLE foo_staging RENAME TO foo' in executed)
+        self.assertEquals(executed[-1], 'DROP TABLE IF EXISTS baz_staging CASCADE')
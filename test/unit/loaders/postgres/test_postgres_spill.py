@@ -0,0 +1,53 @@
+import json
+import unittest
+from mock import patch
+from nose.tools import raises
+
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestPostgresSpill(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'foo',
+                'pkey': None,
+                'columns': (('foo', 'INTEGER'), ('bar', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['baz'],
+            },
+            {
+                'table_name': 'baz',
+                'pkey': None,
+                'columns': (('baz', 'VARCHAR'),),
+                'to_relations': ['foo'],
+                'from_relations': []
+            }
+        ]
+
+        self.loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=self.schema)
+
+        self.data = json.loads(open('./test/mock/json/one_relation.json', 'r').read())
+
+    @patch('wextractor.loaders.postgres.PostgresLoader.connect')
+    def test_spilled_load(self, connect):
+        '''
+        Tests that loading with spilled deduplication copies the same rows
+        '''
+        copied = {}
+        def copy_from(stream, table, **kwargs):
+            copied[table] = stream.read().splitlines()
+
+        cursor = connect.return_value.cursor.return_value
+        cursor.copy_from.side_effect = copy_from
+
+        self.loader.load(iter(self.data), True, dedupe='spill', memory_limit=1024)
+
+        self.assertEquals(len(copied['foo']), 5)
+        self.assertEquals(len(copied['baz']), 3)
+
+    @raises(Exception)
+    def test_bad_dedupe_mode(self):
+        '''
+        Tests that unknown dedupe modes raise
+        '''
+        self.loader.transformed_batches(self.data, True, dedupe='maybe')
@@ -0,0 +1,99 @@
+import unittest
+import struct
+import datetime
+from nose.tools import raises
+
+from wextractor.loaders.binary_copy import (
+    BinaryCopyStream, compile_encoder, type_name, PGCOPY_HEADER, PGCOPY_TRAILER
+)
+
+class TestBinaryCopy(unittest.TestCase):
+    def test_type_name(self):
+        '''
+        Tests that schema column types are normalized
+        '''
+        self.assertEquals(type_name('VARCHAR(32)'), 'varchar')
+        self.assertEquals(type_name('Double  Precision'), 'double precision')
+
+    def test_encoders(self):
+        '''
+        Tests the binary encoding of each supported type
+        '''
+        self.assertEquals(compile_encoder('SMALLINT')(3), struct.pack('>h', 3))
+        self.assertEquals(compile_encoder('INTEGER')('42'), struct.pack('>i', 42))
+        self.assertEquals(compile_encoder('BIGINT')(2 ** 40), struct.pack('>q', 2 ** 40))
+        self.assertEquals(compile_encoder('REAL')(1.5), struct.pack('>f', 1.5))
+        self.assertEquals(compile_encoder('DOUBLE PRECISION')('2.25'), struct.pack('>d', 2.25))
+        self.assertEquals(compile_encoder('BOOLEAN')(True), '\x01')
+        self.assertEquals(compile_encoder('BOOLEAN')('False'), '\x00')
+        self.assertEquals(compile_encoder('TEXT')(u'caf\xe9'), 'caf\xc3\xa9')
+        self.assertEquals(compile_encoder('VARCHAR(32)')(7), '7')
+
+    def test_text_matches_text_copy(self):
+        '''
+        Tests that non-string values in text columns are written
+        the way a text format COPY writes them
+        '''
+        text = compile_encoder('TEXT')
+        self.assertEquals(text(1234567.1234567), '1234567.1234567')
+        self.assertEquals(text(0.1), '0.1')
+        self.assertEquals(text(2 ** 70), str(2 ** 70))
+        self.assertEquals(text(datetime.date(2000, 1, 31)), '2000-01-31')
+
+    def test_date_encoders(self):
+        '''
+        Tests that dates and timestamps are offsets from 2000-01-01
+        '''
+        timestamp = compile_encoder('TIMESTAMP')
+        self.assertEquals(timestamp(datetime.datetime(2000, 1, 1)), struct.pack('>q', 0))
+        self.assertEquals(
+            timestamp(datetime.datetime(2000, 1, 2, 0, 0, 1, 5)),
+            struct.pack('>q', 86401000005)
+        )
+        self.assertEquals(timestamp('1999-12-31 23:59:59'), struct.pack('>q', -1000000))
+
+        date = compile_encoder('DATE')
+        self.assertEquals(date(datetime.date(2000, 1, 31)), struct.pack('>i', 30))
+        self.assertEquals(date('1999-12-31'), struct.pack('>i', -1))
+
+    @raises(Exception)
+    def test_unsupported_type(self):
+        '''
+        Tests that types without an encoder raise
+        '''
+        compile_encoder('NUMERIC(10, 2)')
+
+    def test_stream(self):
+        '''
+        Tests that the stream writes the header, one tuple per row and the trailer
+        '''
+        stream = BinaryCopyStream(
+            [{'foo': 5, 'bar': 'a'}, {'foo': None}],
+            ['bar', 'foo'], ['TEXT', 'INTEGER'], start=10
+        )
+
+        self.assertEquals(stream.read(), ''.join([
+            PGCOPY_HEADER,
+            struct.pack('>hii', 3, 4, 11), struct.pack('>i', 1), 'a', struct.pack('>ii', 4, 5),
+            struct.pack('>hii', 3, 4, 12), struct.pack('>ii', -1, -1),
+            PGCOPY_TRAILER,
+        ]))
+        self.assertEquals(stream.read(), '')
+        self.assertEquals(stream.rows_written, 2)
+        self.assertEquals(stream.row_id, 12)
+
+    def test_small_reads(self):
+        '''
+        Tests that reading in small pieces produces the same data
+        '''
+        rows = [{'foo': i} for i in range(50)]
+        expected = BinaryCopyStream(rows, ['foo'], ['BIGINT']).read()
+
+        stream, pieces = BinaryCopyStream(rows, ['foo'], ['BIGINT']), []
+        while True:
+            piece = stream.read(7)
+            if not piece:
+                break
+            pieces.append(piece)
+
+        self.assertEquals(''.join(pieces), expected)
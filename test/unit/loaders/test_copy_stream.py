@@ -0,0 +1,78 @@
+import unittest
+import datetime
+from wextractor.loaders.copy_stream import CopyStream, escape_copy_text, compile_formatter
+
+class TestCopyStream(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            {'foo': 'a', 'bar': None},
+            {'foo': 'tab\there', 'bar': 'back\\slash\nnewline'},
+            {'foo': 'c'},
+        ]
+
+    def test_escape_copy_text(self):
+        '''
+        Tests that COPY special characters are escaped
+        '''
+        self.assertEquals(escape_copy_text('a\tb\\c\r\nd'), 'a\\tb\\\\c\\r\\nd')
+        self.assertEquals(escape_copy_text('plain'), 'plain')
+
+    def test_read_everything(self):
+        '''
+        Tests that the stream generates properly formatted COPY lines
+        '''
+        stream = CopyStream(self.rows, ['bar', 'foo'], start=10)
+        self.assertEquals(
+            stream.read(),
+            '11\t\\N\ta\n'
+            '12\tback\\\\slash\\nnewline\ttab\\there\n'
+            '13\t\\N\tc\n'
+        )
+        self.assertEquals(stream.read(), '')
+        self.assertEquals(stream.rows_written, 3)
+
+    def test_read_in_chunks(self):
+        '''
+        Tests that small reads give the same data and don't buffer every row
+        '''
+        expected = CopyStream(self.rows, ['bar', 'foo']).read()
+
+        stream = CopyStream(self.rows, ['bar', 'foo'])
+        chunks = []
+        while True:
+            chunk = stream.read(4)
+            if not chunk:
+                break
+            self.assertTrue(len(chunk) <= 4)
+            self.assertTrue(len(stream.buffer) <= len(expected.split('\n')[1]) + 1)
+            chunks.append(chunk)
+
+        self.assertEquals(''.join(chunks), expected)
+        self.assertEquals(stream.bytes_written, len(expected))
+
+    def test_readline(self):
+        '''
+        Tests that lines can be read one at a time
+        '''
+        stream = CopyStream(self.rows, ['foo'])
+        self.assertEquals(stream.readline(), '1\ta\n')
+        self.assertEquals(stream.readline(), '2\ttab\\there\n')
+        self.assertEquals(stream.read(), '3\tc\n')
+
+    def test_typed_values(self):
+        '''
+        Tests that typed values are formatted by their column's formatter
+        '''
+        stream = CopyStream(
+            [{'a': 5, 'b': 0.1, 'c': u'caf\xe9\t', 'd': datetime.datetime(2015, 1, 2, 3, 4, 5), 'e': True}],
+            ['a', 'b', 'c', 'd', 'e'], column_types=['INTEGER', 'DOUBLE PRECISION', 'VARCHAR(10)', 'TIMESTAMP', 'BOOLEAN']
+        )
+        self.assertEquals(stream.read(), '1\t5\t0.1\tcaf\xc3\xa9\\t\t2015-01-02 03:04:05\tTrue\n')
+
+    def test_compile_formatter(self):
+        '''
+        Tests that formatters handle values that don't match their column type
+        '''
+        self.assertEquals(compile_formatter('INTEGER')('1\t2'), '1\\t2')
+        self.assertEquals(compile_formatter('TEXT')(12L), '12')
+        self.assertEquals(compile_formatter()(1.0 / 3), repr(1.0 / 3))
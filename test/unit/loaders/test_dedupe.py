@@ -0,0 +1,86 @@
+import unittest
+import random
+from hashlib import md5
+from nose.tools import raises
+from wextractor.loaders.dedupe import Deduper, SpillingDeduper
+
+class TestDeduper(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            {'foo': '1', 'foo_id': 'a', 'baz_id': 'x'},
+            {'foo': '2', 'foo_id': 'b', 'baz_id': 'x'},
+            {'foo': '1', 'foo_id': 'a', 'baz_id': 'y'},
+            {'foo': '1', 'foo_id': 'a', 'baz_id': 'x'},
+        ]
+
+    def test_dedupe_keeps_first_occurrence(self):
+        '''
+        Tests that duplicates are dropped in a single pass, in order
+        '''
+        deduper = Deduper('foo_id')
+        output = list(deduper.dedupe(self.rows))
+
+        self.assertEquals(output, [self.rows[0], self.rows[1]])
+        self.assertEquals(deduper.rows_in, 4)
+        self.assertEquals(deduper.rows_out, 2)
+
+    def test_dedupe_across_calls(self):
+        '''
+        Tests that state carries over between batches
+        '''
+        deduper = Deduper('foo_id')
+        self.assertEquals(len(list(deduper.dedupe(self.rows[:2]))), 2)
+        self.assertEquals(len(list(deduper.dedupe(self.rows[2:]))), 0)
+        self.assertEquals(deduper.seen, set(['a', 'b']))
+
+    def test_dedupe_keeps_relationships(self):
+        '''
+        Tests that a row under a second parent is kept with a new id
+        '''
+        deduper = Deduper('foo_id', ['baz_id'], lambda row: 'a-' + row['baz_id'])
+        output = list(deduper.dedupe([dict(row) for row in self.rows]))
+
+        self.assertEquals(
+            [(row['foo_id'], row['baz_id']) for row in output],
+            [('a', 'x'), ('b', 'x'), ('a-y', 'y')]
+        )
+        self.assertEquals(deduper.rows_out, 3)
+
+        spilling = SpillingDeduper('foo_id', ['baz_id'], lambda row: 'a-' + row['baz_id'])
+        for row in self.rows:
+            spilling.add(dict(row))
+        self.assertEquals(
+            sorted((row['foo_id'], row['baz_id']) for row in spilling.dedupe()),
+            [('a', 'x'), ('a-y', 'y'), ('b', 'x')]
+        )
+
+    @raises(Exception)
+    def test_fkeys_need_rehash(self):
+        Deduper('foo_id', ['baz_id'])
+
+    def test_spilling_dedupe(self):
+        '''
+        Tests that spilled deduplication gives the same rows as the
+        in-memory version, including when partitions have to be split
+        '''
+        rng = random.Random(0)
+        rows = []
+        for i in range(2000):
+            value = str(rng.randrange(300))
+            rows.append({'foo': value, 'foo_id': md5(value).hexdigest()})
+
+        expected = list(Deduper('foo_id').dedupe(rows))
+
+        # 1000 bytes at 100 bytes per row forces partitions past 10 rows to split
+        deduper = SpillingDeduper('foo_id', memory_limit=1000, bytes_per_row=100)
+        for row in rows:
+            deduper.add(row)
+        output = list(deduper.dedupe())
+
+        self.assertEquals(len(output), len(expected))
+        self.assertEquals(
+            sorted(row['foo_id'] for row in output),
+            sorted(row['foo_id'] for row in expected)
+        )
+        self.assertEquals(deduper.rows_in, 2000)
+        self.assertEquals(deduper.rows_out, len(expected))
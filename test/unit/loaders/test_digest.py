@@ -0,0 +1,49 @@
+import unittest
+from wextractor.loaders.digest import table_digest, table_signature
+from wextractor.loaders.hashing import BinaryHasher, JsonMd5Hasher
+
+class TestDigest(unittest.TestCase):
+    def setUp(self):
+        self.rows = [
+            {'foo_id': 'f' * 32, 'bar_id': '1' * 32},
+            {'foo_id': '0' * 31 + '1', 'bar_id': None},
+        ]
+
+    def test_order_independent(self):
+        '''
+        Tests that row order doesn't change the digest
+        '''
+        self.assertEquals(
+            table_digest(self.rows, 'foo_id', ('bar_id',)),
+            table_digest(self.rows[::-1], 'foo_id', ('bar_id',))
+        )
+
+    def test_sum_wraps(self):
+        '''
+        Tests that the sum of the hashes wraps at 128 bits
+        '''
+        digest, count = table_digest(self.rows, 'foo_id')
+        self.assertEquals(digest, '0' * 32)
+        self.assertEquals(count, 2)
+        self.assertEquals(table_digest([], 'foo_id'), ('0' * 32, 0))
+
+    def test_relationships_count(self):
+        '''
+        Tests that foreign keys are part of the digest
+        '''
+        moved = [dict(self.rows[0], bar_id='2' * 32), self.rows[1]]
+        self.assertNotEqual(
+            table_digest(self.rows, 'foo_id', ('bar_id',)), table_digest(moved, 'foo_id', ('bar_id',))
+        )
+
+    def test_signature(self):
+        '''
+        Tests that the signature changes with the definition and the hasher
+        '''
+        table = {'table_name': 'foo', 'pkey': 'foo_id', 'columns': (('foo', 'INTEGER'),)}
+        signature = table_signature(table, True, BinaryHasher())
+
+        self.assertEquals(signature, table_signature(dict(table), True, BinaryHasher()))
+        self.assertNotEqual(signature, table_signature(dict(table, columns=(('foo', 'TEXT'),)), True, BinaryHasher()))
+        self.assertNotEqual(signature, table_signature(table, True, JsonMd5Hasher()))
+        self.assertNotEqual(signature, table_signature(dict(table, index='foo'), True, BinaryHasher()))
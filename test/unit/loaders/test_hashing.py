@@ -0,0 +1,115 @@
+import unittest
+import json
+import datetime
+from hashlib import md5
+from nose.tools import raises
+from wextractor.loaders import hashing
+from wextractor.loaders.hashing import BinaryHasher, JsonMd5Hasher, get_hasher
+from wextractor.loaders.postgres import PostgresLoader
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        self.hasher = BinaryHasher()
+
+    def test_json_md5_compatibility(self):
+        '''
+        Tests that the compatibility hasher gives the old md5 ids
+        '''
+        row = {'foo': '1', 'bar': 'NULL'}
+        self.assertEquals(
+            JsonMd5Hasher().hash_row(row, ('bar', 'foo')),
+            md5(json.dumps(row, sort_keys=True)).hexdigest()
+        )
+
+    def test_binary_hash_is_stable(self):
+        '''
+        Tests that binary hashes don't depend on dict ordering
+        '''
+        row = dict((str(i), str(i)) for i in range(50))
+        same_row = dict(reversed(row.items()))
+        self.assertEquals(self.hasher.hash_row(row), self.hasher.hash_row(same_row))
+        self.assertEquals(len(self.hasher.hash_row(row)), 32)
+
+    def test_binary_hash_distinguishes_values(self):
+        '''
+        Tests that values which would collide if naively joined do not
+        '''
+        columns = ('a', 'b')
+        hash_row = self.hasher.hash_row
+        self.assertNotEqual(hash_row({'a': 'ab', 'b': 'c'}, columns), hash_row({'a': 'a', 'b': 'bc'}, columns))
+        self.assertNotEqual(hash_row({'a': '1'}, columns), hash_row({'a': 1}, columns))
+        self.assertNotEqual(hash_row({'a': None}, columns), hash_row({}, columns))
+        self.assertNotEqual(
+            hash_row({'a': datetime.date(2015, 1, 1)}, columns), hash_row({'a': '2015-01-01'}, columns)
+        )
+
+    def test_blake2b(self):
+        '''
+        Tests that blake2b is used when it's available, and raises otherwise
+        '''
+        if hashing.blake2b is None:
+            self.assertRaises(Exception, get_hasher, 'blake2b')
+        else:
+            self.assertEquals(len(get_hasher('blake2b').hash_row({'a': 'b'})), 32)
+
+    @raises(Exception)
+    def test_unknown_hasher(self):
+        '''
+        Tests that asking for a hasher that doesn't exist raises
+        '''
+        get_hasher('sha-whatever')
+
+    def test_loader_compatibility_mode(self):
+        '''
+        Tests that the loader's compatibility mode gives today's md5 ids
+        '''
+        loader = PostgresLoader(
+            {'database': 'dummy_db', 'user': 'dummy_user'},
+            schema=[{'table_name': 'test', 'pkey': None, 'columns': (('foo', 'TEXT'), ('bar', 'TEXT'))}],
+            hasher='json-md5'
+        )
+        table = loader.transform_to_schema([{'foo': 'a', 'bar': None}], True)[0]
+        self.assertEquals(
+            table[0]['test_id'],
+            md5(json.dumps({'foo': 'a', 'bar': 'NULL'}, sort_keys=True)).hexdigest()
+        )
+
+    def test_json_md5_matches_old_ids(self):
+        '''
+        Tests compatibility mode against ids generated by an older
+        version of the loader, see test/mock/json/baseline_ids.json
+        '''
+        baseline = json.load(open('./test/mock/json/baseline_ids.json'))
+        schema = [
+            dict(table, columns=tuple(tuple(column) for column in table['columns']))
+            for table in baseline['schema']
+        ]
+        loader = PostgresLoader({'database': 'dummy_db', 'user': 'dummy_user'}, schema=schema, hasher='json-md5')
+        tables = loader.transform_to_schema(baseline['data'], True)
+
+        # companies have no foreign keys, so every id matches
+        self.assertEquals(
+            sorted(row['company_id'] for row in tables[1]),
+            sorted(row['company_id'] for row in baseline['tables'][1])
+        )
+
+        # contracts that appear once keep their ids; duplicated ones
+        # were re-hashed with a company id and don't
+        def ids(rows):
+            return dict((row['description'], row['contract_id']) for row in rows)
+        new, old = ids(tables[0]), ids(baseline['tables'][0])
+
+        for description in ('snow removal', 'office supplies'):
+            self.assertEquals(new[description], old[description])
+        for description in ('paving', 'signs'):
+            self.assertNotEquals(new[description], old[description])
+
+    def test_json_md5_stringifies_typed_values(self):
+        '''
+        Tests that typed rows get the ids their old stringified versions got
+        '''
+        hash_row = JsonMd5Hasher().hash_row
+        self.assertEquals(
+            hash_row({'foo': 1, 'bar': None, 'baz': 1.5}),
+            md5(json.dumps({'foo': '1', 'bar': 'NULL', 'baz': '1.5'}, sort_keys=True)).hexdigest()
+        )
@@ -0,0 +1,65 @@
+import unittest
+from nose.tools import raises
+from wextractor.loaders.plan import compile_schema, dependency_order
+
+class TestSchemaPlan(unittest.TestCase):
+    def setUp(self):
+        self.schema = [
+            {
+                'table_name': 'contract',
+                'pkey': None,
+                'columns': (('description', 'TEXT'), ('amount', 'INTEGER')),
+                'to_relations': [],
+                'from_relations': ['company'],
+            },
+            {
+                'table_name': 'company',
+                'pkey': 'company',
+                'columns': (('company', 'VARCHAR(255)'),),
+                'to_relations': ['contract'],
+                'from_relations': [],
+            }
+        ]
+        self.plan = compile_schema(self.schema)
+
+    def test_columns_and_ids(self):
+        '''
+        Tests that column names and id columns are precomputed
+        '''
+        contract, company = self.plan
+        self.assertEquals(contract.columns, ('description', 'amount'))
+        self.assertEquals(contract.hash_columns, ('amount', 'description'))
+        self.assertEquals(contract.fkey_names, ('company_id',))
+        self.assertEquals(contract.row_id_name(False), 'contract_id')
+        self.assertEquals(company.row_id_name(True), 'company_id')
+        self.assertEquals(company.row_id_name(False), 'company')
+
+    def test_relations_are_resolved(self):
+        '''
+        Tests that to_relations are resolved to table indexes
+        '''
+        self.assertEquals(self.plan[0].relations, [])
+        self.assertEquals(self.plan[1].relations, [(0, 'company_id')])
+
+    def test_dependency_order(self):
+        '''
+        Tests that tables are ordered after the tables they reference
+        '''
+        self.assertEquals(self.plan[0].from_indexes, (1,))
+        self.assertEquals(dependency_order(self.plan), [1, 0])
+
+    @raises(Exception)
+    def test_circular_relations(self):
+        '''
+        Tests that circular from_relations raise
+        '''
+        self.schema[1]['from_relations'] = ['contract']
+        dependency_order(compile_schema(self.schema))
+
+    @raises(Exception)
+    def test_unknown_relation(self):
+        '''
+        Tests that relationships to missing tables raise up front
+        '''
+        self.schema[1]['to_relations'] = ['not_a_table']
+        compile_schema(self.schema)
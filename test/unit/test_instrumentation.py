@@ -0,0 +1,153 @@
+import unittest
+import pickle
+import logging
+from mock import Mock, patch
+
+from wextractor.instrumentation import Instrumentation, StageStats, peak_memory
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation(log_level=None)
+
+    def test_stage_records_stats(self):
+        '''
+        Tests that a stage is timed and filled in by its block
+        '''
+        with self.instrumentation.stage('dedupe', 'foo', rows_in=4) as stats:
+            stats.rows_out = 3
+
+        self.assertEquals((stats.stage, stats.label, stats.rows_in, stats.rows_out), ('dedupe', 'foo', 4, 3))
+        self.assertEquals(stats.dedupe_ratio, 0.25)
+        assert stats.seconds >= 0
+        assert stats.peak_memory > 0
+        assert stats.memory_growth >= 0
+
+    def test_callbacks(self):
+        '''
+        Tests that callbacks get every finished stage, and that failed stages aren't recorded
+        '''
+        callback = Mock()
+        self.instrumentation.add_callback(callback)
+
+        with self.instrumentation.stage('copy', 'foo') as stats:
+            pass
+
+        try:
+            with self.instrumentation.stage('copy', 'bar'):
+                raise ValueError
+        except ValueError:
+            pass
+
+        callback.assert_called_once_with(stats)
+        self.assertEquals(self.instrumentation.totals()['copy'].stage, 'copy')
+        self.assertEquals(len(self.instrumentation.totals()), 1)
+
+        self.instrumentation.remove_callback(callback)
+        with self.instrumentation.stage('copy', 'baz'):
+            pass
+        self.assertEquals(callback.call_count, 1)
+
+    @patch('wextractor.instrumentation.logger')
+    def test_logging(self, logger):
+        '''
+        Tests that stages are logged at the configured level, or not at all
+        '''
+        with Instrumentation(log_level=logging.DEBUG).stage('tempfile', rows_in=2) as stats:
+            stats.rows_out = 2
+            stats.bytes_written = 2048
+
+        self.assertEquals(logger.log.call_args[0][0], logging.DEBUG)
+        message = logger.log.call_args[0][1]
+        assert message.startswith('tempfile: 2 rows in, 2 rows out, 2.0 KB written')
+
+        with self.instrumentation.stage('tempfile'):
+            pass
+        self.assertEquals(logger.log.call_count, 1)
+
+    def test_totals(self):
+        '''
+        Tests that totals adds up every run of each stage
+        '''
+        for rows_in, rows_out in ((10, 8), (10, 7)):
+            with self.instrumentation.stage('dedupe', rows_in=rows_in) as stats:
+                stats.rows_out = rows_out
+        with self.instrumentation.stage('copy') as stats:
+            stats.bytes_written = 100
+
+        totals = self.instrumentation.totals()
+
+        self.assertEquals(sorted(totals.keys()), ['copy', 'dedupe'])
+        self.assertEquals((totals['dedupe'].rows_in, totals['dedupe'].rows_out), (20, 15))
+        self.assertEquals(totals['dedupe'].dedupe_ratio, 0.25)
+        self.assertEquals(totals['copy'].bytes_written, 100)
+        self.assertEquals(totals['copy'].rows_in, None)
+
+        self.instrumentation.reset()
+        self.assertEquals(self.instrumentation.totals(), {})
+
+    def test_history(self):
+        '''
+        Tests that no stages are kept by default, and that history keeps the latest ones
+        '''
+        for ix in range(3):
+            with self.instrumentation.stage('copy', ix):
+                pass
+        self.assertEquals(list(self.instrumentation.history), [])
+
+        instrumentation = Instrumentation(log_level=None, history_size=2)
+        for ix in range(3):
+            with instrumentation.stage('copy', ix, rows_in=1):
+                pass
+        self.assertEquals([stats.label for stats in instrumentation.history], [1, 2])
+        # totals still count the stages that were dropped
+        self.assertEquals(instrumentation.totals()['copy'].rows_in, 3)
+
+        instrumentation = Instrumentation(log_level=None, history_size=None)
+        for ix in range(3):
+            with instrumentation.stage('copy', ix):
+                pass
+        self.assertEquals(len(instrumentation.history), 3)
+
+        instrumentation.reset()
+        self.assertEquals(len(instrumentation.history), 0)
+
+    def test_as_dict(self):
+        stats = StageStats('extract', 'file.csv', rows_out=10)
+        stats.seconds = 2.0
+
+        output = stats.as_dict()
+
+        self.assertEquals(output['rows_per_second'], 5.0)
+        self.assertEquals(output['dedupe_ratio'], None)
+        self.assertEquals(output['label'], 'file.csv')
+
+    def test_pickle_drops_callbacks(self):
+        '''
+        Tests that an instrumentation with callbacks that can't be pickled still pickles
+        '''
+        instrumentation = Instrumentation(log_level=None, history_size=5)
+        instrumentation.add_callback(lambda stats: None)
+        with instrumentation.stage('extract'):
+            pass
+
+        copy = pickle.loads(pickle.dumps(instrumentation))
+
+        self.assertEquals((copy.callbacks, list(copy.history), copy.log_level), ([], [], None))
+        self.assertEquals((copy.history.maxlen, copy.totals()), (5, {}))
+
+        with copy.stage('extract'):
+            pass
+        self.assertEquals(copy.totals()['extract'].stage, 'extract')
+
+    @patch('wextractor.instrumentation.resource', None)
+    def test_no_resource_module(self):
+        '''
+        Tests that memory is left out where the resource module is missing
+        '''
+        self.assertEquals(peak_memory(), None)
+
+        with self.instrumentation.stage('extract') as stats:
+            pass
+
+        self.assertEquals((stats.peak_memory, stats.memory_growth), (None, None))
+        assert 'peak memory ?' in str(stats)
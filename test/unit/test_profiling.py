@@ -0,0 +1,134 @@
+import os
+import time
+import shutil
+import pstats
+import tempfile
+import unittest
+from mock import patch
+from nose.tools import raises
+
+from wextractor.instrumentation import Instrumentation
+from wextractor.profiling import Profiler, get_profiler, profiled
+
+def busy(seconds):
+    '''
+    Spins for seconds, so that the profiles have something to find
+    '''
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def function_names(self, path):
+        return [key[2] for key in pstats.Stats(path).stats]
+
+    @patch.dict('os.environ', {'WEXTRACTOR_PROFILE': ''})
+    def test_get_profiler(self):
+        '''
+        Tests the values profile can take
+        '''
+        profiler = Profiler(self.directory)
+
+        self.assertEquals(get_profiler(None), None)
+        self.assertEquals(get_profiler(False), None)
+        self.assertEquals(get_profiler(profiler), profiler)
+        self.assertEquals(get_profiler(True).output, os.getcwd())
+        self.assertEquals(get_profiler(self.directory).output, self.directory)
+
+    def test_environment(self):
+        '''
+        Tests that the environment turns profiling on for runs that don't pass profile
+        '''
+        with patch.dict('os.environ', {'WEXTRACTOR_PROFILE': self.directory, 'WEXTRACTOR_PROFILE_MODE': 'sample'}):
+            profiler = get_profiler(None)
+            self.assertEquals((profiler.output, profiler.mode), (self.directory, 'sample'))
+            self.assertEquals(get_profiler(False), None)
+
+        with patch.dict('os.environ', {'WEXTRACTOR_PROFILE': 'true'}):
+            self.assertEquals(get_profiler(None).output, os.getcwd())
+
+        with patch.dict('os.environ', {'WEXTRACTOR_PROFILE': '0'}):
+            self.assertEquals(get_profiler(None), None)
+
+    @raises(Exception)
+    def test_bad_mode(self):
+        Profiler(self.directory, mode='perf')
+
+    def test_cprofile_run(self):
+        '''
+        Tests that a run writes a .pstats file and a summary with stages and functions
+        '''
+        instrumentation = Instrumentation(log_level=None)
+
+        with profiled(self.directory, 'test run', instrumentation) as profiler:
+            with instrumentation.stage('transform', rows_in=10):
+                busy(0.01)
+
+        self.assertEquals(os.path.dirname(profiler.pstats_path), self.directory)
+        assert os.path.basename(profiler.pstats_path).startswith('test_run-')
+        assert 'busy' in self.function_names(profiler.pstats_path)
+
+        self.assertEquals(open(profiler.summary_path).read(), profiler.summary)
+        assert profiler.summary.startswith('test run: ')
+        assert 'transform' in profiler.summary
+        assert 'busy' in profiler.summary
+
+        # the callback doesn't outlive the run
+        self.assertEquals(instrumentation.callbacks, [])
+
+    def test_sample_run(self):
+        '''
+        Tests that the sampler finds where the time went
+        '''
+        profiler = Profiler(os.path.join(self.directory, 'sampled.pstats'), mode='sample', interval=0.001)
+
+        with profiler.run('sampled'):
+            busy(0.1)
+
+        self.assertEquals(profiler.pstats_path, os.path.join(self.directory, 'sampled.pstats'))
+        self.assertEquals(profiler.summary_path, os.path.join(self.directory, 'sampled.txt'))
+
+        stats = pstats.Stats(profiler.pstats_path)
+        busy_stats = [value for key, value in stats.stats.items() if key[2] == 'busy'][0]
+        assert busy_stats[3] > 0.05
+
+    def test_empty_sample_run(self):
+        profiler = Profiler(self.directory, mode='sample', interval=0.5)
+
+        with profiler.run('empty'):
+            pass
+
+        assert 'no samples were taken' in profiler.summary
+
+    def test_nested_runs(self):
+        '''
+        Tests that runs inside a profiled run aren't profiled on their own
+        '''
+        outer, inner = Profiler(self.directory), Profiler(self.directory)
+
+        with outer.run('outer'):
+            with inner.run('inner'):
+                busy(0.01)
+
+        self.assertEquals(inner.pstats_path, None)
+        self.assertEquals(len([name for name in os.listdir(self.directory) if name.endswith('.pstats')]), 1)
+
+    def test_failed_runs_are_written(self):
+        '''
+        Tests that a run that raises still writes its profile
+        '''
+        profiler = Profiler(self.directory)
+
+        try:
+            with profiler.run('failed'):
+                raise ValueError
+        except ValueError:
+            pass
+
+        assert os.path.exists(profiler.pstats_path)
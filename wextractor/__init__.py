@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+import logging
+
+try:
+    from logging import NullHandler
+except ImportError:
+    # added in python 2.7
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+# stage timings and other diagnostics are logged under this
+# logger; leave it to the application to decide where they go
+logging.getLogger(__name__).addHandler(NullHandler())
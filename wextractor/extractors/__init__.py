@@ -2,3 +2,5 @@
 from extractor import Extractor
 from excel_extractor import ExcelExtractor
 from csv_extractor import CsvExtractor
+from batch import extract_many, ExtractionError
+from cache import ExtractionCache
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+import sys
+import Queue
+import traceback
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from wextractor.extractors.csv_extractor import CsvExtractor
+
+# how often extract_many checks for tasks that failed without
+# reporting back, in seconds
+POLL_INTERVAL = 0.1
+
+class ExtractionError(Exception):
+    def __init__(self, source, message, details=None):
+        '''
+        Stands in for the rows of a source that extract_many
+        couldn't extract. message is the original error's type
+        and message, and details its formatted traceback.
+        '''
+        super(ExtractionError, self).__init__(message)
+        self.source = source
+        self.message = message
+        self.details = details
+
+    def __reduce__(self):
+        return (ExtractionError, (self.source, self.message, self.details))
+
+def describe_error():
+    '''
+    Returns the message and formatted traceback of the
+    exception being handled, see ExtractionError
+    '''
+    exc_type, exc_value = sys.exc_info()[:2]
+    return '{name}: {error}'.format(name=exc_type.__name__, error=exc_value), traceback.format_exc()
+
+def extract_source(task):
+    '''
+    Worker for extract_many. Extracts one source, catching any
+    error so that it can be reported instead of aborting the
+    rest of the batch. Returns (index, rows, error message,
+    traceback).
+    '''
+    index, extractor = task
+
+    try:
+        return index, extractor.extract(), None, None
+    except Exception:
+        message, details = describe_error()
+        return index, None, message, details
+
+def uses_threads(extractor):
+    '''
+    Sources that spend their time waiting on the network are
+    extracted in threads, everything else in processes
+    '''
+    return isinstance(extractor, CsvExtractor) and extractor.url
+
+def extract_many(sources, workers=None):
+    '''
+    Extracts a list of extractors concurrently and yields a
+    (source, rows) pair for each one as soon as it finishes,
+    so in no particular order. CsvExtractors that read from a
+    url are extracted in a pool of workers threads; everything
+    else, which is mostly CPU-bound parsing, goes to a pool of
+    workers processes, so those extractors must be picklable.
+    workers defaults to the number of CPUs.
+
+    If a source fails, including an extractor that can't be
+    pickled, rows is an ExtractionError describing what went
+    wrong and the rest of the batch carries on.
+    '''
+    sources = list(sources)
+    workers = workers or multiprocessing.cpu_count()
+
+    results = Queue.Queue()
+    pending = {}
+    pools = []
+
+    thread_tasks = [(ix, source) for ix, source in enumerate(sources) if uses_threads(source)]
+    process_tasks = [(ix, source) for ix, source in enumerate(sources) if not uses_threads(source)]
+
+    try:
+        for tasks, pool_class in ((thread_tasks, ThreadPool), (process_tasks, multiprocessing.Pool)):
+            if not tasks:
+                continue
+
+            pool = pool_class(min(workers, len(tasks)))
+            pools.append(pool)
+
+            for task in tasks:
+                pending[task[0]] = pool.apply_async(extract_source, (task,), callback=results.put)
+
+            pool.close()
+
+        while pending:
+            try:
+                index, rows, message, details = results.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                # the callback only runs if extract_source returned;
+                # a task that failed in the pool itself, e.g. because
+                # its extractor couldn't be pickled, never reports back
+                for index, result in pending.items():
+                    if not result.ready() or result.successful():
+                        continue
+
+                    del pending[index]
+                    try:
+                        result.get()
+                    except Exception:
+                        message, details = describe_error()
+                        yield sources[index], ExtractionError(sources[index], message, details)
+                continue
+
+            del pending[index]
+
+            if message is not None:
+                rows = ExtractionError(sources[index], message, details)
+
+            yield sources[index], rows
+
+    finally:
+        # stops any outstanding work if the caller gives up early
+        for pool in pools:
+            pool.terminate()
+            pool.join()
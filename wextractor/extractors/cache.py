@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import os
+import types
+import errno
+import hashlib
+import cPickle
+import tempfile
+
+from wextractor.extractors.csv_extractor import CsvExtractor, http_request, http_url, local_path
+
+# extract() arguments that change how the work is done, but not
+# what comes out of it
+EXECUTION_ARGUMENTS = ('workers', 'rows_per_task', 'profile')
+
+# part of every key; bump it when what's stored for a key changes
+CACHE_FORMAT = 1
+
+def stable_repr(value):
+    '''
+    repr that doesn't depend on memory addresses or dictionary
+    order, so that it can go into a cache key. Types, such as
+    dtypes, are represented by their module and name. Other
+    callables also include a hash of their code and of the
+    values they close over, so that two lambdas or two
+    functions with the same name don't share a key.
+    '''
+    if isinstance(value, type):
+        return '{module}.{name}'.format(module=value.__module__, name=value.__name__)
+    elif isinstance(value, types.CodeType):
+        return hashlib.md5(
+            value.co_code + stable_repr(value.co_consts) + stable_repr(value.co_names)
+        ).hexdigest()
+    elif isinstance(value, (list, tuple)):
+        return '[' + ', '.join(stable_repr(item) for item in value) + ']'
+    elif isinstance(value, dict):
+        return '{' + ', '.join(
+            stable_repr(key) + ': ' + stable_repr(value[key]) for key in sorted(value)
+        ) + '}'
+    elif callable(value):
+        function = getattr(value, '__func__', value)
+        code = getattr(function, '__code__', None)
+        closure = [cell.cell_contents for cell in getattr(function, '__closure__', None) or ()]
+        return '{module}.{name}:{code}'.format(
+            module=getattr(value, '__module__', None), name=getattr(value, '__name__', repr(value)),
+            code=stable_repr(code) + stable_repr(closure) if code is not None else None
+        )
+    return repr(value)
+
+class ExtractionCache(object):
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, chunk_size=65536):
+        '''
+        Stores the rows extracted from each source on disk, keyed
+        on a fingerprint of the source and of the extractor's
+        settings, so that sources that haven't changed since they
+        were last extracted are loaded from the cache instead of
+        being parsed again.
+
+        Rows are pickled with protocol 2. Once the cache holds
+        more than max_bytes, the least recently used entries are
+        removed.
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def stream_hash(self, extractor):
+        '''
+        Hashes a source's contents as they are read
+        '''
+        digest = hashlib.md5()
+
+        if isinstance(extractor, CsvExtractor):
+            stream = extractor.open_stream()[0]
+        else:
+            stream = open(extractor.target, 'rb')
+
+        try:
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        finally:
+            stream.close()
+
+        return digest.hexdigest()
+
+    def source_fingerprint(self, extractor):
+        '''
+        Identifies a version of a source as cheaply as possible:
+        local files by path, modification time and size, urls by
+        their ETag and Last-Modified headers, and anything else
+        by hashing its contents
+        '''
+        if isinstance(extractor, CsvExtractor) and extractor.url:
+            url = http_url(extractor.target)
+
+            try:
+                response = http_request('HEAD', url)[1]
+                response.read()
+                etag = response.getheader('etag')
+                last_modified = response.getheader('last-modified')
+            except StandardError:
+                etag, last_modified = None, None
+
+            if etag or last_modified:
+                return ('url', url, etag, last_modified)
+            return ('url', url, self.stream_hash(extractor))
+
+        path = local_path(extractor.target) if isinstance(extractor, CsvExtractor) else extractor.target
+
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            return ('content', self.stream_hash(extractor))
+
+        return ('file', os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+    def key(self, extractor, **kwargs):
+        '''
+        Returns the cache key for extracting a source with the
+        given extractor and extract() arguments
+        '''
+        settings = [
+            CACHE_FORMAT,
+            type(extractor).__name__,
+            extractor.header,
+            extractor.dtypes,
+            getattr(extractor, 'member', None),
+            dict((name, value) for name, value in kwargs.items() if name not in EXECUTION_ARGUMENTS),
+        ]
+
+        return hashlib.sha1(
+            stable_repr(self.source_fingerprint(extractor)) + stable_repr(settings)
+        ).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def extract(self, extractor, **kwargs):
+        '''
+        Returns extractor.extract(**kwargs), from the cache if
+        the source hasn't changed since it was cached
+        '''
+        path = self.path(self.key(extractor, **kwargs))
+
+        try:
+            with open(path, 'rb') as cached:
+                rows = cPickle.load(cached)
+        except IOError:
+            pass
+        except (EOFError, cPickle.UnpicklingError, ValueError):
+            # e.g. an entry that was being written when we crashed
+            self.remove(path)
+        else:
+            self.hits += 1
+            # the modification time marks when an entry was last used
+            os.utime(path, None)
+            return rows
+
+        self.misses += 1
+        rows = extractor.extract(**kwargs)
+        self.store(path, rows)
+
+        return rows
+
+    def store(self, path, rows):
+        '''
+        Writes an entry to a temporary file and then moves it into
+        place, so that a half written entry is never read
+        '''
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                cPickle.dump(rows, temp_file, 2)
+            os.rename(temp_path, path)
+        except:
+            self.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def entries(self):
+        '''
+        Returns (last used time, size, path) for every entry
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        return entries
+
+    def size(self):
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache
+        fits in max_bytes
+        '''
+        entries = sorted(self.entries())
+        total = sum(entry[1] for entry in entries)
+
+        for last_used, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clear(self):
+        for last_used, size, path in self.entries():
+            self.remove(path)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def compile_converter(dtype):
+    '''
+    Returns a function that coerces a single value to dtype,
+    returning None if the coercion fails for any reason. This
+    matches the per-cell behavior of Extractor.transform_row
+    '''
+    def convert(value):
+        try:
+            return dtype(value)
+        except:
+            return None
+
+    return convert
+
+def compile_typed_converter(dtype):
+    '''
+    Returns a function that coerces a single already-typed value
+    to dtype. Values that already have the right type are left
+    alone, bools are never coerced and TypeErrors and ValueErrors
+    result in None. This matches ExcelExtractor.transform_row
+    '''
+    if dtype == bool:
+        def convert(value):
+            if type(value) == bool:
+                return value
+            return None
+
+    else:
+        def convert(value):
+            if type(value) == dtype:
+                return value
+            try:
+                return dtype(value)
+            except TypeError:
+                # e.g. you are attempting to load a complex type
+                return None
+            except ValueError:
+                # e.g. you try to coerce an empty string to an int
+                return None
+
+    return convert
+
+def numpy_coerce(dtype, column):
+    '''
+    Attempts to coerce a whole column to int or float in one
+    vectorized NumPy pass. Only homogeneous columns of strings,
+    numbers and bools are handled; returns None whenever the
+    fast path does not apply or any single value fails to
+    convert, so that the caller can fall back to the per-value
+    converter and get its None-on-failure semantics.
+    '''
+    if numpy is None or dtype not in (int, float) or len(column) == 0:
+        return None
+
+    if len(set(map(type, column))) != 1:
+        return None
+
+    try:
+        values = numpy.asarray(column)
+
+        if values.dtype.kind not in 'biufSU':
+            return None
+
+        if dtype == float:
+            return values.astype(numpy.float64).tolist()
+
+        if values.dtype.kind == 'f':
+            # int() refuses nan and inf, and int64 can't hold
+            # everything a python long can
+            if not (numpy.isfinite(values).all() and (numpy.abs(values) < 2.0 ** 63).all()):
+                return None
+
+        return values.astype(numpy.int64).tolist()
+
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+class ColumnarCoercer(object):
+    def __init__(self, dtypes, converter=compile_converter, use_numpy=False):
+        '''
+        Coerces blocks of rows one column at a time. A converter
+        is compiled once per column from the list of dtypes using
+        the converter factory. If use_numpy is set and NumPy is
+        installed, int and float columns are converted with a
+        single vectorized call where possible.
+        '''
+        self.dtypes = dtypes
+        self.converters = [converter(dtype) for dtype in dtypes]
+        self.use_numpy = use_numpy and numpy is not None
+
+    def coerce_column(self, idx, column):
+        '''
+        Converts a single column of values. Columns past the
+        end of the dtypes list are dropped to None
+        '''
+        if idx >= len(self.converters):
+            return [None] * len(column)
+
+        if self.use_numpy:
+            converted = numpy_coerce(self.dtypes[idx], column)
+            if converted is not None:
+                return converted
+
+        return map(self.converters[idx], column)
+
+    def coerce_columns(self, columns):
+        '''
+        Takes a list of columns (each a list of values) and
+        returns a list of converted columns
+        '''
+        return [self.coerce_column(idx, column) for idx, column in enumerate(columns)]
+
+    def coerce_rows(self, header, rows):
+        '''
+        Takes a header and a block of rows (each a list of
+        values) and returns a list of dictionaries in the same
+        format as Extractor.transform_row
+        '''
+        if len(rows) == 0:
+            return []
+
+        if len(set(map(len, rows))) != 1:
+            # ragged rows can't be pivoted into columns, so
+            # convert them one row at a time instead
+            return [
+                dict(zip(header, [self.coerce_column(idx, [cell])[0] for idx, cell in enumerate(row)]))
+                for row in rows
+            ]
+
+        columns = self.coerce_columns([list(column) for column in zip(*rows)])
+
+        return [dict(zip(header, values)) for values in zip(*columns)]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import os
+import re
+import bz2
+import zlib
+import zipfile
+import tempfile
+from urlparse import urlparse
+
+# archives read from a stream that can't seek (e.g. a url) are
+# spooled to disk once they grow past this many bytes
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# bz2 streams start with 'BZh', a block size digit and the block
+# magic (the BCD digits of pi), so that a plain text file that
+# happens to start with 'BZh' isn't taken for one
+MAGIC_NUMBERS = [
+    (re.compile(r'\x1f\x8b'), 'gzip'),
+    (re.compile(r'BZh[1-9]\x31\x41\x59\x26\x53\x59'), 'bz2'),
+    (re.compile(r'PK\x03\x04'), 'zip'),
+]
+
+# number of bytes needed to tell the magic numbers apart
+MAGIC_LENGTH = 10
+
+EXTENSIONS = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.bz2': 'bz2',
+    '.zip': 'zip',
+}
+
+def detect_compression(name, head=''):
+    '''
+    Returns 'gzip', 'bz2', 'zip' or None for a file, going by
+    its first few bytes if they are given and by the extension
+    of its name (a path or url) otherwise
+    '''
+    for magic, compression in MAGIC_NUMBERS:
+        if magic.match(head):
+            return compression
+
+    if head:
+        return None
+
+    return EXTENSIONS.get(os.path.splitext(urlparse(name).path)[1].lower())
+
+def archive_members(archive):
+    '''
+    Returns the names of the files in a zip archive, skipping
+    directories and the metadata that OS X adds
+    '''
+    return [
+        name for name in archive.namelist()
+        if not name.endswith('/') and not name.startswith('__MACOSX/')
+        and not os.path.basename(name).startswith('.')
+    ]
+
+class DecompressingStream(object):
+    def __init__(self, stream, compression=None, head='', chunk_size=65536):
+        '''
+        A read-only file-like object that decompresses a gzip or
+        bz2 stream chunk_size compressed bytes at a time as it is
+        read, so that the uncompressed data never has to be held
+        in memory or written to disk. head is data that was
+        already read from the stream to sniff its type. With no
+        compression, data is passed through as it is.
+        '''
+        self.stream = stream
+        self.compression = compression
+        self.pending = head
+        self.chunk_size = chunk_size
+        self.decompressor = self.new_decompressor()
+        self.buffer = ''
+        self.eof = False
+
+    def new_decompressor(self):
+        if self.compression == 'gzip':
+            # 16 + MAX_WBITS tells zlib to expect a gzip header
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.compression == 'bz2':
+            return bz2.BZ2Decompressor()
+        return None
+
+    def raw_chunk(self):
+        if self.pending:
+            data, self.pending = self.pending, ''
+            return data
+        return self.stream.read(self.chunk_size)
+
+    def decompress(self, data):
+        if self.decompressor is None:
+            return data
+
+        try:
+            output = [self.decompressor.decompress(data)]
+        except EOFError:
+            # a bz2 stream ended exactly at the end of the last chunk
+            # and another one follows
+            self.decompressor = self.new_decompressor()
+            output = [self.decompressor.decompress(data)]
+
+        # files can hold several concatenated gzip members or bz2
+        # streams, each of which needs a decompressor of its own
+        unused = self.decompressor.unused_data
+        while unused:
+            self.decompressor = self.new_decompressor()
+            output.append(self.decompressor.decompress(unused))
+            unused = self.decompressor.unused_data
+
+        return ''.join(output)
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            data = self.raw_chunk()
+
+            if not data:
+                self.eof = True
+                if self.compression == 'gzip':
+                    self.buffer += self.decompressor.flush()
+                break
+
+            self.buffer += self.decompress(data)
+
+        if size < 0:
+            data, self.buffer = self.buffer, ''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        return data
+
+    def close(self):
+        # the underlying stream belongs to whoever opened it
+        pass
+
+class ArchiveMember(object):
+    def __init__(self, archive, member, spool=None):
+        '''
+        A file in a zip archive, opened for reading. Closing it
+        closes the archive and any file it was spooled to, but
+        not the stream the archive was read from.
+        '''
+        self.archive = archive
+        self.member = member
+        self.spool = spool
+
+    def read(self, size=-1):
+        return self.member.read(size)
+
+    def close(self):
+        self.member.close()
+        self.archive.close()
+        if self.spool is not None:
+            self.spool.close()
+
+def open_archive(stream, head='', chunk_size=65536):
+    '''
+    Opens a zip archive from a stream. zipfile needs to seek,
+    so streams that can't, such as url responses, are first
+    copied into a SpooledTemporaryFile, which only goes to disk
+    for large archives. Returns the archive and the spool file,
+    if one was needed.
+    '''
+    if hasattr(stream, 'seek'):
+        stream.seek(0)
+        return zipfile.ZipFile(stream), None
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    spool.write(head)
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        spool.write(chunk)
+
+    spool.seek(0)
+    return zipfile.ZipFile(spool), spool
+
+def open_decompressed(stream, name, member=None, chunk_size=65536):
+    '''
+    Wraps a file-like object so that reading it gives the
+    uncompressed data. Compression is detected from the
+    stream's first bytes or from name. For zip archives the
+    given member is read, or the only file in the archive if
+    member is None.
+    '''
+    head = stream.read(chunk_size)
+    while head and len(head) < MAGIC_LENGTH:
+        more = stream.read(chunk_size)
+        if not more:
+            break
+        head += more
+    compression = detect_compression(name, head)
+
+    if compression != 'zip':
+        return DecompressingStream(stream, compression, head, chunk_size)
+
+    archive, spool = open_archive(stream, head, chunk_size)
+
+    if member is None:
+        members = archive_members(archive)
+        if len(members) != 1:
+            archive.close()
+            if spool is not None:
+                spool.close()
+            raise Exception('{name} holds {count} files, pick one with member'.format(
+                name=name, count=len(members)
+            ))
+        member = members[0]
+
+    return ArchiveMember(archive, archive.open(member), spool)
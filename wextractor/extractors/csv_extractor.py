@@ -1,20 +1,139 @@
 #!/usr/bin/env python
 
+import os
+import copy
 import urllib2
 import httplib
+import socket
+import codecs
+import threading
+from collections import OrderedDict
+from urllib import url2pathname
 from urlparse import urlparse
 import csv
 
 from wextractor.extractors.extractor import Extractor
+from wextractor.extractors.compression import open_decompressed, open_archive, archive_members
+
+# definite detect_url results, keyed by target; the oldest are
+# dropped once there are more than URL_CACHE_SIZE
+URL_CACHE_SIZE = 1024
+_url_cache = OrderedDict()
+_url_cache_lock = threading.Lock()
+
+# keep-alive connections, one per (scheme, host) per thread
+_local = threading.local()
+
+def is_local_path(target):
+    '''
+    Recognizes targets that are certainly local files without
+    touching the network: existing paths, absolute or explicitly
+    relative paths and file:// urls
+    '''
+    if os.path.exists(target) or target.startswith(os.sep) or target.startswith('.'):
+        return True
+
+    # a single letter scheme is a windows drive, e.g. C:\data.csv
+    scheme = urlparse(target).scheme
+    return scheme == 'file' or len(scheme) == 1
+
+def local_path(target):
+    '''
+    Turns a file:// url into the path it points to, leaving
+    any other target as it is
+    '''
+    parsed = urlparse(target)
+    if parsed.scheme != 'file':
+        return target
+    return url2pathname(parsed.path)
+
+def http_url(target):
+    '''
+    Adds a scheme to urls that don't have one
+    '''
+    if bool(urlparse(target).scheme) is False:
+        return 'http://' + target
+    return target
+
+def keep_alive_connection(scheme, host):
+    '''
+    Returns this thread's open connection to a host, creating
+    it on first use, so that requests to the same host don't
+    pay for DNS lookups and TCP or TLS handshakes again
+    '''
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    if (scheme, host) not in connections:
+        if scheme == 'https':
+            connections[(scheme, host)] = httplib.HTTPSConnection(host)
+        else:
+            connections[(scheme, host)] = httplib.HTTPConnection(host)
+
+    return connections[(scheme, host)]
+
+def http_request(method, url):
+    '''
+    Sends a request over a keep-alive connection and returns
+    the connection and its response. A connection the server
+    has since closed is reopened and the request retried once.
+    '''
+    parsed = urlparse(url)
+    conn = keep_alive_connection(parsed.scheme, parsed.netloc)
+
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+
+    try:
+        conn.request(method, path)
+        return conn, conn.getresponse()
+    except (httplib.HTTPException, socket.error):
+        conn.close()
+        conn.request(method, path)
+        return conn, conn.getresponse()
+
+def open_url(url):
+    '''
+    Opens a url for reading, reusing the keep-alive connection
+    from detect_url. Anything other than a 200, e.g. a redirect,
+    is handed to urllib2, which knows how to deal with it.
+    Returns the response and the connection it is using, if any.
+    '''
+    try:
+        conn, response = http_request('GET', url)
+    except (httplib.HTTPException, socket.error):
+        return urllib2.urlopen(url), None
+
+    if response.status == httplib.OK:
+        return response, conn
+
+    response.read()
+    return urllib2.urlopen(url), None
 
 class CsvExtractor(Extractor):
-    def __init__(self, target, header=None, dtypes=None, url=None):
+    def __init__(self, target, header=None, dtypes=None, url=None, chunk_size=65536, member=None, **kwargs):
         '''
         CsvExtractor initializes with an optional url flag that tells
         the extractor whether or not the resource is local or remote so
-        that it can be loaded accordingly
+        that it can be loaded accordingly. chunk_size controls how many
+        bytes are read from the file or response at a time.
+
+        Url detection only goes to the network for targets that
+        don't look like local paths. Its answer is cached unless the
+        check failed or the server had an error, so that a passing
+        network problem isn't remembered.
+
+        gzip and bz2 compressed files are decompressed as they
+        are read. For zip archives, member names the file in the
+        archive to read; it can be left out if there's only one.
+        See members.
         '''
-        super(CsvExtractor, self).__init__(target, header, dtypes)
+        super(CsvExtractor, self).__init__(target, header, dtypes, **kwargs)
+
+        self.chunk_size = chunk_size
+        self.member = member
 
         if url is None:
             self.url = self.detect_url(target)
@@ -28,44 +147,184 @@ class CsvExtractor(Extractor):
         # and http://stackoverflow.com/questions/1140661/python-get-http-response-code-from-a-url
         # for additional information
         good_codes = [httplib.OK, httplib.FOUND, httplib.MOVED_PERMANENTLY]
-        # check to see if we have a scheme in the url, and append one if not
-        parsed_target = urlparse(target)
-        if bool(parsed_target.scheme) is False:
-            target = 'http://' + target
-        host, path = urlparse(target)[1:3]
+
+        if is_local_path(target):
+            return False
+
+        with _url_cache_lock:
+            if target in _url_cache:
+                return _url_cache[target]
+
         try:
-            conn = httplib.HTTPConnection(host)
-            conn.request("HEAD", path)
-            status = conn.getresponse().status
+            # the connection is kept open for the GET in iter_extract
+            response = http_request('HEAD', http_url(target))[1]
+            response.read()
+            status = response.status
         except StandardError:
             status = None
 
-        return status in good_codes
+        is_url = status in good_codes
+
+        # connection errors and 5xx responses may not happen again
+        if status is not None and status < 500:
+            with _url_cache_lock:
+                _url_cache[target] = is_url
+                while len(_url_cache) > URL_CACHE_SIZE:
+                    _url_cache.popitem(last=False)
+
+        return is_url
+
+    def iter_lines(self, stream):
+        '''
+        Reads a file-like object chunk_size bytes at a time and
+        yields one '\\n' terminated line at a time. A leading
+        UTF-8 byte order mark is dropped and '\\r\\n' and '\\r'
+        line endings are standardized to '\\n' as the data arrives,
+        so the whole file never has to be held in memory.
+        '''
+        leftover = ''
+
+        # the byte order mark can be split over several small
+        # chunks, so read until it can be recognized
+        head = ''
+        while len(head) < len(codecs.BOM_UTF8):
+            chunk = stream.read(self.chunk_size)
+            if not chunk:
+                break
+            head += chunk
+        if head.startswith(codecs.BOM_UTF8):
+            head = head[len(codecs.BOM_UTF8):]
+
+        while True:
+            if head:
+                chunk, head = head, ''
+            else:
+                chunk = stream.read(self.chunk_size)
 
-    def extract(self):
+            if not chunk:
+                break
+
+            chunk = leftover + chunk
+
+            # a trailing \r might be the first half of a \r\n pair,
+            # so hold onto it until the next chunk arrives
+            if chunk.endswith('\r'):
+                chunk, held = chunk[:-1], '\r'
+            else:
+                held = ''
+
+            lines = chunk.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+            leftover = lines.pop() + held
+
+            for line in lines:
+                yield line + '\n'
+
+        if leftover:
+            lines = leftover.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+            last = lines.pop()
+
+            for line in lines:
+                yield line + '\n'
+            if last:
+                yield last + '\n'
+
+    def open_stream(self):
+        '''
+        Opens the target file or url for reading. Returns the
+        raw stream and the keep-alive connection it came over,
+        if any.
+        '''
         if self.url:
-            raw_data = urllib2.urlopen(self.target).read().decode('utf-8-sig').rstrip()
-        else:
-            with open(self.target, 'r') as f:
-                raw_data = f.read().decode('utf-8-sig').rstrip()
+            return open_url(http_url(self.target))
+        return open(local_path(self.target), 'rb'), None
 
-        # standardize the file endings
-        raw_data = raw_data.replace('\r\n', '\n').replace('\r', '\n')
+    def members(self):
+        '''
+        Returns one CsvExtractor per file in a zip archive, each
+        with the same settings as this one, so that the files
+        can be extracted as separate sources (e.g. with
+        extract_many). Remote archives are downloaded again by
+        each member's extractor.
+        '''
+        stream, conn = self.open_stream()
 
-        if self.header is None:
-            # use first line if self.header not defined
-            current_headers = raw_data.split('\n')[0].split(',')
-            raw_data = '\n'.join(raw_data.split('\n')[1:])
-        else:
-            current_headers = self.header
+        try:
+            archive, spool = open_archive(stream, chunk_size=self.chunk_size)
+            try:
+                names = archive_members(archive)
+            finally:
+                archive.close()
+                if spool is not None:
+                    spool.close()
+        finally:
+            stream.close()
 
-        output = []
+        extractors = []
+        for name in names:
+            extractor = copy.copy(self)
+            extractor.member = name
+            extractors.append(extractor)
 
-        reader = csv.reader(raw_data.splitlines(), delimiter=',')
+        return extractors
 
-        for row in reader:
-            output.append(
-                self.transform_row(current_headers, row)
-            )
+    def iter_extract(self):
+        '''
+        Generator version of extract. Yields one transformed
+        row dictionary at a time, reading the underlying file
+        or url incrementally so that memory use stays flat
+        regardless of the size of the input.
+        '''
+        stream, conn = self.open_stream()
+        data = None
+
+        try:
+            data = open_decompressed(stream, self.target, self.member, self.chunk_size)
+            reader = csv.reader(self.iter_lines(data), delimiter=',')
+
+            if self.header is None:
+                # use first line if self.header not defined
+                current_headers = next(reader, [])
+            else:
+                current_headers = self.header
+
+            if self.coercer is None:
+                for row in reader:
+                    if not row:
+                        # skip blank lines
+                        continue
+
+                    yield self.transform_row(current_headers, row)
 
-        return output
+            else:
+                block = []
+                for row in reader:
+                    if not row:
+                        continue
+
+                    block.append(row)
+                    if len(block) == self.block_size:
+                        for transformed in self.transform_rows(current_headers, block):
+                            yield transformed
+                        block = []
+
+                for transformed in self.transform_rows(current_headers, block):
+                    yield transformed
+
+        finally:
+            if data is not None:
+                data.close()
+            if conn is not None and not stream.isclosed():
+                # the rest of the response is still on the wire, so
+                # the connection can't be used for another request
+                conn.close()
+            stream.close()
+
+    def extract(self, profile=None):
+        '''
+        Returns a list of dictionaries, one per row of
+        the csv. See iter_extract for a streaming version.
+
+        Pass profile=True, or an output path, to profile the
+        extraction, see wextractor.profiling
+        '''
+        return self.instrumented_extract(self.iter_extract, profile)
@@ -1,10 +1,36 @@
 #!/usr/bin/env python
 
 import datetime
+import zipfile
+import multiprocessing
 import xlrd
 from wextractor.extractors.extractor import Extractor
+from wextractor.extractors.coercion import compile_typed_converter
+
+CTYPE_CONVERSIONS = {
+    0: unicode, # empty
+    1: unicode, # text
+    2: float, # number
+    3: float, # date
+    4: int, # boolean
+    5: int, # error codes, use error_text_from_code for lookup
+    6: unicode # blank (when formatting_info=True)
+}
 
 class ExcelExtractor(Extractor):
+    converter = staticmethod(compile_typed_converter)
+
+    def cell_value(self, cell, excel_date):
+        '''
+        Converts a single xlrd cell to its native python type
+        based on the cell's ctype
+        '''
+        if cell.ctype == 3:
+            return datetime.datetime(*xlrd.xldate_as_tuple(cell.value, excel_date))
+        elif cell.ctype == 4:
+            return bool(cell.value)
+        return CTYPE_CONVERSIONS[cell.ctype](cell.value)
+
     def transform_row(self, row, header, excel_date):
         '''
         Attempts to reconcile excel data types with native
@@ -18,22 +44,8 @@ class ExcelExtractor(Extractor):
 
         output = []
 
-        ctype_conversions = {
-            0: unicode, # empty
-            1: unicode, # text
-            2: float, # number
-            3: float, # date
-            4: int, # boolean
-            5: int, # error codes, use error_text_from_code for lookup
-            6: unicode # blank (when formatting_info=True)
-        }
-
         for idx, cell in enumerate(row):
-            converted_val = ctype_conversions[cell.ctype](cell.value)
-            if cell.ctype == 3:
-                converted_val = datetime.datetime(*xlrd.xldate_as_tuple(cell.value, excel_date))
-            elif cell.ctype == 4:
-                converted_val = bool(cell.value)
+            converted_val = self.cell_value(cell, excel_date)
 
             if type(converted_val) != self.dtypes[idx]:
                 try:
@@ -53,49 +65,212 @@ class ExcelExtractor(Extractor):
 
         return dict(zip(header, output))
 
-    def extract(self):
+    def sheet_header(self, sheet):
+        '''
+        Returns the header to use for a sheet along with the
+        index of the first data row. If we don't have a header,
+        assume that the first row will be the header
+        '''
+        if not self.header:
+            return [
+                self.simple_cleanup(field.value) for field in sheet.row(0)
+            ], 1
+        return self.header, 0
+
+    def iter_sheet_rows(self, sheet, header, excel_date, start, stop):
+        '''
+        Yields the formatted rows of a sheet from start up to
+        (but not including) stop
+        '''
+        current_row = start
+
+        if self.coercer is not None:
+            while current_row < stop:
+                block_stop = min(current_row + self.block_size, stop)
+                block = [
+                    [self.cell_value(cell, excel_date) for cell in sheet.row(i)]
+                    for i in xrange(current_row, block_stop)
+                ]
+                for formatted_row in self.transform_rows(header, block):
+                    yield formatted_row
+                current_row = block_stop
+
+        while current_row < stop:
+            if self.dtypes:
+                formatted_row = self.transform_row(
+                    sheet.row(current_row), header, excel_date
+                )
+            else:
+                formatted_row = dict(zip(
+                    header, [cell.value for cell in sheet.row(current_row)]
+                ))
+
+            yield formatted_row
+
+            current_row += 1
+
+    def select_sheets(self, workbook, sheets=None):
+        '''
+        Returns the names of the sheets to extract. sheets can be
+        None (every sheet), a sheet name, a sheet index, or a list
+        of names and indexes
+        '''
+        names = workbook.sheet_names()
+
+        if sheets is None:
+            return names
+
+        if not isinstance(sheets, (list, tuple)):
+            sheets = [sheets]
+
+        selected = []
+        for sheet in sheets:
+            if isinstance(sheet, (int, long)):
+                selected.append(names[sheet])
+            elif sheet in names:
+                selected.append(sheet)
+            else:
+                raise Exception('Sheet {sheet} not found in workbook'.format(sheet=sheet))
+
+        return selected
+
+    def iter_extract(self, sheets=None):
+        '''
+        Generator version of extract. The workbook is opened with
+        on-demand sheet loading, so only the selected sheets are
+        parsed, one at a time, and each sheet is unloaded again
+        once its rows have been consumed. NOTE: xlrd only supports
+        on-demand loading for .xls files, .xlsx workbooks are
+        still parsed up front.
+        '''
+        workbook = xlrd.open_workbook(self.target, on_demand=True)
+
+        try:
+            for sheet in self.select_sheets(workbook, sheets):
+
+                current_sheet = workbook.sheet_by_name(sheet)
+
+                if current_sheet.nrows != 0:
+                    current_header, current_row = self.sheet_header(current_sheet)
+
+                    for formatted_row in self.iter_sheet_rows(
+                        current_sheet, current_header, workbook.datemode,
+                        current_row, current_sheet.nrows
+                    ):
+                        yield formatted_row
+
+                workbook.unload_sheet(sheet)
+
+        finally:
+            workbook.release_resources()
+
+    def extract(self, workers=None, rows_per_task=None, sheets=None, profile=None):
         '''
         Returns a list of dictionaries structured as follows:
         [ 
             {field: value, ...},
             ...
         ]
+
+        If workers is greater than one, sheets are converted in
+        a pool of that many processes. Sheets of .xls workbooks
+        can additionally be split into tasks of rows_per_task
+        rows, see parallel_tasks. Either way, rows come back in
+        the same order as the serial path.
+
+        sheets optionally limits extraction to some sheets,
+        see select_sheets
+
+        Pass profile=True, or an output path, to profile the
+        extraction, see wextractor.profiling
         '''
-        output = []
+        if workers is not None and workers > 1:
+            return self.instrumented_extract(
+                lambda: self.parallel_extract(workers, rows_per_task, sheets), profile
+            )
 
-        workbook = xlrd.open_workbook(self.target)
+        return self.instrumented_extract(lambda: self.iter_extract(sheets), profile)
 
-        for sheet in workbook.sheet_names():
+    def parallel_tasks(self, rows_per_task=None, sheets=None):
+        '''
+        Splits the workbook into (extractor, sheet, header, start,
+        stop) tasks for extract_sheet_rows, one per sheet or per
+        rows_per_task rows of a sheet. xlrd parses the whole of
+        an .xlsx workbook every time it is opened, so those are
+        only split by sheet.
+        '''
+        tasks = []
 
-            current_sheet = workbook.sheet_by_name(sheet)
-            current_row = 0
+        if zipfile.is_zipfile(self.target):
+            rows_per_task = None
 
-            if current_sheet.nrows == 0:
-                # immediately continue if we have no rows
-                continue
+        workbook = xlrd.open_workbook(self.target, on_demand=True)
 
-            if not self.header:
-                # if we don't have a header, assume that
-                # the first row will be the header
-                current_header = [
-                    self.simple_cleanup(field.value) for field in current_sheet.row(0)
-                ]
-                current_row = 1
-            else:
-                current_header = self.header
+        try:
+            for sheet in self.select_sheets(workbook, sheets):
+                current_sheet = workbook.sheet_by_name(sheet)
 
-            while current_row < current_sheet.nrows:
-                if self.dtypes:
-                    formatted_row = self.transform_row(
-                        current_sheet.row(current_row), current_header, workbook.datemode
-                    )
-                else:
-                    formatted_row = dict(zip(
-                        current_header, [cell.value for cell in current_sheet.row(current_row)]
-                    ))
+                if current_sheet.nrows != 0:
+                    current_header, current_row = self.sheet_header(current_sheet)
+                    step = rows_per_task or current_sheet.nrows
 
-                output.append(formatted_row)
+                    for start in xrange(current_row, current_sheet.nrows, step):
+                        tasks.append((
+                            self, sheet, current_header,
+                            start, min(start + step, current_sheet.nrows)
+                        ))
 
-                current_row += 1
+                workbook.unload_sheet(sheet)
+
+        finally:
+            workbook.release_resources()
+
+        return tasks
+
+    def parallel_extract(self, workers, rows_per_task=None, sheets=None):
+        '''
+        Splits the workbook into tasks (see parallel_tasks),
+        converts them in a multiprocessing pool and merges the
+        results back in sheet order. Each worker opens the
+        workbook itself, so the extractor (including its dtypes)
+        must be picklable.
+        '''
+        tasks = self.parallel_tasks(rows_per_task, sheets)
+
+        pool = multiprocessing.Pool(workers)
+
+        try:
+            results = pool.map(extract_sheet_rows, tasks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        output = []
+        for result in results:
+            output.extend(result)
 
         return output
+
+def extract_sheet_rows(task):
+    '''
+    Worker for ExcelExtractor.parallel_extract. Opens the
+    workbook and converts one range of rows from one sheet
+    '''
+    extractor, sheet, header, start, stop = task
+
+    workbook = xlrd.open_workbook(extractor.target, on_demand=True)
+
+    try:
+        current_sheet = workbook.sheet_by_name(sheet)
+
+        return list(extractor.iter_sheet_rows(
+            current_sheet, header, workbook.datemode, start, stop
+        ))
+
+    finally:
+        # pool workers live on, so don't leave the file open until
+        # the workbook happens to be collected
+        workbook.release_resources()
@@ -1,16 +1,41 @@
 #!/usr/bin/env python
 
+import os
+
+from wextractor.extractors.coercion import ColumnarCoercer, compile_converter
+from wextractor.instrumentation import Instrumentation
+from wextractor.profiling import profiled
+
 class Extractor(object):
-    def __init__(self, target, header=None, dtypes=None):
+    # factory used to build the per-column converters for the
+    # columnar coercion path
+    converter = staticmethod(compile_converter)
+
+    def __init__(self, target, header=None, dtypes=None, columnar=False, block_size=10000, use_numpy=False,
+                 instrumentation=None):
         '''
         Initializes a new Extractor. Extractors pull data
         out of different targets. The target (file, url, etc)
         is passed in as an argument, along with whether or
         not the first row of the target contains headers
+
+        If columnar is set and dtypes are given, rows are
+        collected block_size at a time and coerced one column
+        at a time (optionally with NumPy) instead of cell by cell
+
+        extract is timed as an 'extract' stage of instrumentation,
+        see wextractor.instrumentation, and can be profiled, see
+        wextractor.profiling
         '''
         self.target = target
         self.header = header
         self.dtypes = dtypes
+        self.columnar = columnar
+        self.block_size = block_size
+        self.use_numpy = use_numpy
+        self.instrumentation = instrumentation or Instrumentation()
+
+        self.coercer = self.build_coercer()
 
         # if we have a header and dtypes, make sure they are the
         # same length
@@ -18,6 +43,28 @@ class Extractor(object):
             if len(self.header) != len(self.dtypes):
                 raise Exception('Number of headers must match number of dtypes')
 
+    def __getstate__(self):
+        '''
+        The compiled coercer holds closures, which can't be
+        pickled, so drop it and rebuild it on the other side
+        '''
+        state = self.__dict__.copy()
+        state.pop('coercer', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.coercer = self.build_coercer()
+
+    def build_coercer(self):
+        '''
+        Returns a ColumnarCoercer if columnar coercion is turned
+        on and we have dtypes, otherwise None
+        '''
+        if self.columnar and self.dtypes:
+            return ColumnarCoercer(self.dtypes, self.converter, self.use_numpy)
+        return None
+
     def transform_row(self, header, row):
         if self.dtypes is None:
             return dict(zip(header, row))
@@ -33,6 +80,15 @@ class Extractor(object):
                 )
             return dict(zip(header, output))
 
+    def transform_rows(self, header, rows):
+        '''
+        Transforms a block of rows at once, using the columnar
+        coercer if one is configured
+        '''
+        if self.coercer is None:
+            return [self.transform_row(header, row) for row in rows]
+        return self.coercer.coerce_rows(header, rows)
+
     def simple_cleanup(self, field):
         '''
         Method to replace spaces with underscores, pound signs
@@ -45,7 +101,23 @@ class Extractor(object):
 
         return clean
 
-    def extract(self):
+    def instrumented_extract(self, extract, profile=None):
+        '''
+        Calls extract and collects the rows it returns into a
+        list as one instrumented 'extract' stage, profiling it if
+        profile (or the WEXTRACTOR_PROFILE environment variable)
+        asks for it, see wextractor.profiling.get_profiler
+        '''
+        name = 'extract-{target}'.format(target=os.path.basename(str(self.target)))
+
+        with profiled(profile, name, self.instrumentation):
+            with self.instrumentation.stage('extract', self.target) as stats:
+                rows = list(extract())
+                stats.rows_out = len(rows)
+
+        return rows
+
+    def extract(self, profile=None):
         '''
         Each Extractor implementation must implement an
         extract method. The method should return a
@@ -54,5 +126,9 @@ class Extractor(object):
             {field: value, ...},
             ...
         ]
+
+        Implementations should collect their rows through
+        instrumented_extract, passing profile along, so that
+        every extract is timed and can be profiled.
         '''
         raise NotImplementedError
\ No newline at end of file
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+import sys
+import copy
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+def peak_memory():
+    '''
+    Returns the peak resident memory of the process so far in
+    bytes, or None where the resource module isn't available
+    '''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # OS X reports bytes, everything else kilobytes
+    if sys.platform != 'darwin':
+        peak *= 1024
+
+    return peak
+
+def format_bytes(value):
+    if value is None:
+        return '?'
+    elif value < 1024 * 1024:
+        return '{kilobytes:.1f} KB'.format(kilobytes=value / 1024.0)
+    return '{megabytes:.1f} MB'.format(megabytes=value / (1024.0 * 1024))
+
+class StageStats(object):
+    def __init__(self, stage, label=None, rows_in=None, rows_out=None, bytes_written=None):
+        '''
+        Measurements for one run of one stage of a load, e.g.
+        'extract', 'transform', 'dedupe', 'tempfile' or 'copy'.
+        label says what the stage ran on, such as a table name.
+        Counts that don't apply to a stage are left as None.
+
+        peak_memory is the peak resident memory of the process
+        when the stage finished and memory_growth how much that
+        peak went up while it ran, both in bytes.
+        '''
+        self.stage = stage
+        self.label = label
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.bytes_written = bytes_written
+        self.seconds = None
+        self.peak_memory = None
+        self.memory_growth = None
+
+    @property
+    def dedupe_ratio(self):
+        '''
+        The share of incoming rows that a 'dedupe' stage dropped,
+        e.g. 0.25 if one row in four was a duplicate. None for
+        every other stage.
+        '''
+        if self.stage != 'dedupe' or not self.rows_in or self.rows_out is None:
+            return None
+        return 1 - float(self.rows_out) / self.rows_in
+
+    @property
+    def rows_per_second(self):
+        rows = self.rows_in if self.rows_in is not None else self.rows_out
+        if rows is None or not self.seconds:
+            return None
+        return rows / self.seconds
+
+    def as_dict(self):
+        return {
+            'stage': self.stage,
+            'label': self.label,
+            'seconds': self.seconds,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'bytes_written': self.bytes_written,
+            'dedupe_ratio': self.dedupe_ratio,
+            'rows_per_second': self.rows_per_second,
+            'peak_memory': self.peak_memory,
+            'memory_growth': self.memory_growth,
+        }
+
+    def __str__(self):
+        name = self.stage if self.label is None else '{stage} {label}'.format(
+            stage=self.stage, label=self.label
+        )
+        parts = []
+
+        if self.rows_in is not None:
+            parts.append('{rows} rows in'.format(rows=self.rows_in))
+        if self.rows_out is not None:
+            parts.append('{rows} rows out'.format(rows=self.rows_out))
+        if self.dedupe_ratio is not None:
+            parts.append('{percent:.1f}% dropped'.format(percent=self.dedupe_ratio * 100))
+        if self.bytes_written is not None:
+            parts.append('{bytes} written'.format(bytes=format_bytes(self.bytes_written)))
+        if self.rows_per_second is not None:
+            parts.append('{rate:.0f} rows/s'.format(rate=self.rows_per_second))
+
+        parts.append('peak memory {peak}'.format(peak=format_bytes(self.peak_memory)))
+
+        return '{name}: {summary} in {seconds:.3f}s'.format(
+            name=name, summary=', '.join(parts), seconds=self.seconds or 0
+        )
+
+class Instrumentation(object):
+    def __init__(self, callbacks=None, log_level=logging.INFO, history_size=0):
+        '''
+        Collects a StageStats for every stage that extractors and
+        loaders run. Each one is logged to the
+        wextractor.instrumentation logger at log_level (pass None
+        to turn that off), passed to every callback and added to
+        the per-stage totals.
+
+        A long-lived loader runs stages without end, so they
+        aren't kept by default: history holds the last
+        history_size of them, or all of them if history_size is
+        None.
+
+        Callbacks are called with the StageStats as soon as the
+        stage finishes, possibly from a worker thread. Callbacks,
+        history and totals aren't pickled, so extractors that are
+        sent to other processes only log there.
+        '''
+        self.callbacks = list(callbacks or [])
+        self.log_level = log_level
+        self.history = deque(maxlen=history_size)
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['callbacks'] = []
+        state['history'] = deque(maxlen=self.history.maxlen)
+        state['_totals'] = {}
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    @contextmanager
+    def stage(self, stage, label=None, rows_in=None):
+        '''
+        Times the code in a with block as one run of a stage.
+        Yields the StageStats, so that the block can fill in its
+        row and byte counts. Nothing is recorded if the block
+        raises.
+        '''
+        stats = StageStats(stage, label, rows_in)
+        memory_before = peak_memory()
+        start = time.time()
+
+        yield stats
+
+        stats.seconds = time.time() - start
+        stats.peak_memory = peak_memory()
+        if memory_before is not None:
+            stats.memory_growth = stats.peak_memory - memory_before
+
+        self.record(stats)
+
+    def record(self, stats):
+        '''
+        Logs a finished stage, adds it to the totals and history
+        and hands it to the callbacks
+        '''
+        with self._lock:
+            self.add_to_total(stats)
+            self.history.append(stats)
+
+        if self.log_level is not None:
+            logger.log(self.log_level, str(stats))
+
+        for callback in self.callbacks:
+            callback(stats)
+
+    def add_to_total(self, stats):
+        total = self._totals.get(stats.stage)
+        if total is None:
+            total = self._totals[stats.stage] = StageStats(stats.stage)
+            total.seconds = 0
+
+        total.seconds += stats.seconds
+        for name in ('rows_in', 'rows_out', 'bytes_written', 'memory_growth'):
+            value = getattr(stats, name)
+            if value is not None:
+                setattr(total, name, (getattr(total, name) or 0) + value)
+        if stats.peak_memory is not None:
+            total.peak_memory = max(total.peak_memory, stats.peak_memory)
+
+    def totals(self):
+        '''
+        Returns a dictionary of stage name to a StageStats that
+        adds up every run of that stage since the last reset. Its
+        peak_memory is the highest seen by any run.
+        '''
+        with self._lock:
+            return dict((stage, copy.copy(total)) for stage, total in self._totals.items())
+
+    def reset(self):
+        with self._lock:
+            self.history.clear()
+            self._totals = {}
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import struct
+import datetime
+
+from wextractor.loaders.copy_stream import CopyStream, type_name, value_text
+
+PGCOPY_HEADER = 'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+PG_EPOCH_DATE = PG_EPOCH.date()
+
+_pack_int16 = struct.Struct('>h').pack
+_pack_int32 = struct.Struct('>i').pack
+_pack_int64 = struct.Struct('>q').pack
+_pack_float4 = struct.Struct('>f').pack
+_pack_float8 = struct.Struct('>d').pack
+
+NULL_FIELD = _pack_int32(-1)
+
+TRUE_STRINGS = ('true', 't', 'yes', 'y', '1')
+
+def parse_datetime(value):
+    '''
+    Parses the str() of a datetime, with or without microseconds
+    '''
+    if '.' in value:
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+def encode_bool(value):
+    if isinstance(value, basestring):
+        value = value.strip().lower() in TRUE_STRINGS
+    return '\x01' if value else '\x00'
+
+def encode_text(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, str):
+        return value
+    # e.g. floats, which str would round to 12 digits
+    return value_text(value)
+
+def encode_timestamp(value):
+    if isinstance(value, basestring):
+        value = parse_datetime(value)
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+
+    delta = value.replace(tzinfo=None) - PG_EPOCH
+    return _pack_int64((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+def encode_date(value):
+    if isinstance(value, basestring):
+        value = datetime.datetime.strptime(value, '%Y-%m-%d')
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+
+    return _pack_int32(value.toordinal() - PG_EPOCH_DATE.toordinal())
+
+# maps Postgres type names to functions that take a python value
+# and return its binary COPY representation
+ENCODERS = {
+    'smallint': lambda value: _pack_int16(int(value)),
+    'int2': lambda value: _pack_int16(int(value)),
+    'integer': lambda value: _pack_int32(int(value)),
+    'int': lambda value: _pack_int32(int(value)),
+    'int4': lambda value: _pack_int32(int(value)),
+    'serial': lambda value: _pack_int32(int(value)),
+    'bigint': lambda value: _pack_int64(int(value)),
+    'int8': lambda value: _pack_int64(int(value)),
+    'bigserial': lambda value: _pack_int64(int(value)),
+    'real': lambda value: _pack_float4(float(value)),
+    'float4': lambda value: _pack_float4(float(value)),
+    'double precision': lambda value: _pack_float8(float(value)),
+    'float8': lambda value: _pack_float8(float(value)),
+    'float': lambda value: _pack_float8(float(value)),
+    'boolean': encode_bool,
+    'bool': encode_bool,
+    'text': encode_text,
+    'varchar': encode_text,
+    'character varying': encode_text,
+    'char': encode_text,
+    'character': encode_text,
+    'timestamp': encode_timestamp,
+    'timestamp without time zone': encode_timestamp,
+    'date': encode_date,
+}
+
+def compile_encoder(column_type):
+    '''
+    Returns the binary encoder for a schema column type, raising
+    an exception for types that binary COPY doesn't support
+    '''
+    try:
+        return ENCODERS[type_name(column_type)]
+    except KeyError:
+        raise Exception('Binary COPY does not support column type {column_type}'.format(
+            column_type=column_type
+        ))
+
+class BinaryCopyStream(CopyStream):
+    def __init__(self, rows, columns, column_types, start=0):
+        '''
+        Binary version of CopyStream, which generates PGCOPY data
+        for COPY ... WITH (FORMAT binary). Every value is encoded
+        according to the Postgres type of its column, given in
+        column_types, so the server never has to parse text.
+        The row_id counter is written as an integer.
+        '''
+        super(BinaryCopyStream, self).__init__(rows, columns, start)
+        self.encoders = [compile_encoder(column_type) for column_type in column_types]
+        self.field_count = _pack_int16(len(columns) + 1)
+        self.buffer = PGCOPY_HEADER
+        self.finished = False
+
+    def format_row(self, row):
+        self.row_id += 1
+
+        parts = [self.field_count, _pack_int32(4), _pack_int32(self.row_id)]
+        for column, encode in zip(self.columns, self.encoders):
+            value = row.get(column)
+            if value is None:
+                parts.append(NULL_FIELD)
+            else:
+                data = encode(value)
+                parts.append(_pack_int32(len(data)))
+                parts.append(data)
+
+        return ''.join(parts)
+
+    def next_line(self):
+        line = super(BinaryCopyStream, self).next_line()
+
+        if line is None and not self.finished:
+            self.finished = True
+            return PGCOPY_TRAILER
+
+        return line
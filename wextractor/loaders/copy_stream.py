@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+import re
+
+_ESCAPE_CHARS = re.compile(r'[\\\t\n\r]')
+_ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+def _escape_char(match):
+    return _ESCAPES[match.group()]
+
+def escape_copy_text(value):
+    '''
+    Escapes backslashes, tabs, newlines and carriage returns
+    so that a value can be written into a text format COPY
+    '''
+    return _ESCAPE_CHARS.sub(_escape_char, value)
+
+def format_unicode(value):
+    return escape_copy_text(value.encode('utf-8'))
+
+def format_float(value):
+    # repr keeps every digit, where str rounds to 12
+    return repr(value)
+
+def format_other(value):
+    # e.g. datetimes, whose str() Postgres reads back
+    return escape_copy_text(str(value))
+
+# how non-string values are written as text; none of these
+# ever need escaping
+_TEXT_CONVERTERS = {
+    int: str,
+    long: str,
+    float: format_float,
+    bool: str,
+}
+
+_VALUE_FORMATTERS = dict(_TEXT_CONVERTERS)
+_VALUE_FORMATTERS.update({
+    str: escape_copy_text,
+    unicode: format_unicode,
+})
+
+def value_text(value):
+    '''
+    Returns the unescaped text of a non-string value, written
+    the way format_value writes it
+    '''
+    return _TEXT_CONVERTERS.get(type(value), str)(value)
+
+def format_value(value):
+    '''
+    Formats any non-null python value for a text format COPY
+    '''
+    return _VALUE_FORMATTERS.get(type(value), format_other)(value)
+
+def format_integer(value):
+    if type(value) is int:
+        return str(value)
+    return format_value(value)
+
+def format_text(value):
+    if type(value) is str:
+        return escape_copy_text(value)
+    return format_value(value)
+
+def type_name(column_type):
+    '''
+    Normalizes a column type from a schema, e.g. 'VARCHAR(32)'
+    becomes 'varchar'
+    '''
+    return ' '.join(column_type.split('(')[0].lower().split())
+
+# formatters that check for the most likely python type of a
+# Postgres column type first. Anything else goes through
+# format_value, which handles every type.
+_COLUMN_FORMATTERS = {
+    'smallint': format_integer,
+    'int2': format_integer,
+    'integer': format_integer,
+    'int': format_integer,
+    'int4': format_integer,
+    'serial': format_integer,
+    'bigint': format_integer,
+    'int8': format_integer,
+    'bigserial': format_integer,
+    'text': format_text,
+    'varchar': format_text,
+    'character varying': format_text,
+    'char': format_text,
+    'character': format_text,
+}
+
+def compile_formatter(column_type=None):
+    '''
+    Returns the function that formats non-null values of a
+    column with the given Postgres type for a text format COPY
+    '''
+    if column_type is None:
+        return format_value
+    return _COLUMN_FORMATTERS.get(type_name(column_type), format_value)
+
+class CopyStream(object):
+    def __init__(self, rows, columns, start=0, column_types=None):
+        '''
+        A read-only file-like object that generates text format
+        COPY data from an iterable of row dictionaries as it is
+        read, so that it can be passed straight to psycopg2's
+        copy_from or copy_expert without writing a tempfile.
+
+        Each line starts with a row_id counter that begins after
+        start, followed by the row's values for columns in order.
+        Values are formatted from their python types, with one
+        formatter per column compiled from column_types (the
+        columns' Postgres types) if they are given. None, or a
+        value missing from the row, is written as \\N. At most one
+        row past the requested read size is ever buffered.
+        '''
+        self.rows = iter(rows)
+        self.columns = columns
+        self.row_id = start
+        self.formatters = [
+            compile_formatter(column_type) for column_type in column_types or [None] * len(columns)
+        ]
+        self.buffer = ''
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    def format_row(self, row):
+        self.row_id += 1
+
+        values = [str(self.row_id)]
+        for column, formatter in zip(self.columns, self.formatters):
+            value = row.get(column)
+            if value is None:
+                values.append('\\N')
+            else:
+                values.append(formatter(value))
+
+        return '\t'.join(values) + '\n'
+
+    def next_line(self):
+        try:
+            row = next(self.rows)
+        except StopIteration:
+            return None
+
+        self.rows_written += 1
+        return self.format_row(row)
+
+    def read(self, size=-1):
+        parts, length = [self.buffer], len(self.buffer)
+
+        while size < 0 or length < size:
+            line = self.next_line()
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+
+        data = ''.join(parts)
+
+        if size < 0:
+            self.buffer = ''
+        else:
+            data, self.buffer = data[:size], data[size:]
+
+        self.bytes_written += len(data)
+        return data
+
+    def readline(self, size=-1):
+        if '\n' not in self.buffer:
+            line = self.next_line()
+            if line is not None:
+                self.buffer += line
+
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+
+        data, self.buffer = self.buffer[:end], self.buffer[end:]
+
+        self.bytes_written += len(data)
+        return data
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import tempfile
+import cPickle
+
+# how many hex digits of a row hash SpillingDeduper will partition on
+MAX_SPILL_DEPTH = 8
+
+class Deduper(object):
+    def __init__(self, id_name, fkey_names=(), rehash=None):
+        '''
+        Drops exact duplicate rows from one table in a single pass.
+        Rows are keyed on the content hash that transform_line
+        stores in the id_name column, so rows never have to be
+        re-hashed or copied. The only state kept is the set of
+        hashes seen so far, plus the (hash, fkeys) pairs for
+        tables with fkey_names, which makes a Deduper safe to
+        reuse across batches of the same table.
+
+        Foreign keys are not part of a row's hash, so the same
+        row can turn up under several parent rows. Each of those
+        relationships is kept: the first keeps the content hash
+        as its id, and later ones get the id rehash(row) returns,
+        which should also hash the row's fkeys.
+        '''
+        self.id_name = id_name
+        self.fkey_names = tuple(fkey_names)
+        self.rehash = rehash
+        self.seen = set()
+        self.relations = set()
+        self.rows_in = 0
+        self.rows_out = 0
+
+        if self.fkey_names and rehash is None:
+            raise Exception('Deduping rows with foreign keys needs a rehash function')
+
+    def dedupe(self, rows):
+        '''
+        Yields the first occurrence of every distinct row, and of
+        every distinct set of foreign keys that row appears with
+        '''
+        id_name, seen, relations, fkey_names = self.id_name, self.seen, self.relations, self.fkey_names
+
+        for row in rows:
+            self.rows_in += 1
+
+            row_hash = row[id_name]
+
+            if fkey_names:
+                relation = (row_hash, tuple(row.get(name) for name in fkey_names))
+                if relation in relations:
+                    continue
+                relations.add(relation)
+
+                if row_hash in seen:
+                    # the same row under another parent
+                    row[id_name] = self.rehash(row)
+
+            elif row_hash in seen:
+                continue
+
+            seen.add(row_hash)
+            self.rows_out += 1
+
+            yield row
+
+class SpillingDeduper(object):
+    def __init__(self, id_name, fkey_names=(), rehash=None, memory_limit=256 * 1024 * 1024,
+                 bytes_per_row=128, directory=None):
+        '''
+        Out-of-core version of Deduper for tables whose distinct
+        rows don't fit in memory, see Deduper for fkey_names and
+        rehash. Rows are added one at a time and
+        spilled to temporary run files, partitioned on the first
+        hex digit of their hash. dedupe then reads the partitions
+        back one at a time, so that only one partition's worth of
+        hashes is held in memory.
+
+        memory_limit is the number of bytes of hash state allowed
+        for a partition, at roughly bytes_per_row bytes per row.
+        Partitions with more rows than that are split again on
+        the next hex digit of the hash before being deduplicated.
+        directory is where the run files are written, defaulting
+        to the system temporary directory.
+        '''
+        self.id_name = id_name
+        self.fkey_names = tuple(fkey_names)
+        self.rehash = rehash
+        self.max_rows = max(1, memory_limit // bytes_per_row)
+        self.directory = directory
+        self.partitions = self.new_partitions()
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def new_partitions(self):
+        return [[tempfile.TemporaryFile(dir=self.directory), 0] for i in range(16)]
+
+    def spill(self, partitions, row, depth):
+        partition = partitions[int(row[self.id_name][depth], 16)]
+        cPickle.dump(row, partition[0], 2)
+        partition[1] += 1
+
+    def add(self, row):
+        '''
+        Spills a row to disk to be deduplicated later
+        '''
+        self.rows_in += 1
+        self.spill(self.partitions, row, 0)
+
+    def read_partition(self, partition):
+        run_file = partition[0]
+        run_file.seek(0)
+
+        try:
+            while True:
+                yield cPickle.load(run_file)
+        except EOFError:
+            pass
+        finally:
+            run_file.close()
+
+    def dedupe_partitions(self, partitions, depth):
+        for partition in partitions:
+            if partition[1] > self.max_rows and depth + 1 < MAX_SPILL_DEPTH:
+                # too big to dedupe in memory, split it up further
+                sub_partitions = self.new_partitions()
+                for row in self.read_partition(partition):
+                    self.spill(sub_partitions, row, depth + 1)
+
+                for row in self.dedupe_partitions(sub_partitions, depth + 1):
+                    yield row
+
+            else:
+                # every copy of a row hashes into the same partition
+                deduper = Deduper(self.id_name, self.fkey_names, self.rehash)
+                for row in deduper.dedupe(self.read_partition(partition)):
+                    self.rows_out += 1
+                    yield row
+
+    def dedupe(self):
+        '''
+        Yields the first occurrence of every distinct row that has
+        been added, one partition at a time. Rows come out grouped
+        by partition rather than in the order they were added.
+        '''
+        partitions, self.partitions = self.partitions, []
+        return self.dedupe_partitions(partitions, 0)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import hashlib
+
+DIGEST_TABLE = 'wextractor_table_digests'
+
+DIGEST_MODULUS = 2 ** 128
+
+def table_digest(rows, id_name, fkey_names=()):
+    '''
+    Returns an order-independent (digest, row count) pair for
+    the rows of one deduplicated table. The digest is the sum of
+    every row's hash, as an integer, modulo 2 ** 128. Each row's
+    foreign keys are folded into its value first, so a row that
+    points at a different parent changes the digest too.
+    '''
+    total, count = 0, 0
+
+    for row in rows:
+        value = int(row[id_name], 16)
+        for fkey_name in fkey_names:
+            fkey = row.get(fkey_name)
+            value = value * 31 + (int(fkey, 16) if fkey else 0)
+
+        total += value
+        count += 1
+
+    return '%032x' % (total % DIGEST_MODULUS), count
+
+def table_signature(table_definition, add_pkey, hasher):
+    '''
+    Returns a hash of everything besides the rows that decides
+    what a loaded table looks like: its columns and their types,
+    its keys and indexes and the hasher that generated its ids
+    '''
+    return hashlib.sha1(repr((
+        tuple(table_definition['columns']),
+        table_definition.get('pkey', None),
+        table_definition.get('index', None),
+        bool(add_pkey),
+        type(hasher).__name__,
+        getattr(hasher, 'algorithm', None),
+    ))).hexdigest()
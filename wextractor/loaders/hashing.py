@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import json
+import struct
+import hashlib
+
+try:
+    from hashlib import blake2b
+except ImportError:
+    try:
+        from pyblake2 import blake2b
+    except ImportError:
+        blake2b = None
+
+class RowHasher(object):
+    def hash_row(self, row, columns=None):
+        '''
+        Each RowHasher must implement a hash_row method. It takes
+        a row dictionary and an optional precomputed ordering of
+        the row's columns and returns a stable 32 character
+        hex digest, which becomes the row's id
+        '''
+        raise NotImplementedError
+
+def legacy_string(value):
+    '''
+    Stringifies a value the way older versions of PostgresLoader
+    did before hashing it, with nulls becoming 'NULL'
+    '''
+    if value is None or value == '':
+        return 'NULL'
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+class JsonMd5Hasher(RowHasher):
+    '''
+    Compatibility hasher that hashes rows the way older
+    versions of PostgresLoader did: the md5 of the row, with
+    every value stringified (see legacy_string), serialized as
+    json with sorted keys. Use it to keep ids stable in
+    databases that were loaded with those versions.
+
+    The exception is rows of tables with foreign keys that
+    appeared more than once in the input: those versions
+    re-hashed them together with one of their foreign keys,
+    picked by dict and set ordering, and kept only one of
+    their relationships. Such rows get new ids, so the first
+    load (incremental or not) replaces them.
+    '''
+    def hash_row(self, row, columns=None):
+        row = dict((key, legacy_string(value)) for key, value in row.iteritems())
+        return hashlib.md5(json.dumps(row, sort_keys=True)).hexdigest()
+
+# marks a column that is missing from a row, as opposed to a null one
+MISSING = object()
+
+_pack_length = struct.Struct('>I').pack
+
+def _length_prefixed(tag, value):
+    return tag + _pack_length(len(value)) + value
+
+class BinaryHasher(RowHasher):
+    '''
+    Hashes rows without json serialization. Values are taken in
+    column order and written as type-tagged, length-prefixed
+    byte strings, so that no two different rows can share an
+    encoding, and the result is digested in one call.
+    '''
+    def __init__(self, algorithm='md5'):
+        self.algorithm = algorithm
+
+        if algorithm == 'blake2b':
+            if blake2b is None:
+                raise Exception('blake2b hashing requires Python 3.6+ or the pyblake2 package')
+            self.new = lambda: blake2b(digest_size=16)
+        else:
+            self.new = getattr(hashlib, algorithm)
+
+        self.encoders = {
+            type(None): lambda value: 'N',
+            str: lambda value: _length_prefixed('s', value),
+            unicode: lambda value: _length_prefixed('u', value.encode('utf-8')),
+            bool: lambda value: 'T' if value else 'F',
+            int: lambda value: _length_prefixed('i', str(value)),
+            long: lambda value: _length_prefixed('i', str(value)),
+            float: lambda value: _length_prefixed('f', repr(value)),
+            tuple: self.encode_sequence,
+            list: self.encode_sequence,
+            dict: self.encode_mapping,
+        }
+
+    def encode(self, value):
+        if value is MISSING:
+            return 'M'
+
+        encoder = self.encoders.get(type(value))
+        if encoder is None:
+            # e.g. datetimes, decimals
+            return _length_prefixed('o', type(value).__name__ + ':' + str(value))
+        return encoder(value)
+
+    def encode_sequence(self, values):
+        return 't' + _pack_length(len(values)) + ''.join(self.encode(value) for value in values)
+
+    def encode_mapping(self, row):
+        return 'd' + _pack_length(len(row)) + ''.join(
+            self.encode(key) + self.encode(row[key]) for key in sorted(row)
+        )
+
+    def hash_row(self, row, columns=None):
+        if columns is None:
+            if isinstance(row, dict):
+                encoded = self.encode_mapping(row)
+            else:
+                encoded = self.encode_sequence(row)
+        else:
+            encode, pack, parts = self.encode, _pack_length, []
+            for column in columns:
+                value = row.get(column, MISSING)
+                # plain strings are by far the most common value, so
+                # skip the encoder lookup for them
+                if type(value) is str:
+                    parts.append('s' + pack(len(value)) + value)
+                else:
+                    parts.append(encode(value))
+            encoded = ''.join(parts)
+
+        digest = self.new()
+        digest.update(encoded)
+        return digest.hexdigest()
+
+HASHERS = {
+    'binary': lambda: BinaryHasher('md5'),
+    'blake2b': lambda: BinaryHasher('blake2b'),
+    'json-md5': JsonMd5Hasher,
+}
+
+def get_hasher(hasher):
+    '''
+    Returns a RowHasher. hasher can be a RowHasher instance or
+    the name of one of the HASHERS
+    '''
+    if isinstance(hasher, RowHasher):
+        return hasher
+
+    try:
+        return HASHERS[hasher]()
+    except KeyError:
+        raise Exception('Unknown hasher {hasher}, must be one of {names}'.format(
+            hasher=hasher, names=', '.join(sorted(HASHERS))
+        ))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+class TablePlan(object):
+    '''
+    Everything the per-row transform needs to know about one
+    table in a loader schema, resolved once up front:
+
+    index: the table's position in the schema
+    table_name: the table's name
+    columns: tuple of the table's column names, in schema order
+    hash_columns: the same names sorted, the order rows are hashed in
+    id_name: name of the generated id column (table_name + '_id')
+    pkey_name: column that holds the row id when add_pkey is False
+    fkey_names: id columns of the tables in from_relations
+    from_indexes: schema indexes of the tables in from_relations
+    relations: (table index, column name) pairs that this table's
+        row id is written to, one per table in to_relations
+    '''
+    __slots__ = (
+        'index', 'table_name', 'columns', 'hash_columns', 'id_name',
+        'pkey_name', 'fkey_names', 'from_indexes', 'relations'
+    )
+
+    def __init__(self, index, table_schema, schema):
+        self.index = index
+        self.table_name = table_schema['table_name']
+        self.columns = tuple(column[0] for column in table_schema['columns'])
+        self.hash_columns = tuple(sorted(self.columns))
+        self.id_name = self.table_name + '_id'
+        self.pkey_name = table_schema.get('pkey', None) or self.id_name
+        self.fkey_names = tuple(
+            relationship + '_id' for relationship in table_schema.get('from_relations', None) or []
+        )
+
+        table_indexes = dict(
+            (table['table_name'], ix) for ix, table in enumerate(schema)
+        )
+
+        for relationship in (table_schema.get('to_relations', None) or []) + \
+                (table_schema.get('from_relations', None) or []):
+            if relationship not in table_indexes:
+                raise Exception('Table {table} has a relationship to unknown table {relationship}'.format(
+                    table=self.table_name, relationship=relationship
+                ))
+
+        self.from_indexes = tuple(
+            table_indexes[relationship] for relationship in table_schema.get('from_relations', None) or []
+        )
+        self.relations = [
+            (table_indexes[relationship], self.id_name)
+            for relationship in table_schema.get('to_relations', None) or []
+        ]
+
+    def row_id_name(self, add_pkey):
+        '''
+        Returns the column that a transformed row's id is stored in
+        '''
+        if add_pkey:
+            return self.id_name
+        return self.pkey_name
+
+    def copy_columns(self, add_pkey):
+        '''
+        Returns the sorted names of every column a transformed
+        row can hold, which is the column list used for COPY
+        '''
+        return sorted(set(self.columns + self.fkey_names + (self.row_id_name(add_pkey),)))
+
+def dependency_order(plan):
+    '''
+    Returns the table indexes of a compiled schema ordered so
+    that every table comes after the tables it has foreign keys
+    to (its from_relations). Rows should be inserted in this
+    order and deleted in the reverse order.
+    '''
+    order, visiting, done = [], set(), set()
+
+    def visit(table):
+        if table.index in done:
+            return
+        if table.index in visiting:
+            raise Exception('Circular relationship involving table {table}'.format(table=table.table_name))
+
+        visiting.add(table.index)
+        for index in table.from_indexes:
+            visit(plan[index])
+        visiting.discard(table.index)
+
+        done.add(table.index)
+        order.append(table.index)
+
+    for table in plan:
+        visit(table)
+
+    return order
+
+def compile_schema(schema):
+    '''
+    Builds one TablePlan per table in a loader schema
+    '''
+    return [TablePlan(ix, table_schema, schema) for ix, table_schema in enumerate(schema)]
@@ -1,20 +1,64 @@
 #!/usr/bin/env python
 
 import os
+import time
+import logging
 import tempfile
 import psycopg2
-import json
-from hashlib import md5
-from copy import deepcopy
-
-from collections import defaultdict
+import psycopg2.pool
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 from wextractor.loaders.loader import Loader
+from wextractor.loaders.hashing import get_hasher
+from wextractor.loaders.plan import compile_schema, dependency_order
+from wextractor.loaders.copy_stream import CopyStream, format_value
+from wextractor.loaders.binary_copy import BinaryCopyStream, compile_encoder
+from wextractor.loaders.dedupe import Deduper, SpillingDeduper
+from wextractor.loaders.digest import DIGEST_TABLE, table_digest, table_signature
+from wextractor.instrumentation import Instrumentation
+from wextractor.profiling import profiled
+
+logger = logging.getLogger(__name__)
 
 class PostgresLoader(Loader):
-    def __init__(self, connection_params, schema=None):
+    def __init__(self, connection_params, schema=None, hasher='binary', copy_buffer_size=65536,
+                 pool_size=None, connection=None, instrumentation=None):
+        '''
+        hasher is a RowHasher or the name of one (see
+        wextractor.loaders.hashing). Pass 'json-md5' to keep the
+        md5 ids generated by older versions of the loader, except
+        for duplicated rows with foreign keys (see JsonMd5Hasher).
+
+        copy_buffer_size is the number of bytes psycopg2 reads
+        from a CopyStream at a time, which caps how much COPY data
+        is held in memory for a table.
+
+        By default every load opens and closes its own connection.
+        Pass a pool_size to keep up to that many connections open
+        in a pool that is shared by every load, or pass an open
+        psycopg2 connection to use it for every load. Neither is
+        closed by load; use the loader as a context manager (or
+        call close) to shut the pool down.
+
+        The transform, dedupe, tempfile, copy and index stages of
+        every load are timed by instrumentation, see
+        wextractor.instrumentation. By default each stage is only
+        logged.
+        '''
         super(PostgresLoader, self).__init__(connection_params, schema)
 
+        self.hasher = get_hasher(hasher)
+        self.copy_buffer_size = copy_buffer_size
+        self.pool_size = pool_size
+        self.pool = None
+        self.connection = connection
+        self.prepared_tables = {}
+        self.index_timings = {}
+        # set once the digest table is known to exist, see forget_digests
+        self.digest_table_exists = False
+        self.instrumentation = instrumentation or Instrumentation()
+
         if self.schema is None:
             self.schema = []
 
@@ -26,6 +70,10 @@ class PostgresLoader(Loader):
             elif len(table_schema['columns'][0]) == 1:
                 raise Exception('Column Types are not specified')
 
+        # resolve column names, id columns and relationships once
+        # so that the per-row transform doesn't have to
+        self.plan = compile_schema(self.schema)
+
     def connect(self):
         '''
         The connect method implements the logic behind
@@ -39,15 +87,53 @@ class PostgresLoader(Loader):
         It can also optionally include a hostname, port,
         and password
         '''
+        if self.connection is not None:
+            return self.connection
+
         database = self.connection_params.get('database', None)
         user = self.connection_params.get('user', None)
 
         if not database or not user:
             raise Exception('PostgresLoader must contain "database" and "user" keys')
 
+        if self.pool_size:
+            if self.pool is None:
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    1, self.pool_size, **self.connection_params
+                )
+            return self.pool.getconn()
+
         conn = psycopg2.connect(**self.connection_params)
         return conn
 
+    def release(self, conn):
+        '''
+        Hands back a connection from connect once a load is done
+        with it: pooled connections go back to the pool, an
+        injected connection is left open and anything else is
+        closed
+        '''
+        if conn is self.connection:
+            return
+        elif self.pool is not None:
+            self.pool.putconn(conn, close=bool(conn.closed))
+        else:
+            conn.close()
+
+    def close(self):
+        '''
+        Closes every pooled connection
+        '''
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def generate_drop_table_query(self, table_schema):
         '''
         Generates a cascanding drop table query that will drop
@@ -59,10 +145,16 @@ class PostgresLoader(Loader):
 
         return drop_query
 
-    def generate_create_table_query(self, table_schema):
+    def generate_create_table_query(self, table_schema, primary_key=True, unlogged=False):
         '''
         Geneates a create table query and raises exceptions
         if the table schema generation is malformed
+
+        Pass primary_key=False to leave the primary key off so
+        that it can be added after the data is loaded (see
+        generate_primary_key_query), and unlogged=True to create
+        an UNLOGGED table, which skips the write-ahead log but is
+        emptied if the server crashes.
         '''
         if len(table_schema['columns'][0]) == 2:
             coldefs = 'row_id SERIAL,'
@@ -71,14 +163,224 @@ class PostgresLoader(Loader):
                     '{name} {dtype}'.format(name=name, dtype=dtype) for name, dtype in table_schema['columns']
                 )
 
-            create_query = '''CREATE TABLE IF NOT EXISTS {table} ({coldefs}, PRIMARY KEY({pkey}))'''.format(
+            if primary_key:
+                coldefs += ', PRIMARY KEY({pkey})'.format(pkey=table_schema['pkey'])
+
+            create_query = '''CREATE {unlogged}TABLE IF NOT EXISTS {table} ({coldefs})'''.format(
+                unlogged='UNLOGGED ' if unlogged else '',
                 table=table_schema['table_name'],
-                coldefs=coldefs,
-                pkey=table_schema['pkey']
+                coldefs=coldefs
             )
 
             return create_query
 
+    def generate_primary_key_query(self, table_schema):
+        '''
+        Generates a query that adds the primary key to a table
+        that was created without one
+        '''
+        return '''ALTER TABLE {table} ADD PRIMARY KEY ({pkey})'''.format(
+            table=table_schema['table_name'],
+            pkey=table_schema['pkey']
+        )
+
+    def index_columns(self, table_schema):
+        '''
+        Returns the indexes declared by a table schema's 'index'
+        key as a list of column tuples. The key can name a single
+        column, or hold a list whose entries are either column
+        names or tuples of column names for composite indexes.
+        '''
+        declared = table_schema.get('index', None)
+
+        if not declared:
+            return []
+        elif isinstance(declared, basestring):
+            declared = [declared]
+
+        indexes = []
+        for index in declared:
+            if isinstance(index, basestring):
+                indexes.append((index,))
+            else:
+                indexes.append(tuple(index))
+
+        return indexes
+
+    def table_indexes(self, table_schema):
+        '''
+        Returns a (name, columns) pair for every index a table
+        gets: the ones declared in the schema (see index_columns)
+        followed by one for each foreign key column that isn't
+        already the first column of a declared index
+        '''
+        indexes = self.index_columns(table_schema)
+
+        for relationship in table_schema.get('from_relations', None) or []:
+            if relationship + '_id' not in [columns[0] for columns in indexes]:
+                indexes.append((relationship + '_id',))
+
+        return [
+            ('{table}_{name}_idx'.format(table=table_schema['table_name'], name='_'.join(columns)), columns)
+            for columns in indexes
+        ]
+
+    def generate_index_query(self, table_schema, name, columns, concurrently=False):
+        '''
+        Generates a create index query. Indexes created
+        concurrently don't lock out writes to the table, but
+        can't be created inside a transaction.
+        '''
+        return '''CREATE INDEX {concurrently}{name} ON {table} ({columns})'''.format(
+            concurrently='CONCURRENTLY ' if concurrently else '',
+            name=name,
+            table=table_schema['table_name'],
+            columns=', '.join(columns)
+        )
+
+    def generate_index_queries(self, table_schema, concurrently=False):
+        '''
+        Generates a create index query for every index on a
+        table, see table_indexes
+        '''
+        return [
+            self.generate_index_query(table_schema, name, columns, concurrently)
+            for name, columns in self.table_indexes(table_schema)
+        ]
+
+    def index_validity(self, cursor, name):
+        '''
+        Checks whether an index with the given name exists and is
+        valid. Returns None if there is no such index and False
+        for an invalid one, which is what a failed CREATE INDEX
+        CONCURRENTLY leaves behind.
+        '''
+        cursor.execute(
+            '''SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s AND pg_table_is_visible(c.oid)''',
+            (name,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return bool(row[0])
+
+    def generate_drop_index_query(self, name):
+        return '''DROP INDEX IF EXISTS {name}'''.format(name=name)
+
+    def create_index(self, cursor, table_schema, name, columns, concurrently=False):
+        '''
+        Creates one index, recording how long it took to build
+        in index_timings
+        '''
+        with self.instrumentation.stage('index', name):
+            start = time.time()
+            cursor.execute(self.generate_index_query(table_schema, name, columns, concurrently))
+            self.index_timings[name] = time.time() - start
+
+    def build_table_indexes(self, table_schema, session_settings=None):
+        '''
+        Creates every missing index on one table concurrently,
+        over a connection of its own in autocommit mode. Invalid
+        indexes are dropped and built again. session_settings
+        (e.g. maintenance_work_mem) are set for the session while
+        the indexes are built and reset afterwards.
+        '''
+        conn = self.connect()
+        autocommit = conn.autocommit
+
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+
+            # every statement commits on its own, so SET LOCAL
+            # wouldn't outlast it
+            self.apply_session_settings(cursor, session_settings, local=False)
+
+            try:
+                for name, columns in self.table_indexes(table_schema):
+                    valid = self.index_validity(cursor, name)
+                    if valid:
+                        continue
+                    elif valid is False:
+                        cursor.execute(self.generate_drop_index_query(name))
+
+                    self.create_index(cursor, table_schema, name, columns, concurrently=True)
+
+            finally:
+                self.reset_session_settings(cursor, session_settings)
+
+        finally:
+            conn.autocommit = autocommit
+            self.release(conn)
+
+    def build_indexes(self, tables, workers=None, session_settings=None):
+        '''
+        Creates the indexes on every table once the data has been
+        committed, see build_table_indexes. If workers is greater
+        than one, that many tables are indexed at once, unless
+        the loader was given a connection, which can only build
+        one index at a time.
+        '''
+        tables = [table for table in tables if self.table_indexes(table)]
+
+        if workers is not None and workers > 1 and self.connection is None:
+            pool = ThreadPool(workers)
+            try:
+                pool.map(lambda table: self.build_table_indexes(table, session_settings), tables)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for table in tables:
+                self.build_table_indexes(table, session_settings)
+
+    def generate_analyze_query(self, table_schema):
+        return '''ANALYZE {table}'''.format(table=table_schema['table_name'])
+
+    def apply_session_settings(self, cursor, session_settings, local=True):
+        '''
+        Applies a dictionary of server settings, for example
+        {'maintenance_work_mem': '1GB', 'synchronous_commit': 'off'},
+        with SET LOCAL so that they only last for the current
+        transaction, or if local is False for the rest of the
+        session, see reset_session_settings
+        '''
+        for name in sorted(session_settings or {}):
+            cursor.execute(
+                '''SET {local}{name} = %s'''.format(local='LOCAL ' if local else '', name=name),
+                (str(session_settings[name]),)
+            )
+
+    def reset_session_settings(self, cursor, session_settings):
+        '''
+        Undoes apply_session_settings with local=False
+        '''
+        for name in sorted(session_settings or {}):
+            cursor.execute('''RESET {name}'''.format(name=name))
+
+    def add_constraints(self, cursor, tables, bulk=False):
+        '''
+        Runs everything that has to happen after the data is in
+        place. Tables loaded in bulk mode get their primary keys
+        and indexes first, all foreign keys are added, and
+        bulk loaded tables are then analyzed so the planner has
+        statistics for them straight away.
+        '''
+        if bulk:
+            for table in tables:
+                cursor.execute(self.generate_primary_key_query(table))
+                for name, columns in self.table_indexes(table):
+                    self.create_index(cursor, table, name, columns)
+
+        for table in tables:
+            for ix, relationship in enumerate(table.get('from_relations', [])):
+                fk_query = self.generate_foreign_key_query(table, ix)
+                cursor.execute(fk_query)
+
+        if bulk:
+            for table in tables:
+                cursor.execute(self.generate_analyze_query(table))
+
     def generate_foreign_key_query(self, table, i=0):
         '''
         Generates alter table statements that add formal
@@ -97,6 +399,194 @@ class PostgresLoader(Loader):
             relationship=table['from_relations'][i]
         )
 
+    def generate_swap_queries(self, table_schema, staging_name, primary_key=True):
+        '''
+        Generates the queries that replace a table with its fully
+        loaded staging copy. The staging table's primary key index
+        and row_id sequence are renamed along with it so that the
+        next load can create a fresh staging table. Pass
+        primary_key=False if the staging table has no primary key.
+        '''
+        table = table_schema['table_name']
+
+        queries = [
+            self.generate_drop_table_query(table_schema),
+            'ALTER TABLE {staging} RENAME TO {table}'.format(staging=staging_name, table=table),
+        ]
+
+        if primary_key:
+            queries.append(
+                'ALTER INDEX {staging}_pkey RENAME TO {table}_pkey'.format(staging=staging_name, table=table)
+            )
+
+        queries.append(
+            'ALTER SEQUENCE {staging}_row_id_seq RENAME TO {table}_row_id_seq'.format(
+                staging=staging_name, table=table
+            )
+        )
+
+        return queries
+
+    def generate_incoming_table_query(self, table_schema):
+        '''
+        Generates a query that creates a temporary table shaped
+        like an existing table to COPY new rows into. It is dropped
+        automatically at the end of the transaction.
+        '''
+        return '''CREATE TEMP TABLE {table}_incoming (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP'''.format(
+            table=table_schema['table_name']
+        )
+
+    def generate_delete_vanished_query(self, table_schema):
+        '''
+        Generates a query that deletes every row whose primary
+        key is not in the table's incoming rows
+        '''
+        return '''DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM {table}_incoming WHERE {table}_incoming.{pkey} = {table}.{pkey})'''.format(
+            table=table_schema['table_name'],
+            pkey=table_schema['pkey']
+        )
+
+    def generate_upsert_query(self, table_schema, columns, fkey_columns=()):
+        '''
+        Generates a query that inserts the table's incoming rows.
+        Row ids only hash a row's own columns, so a row that is
+        already present can still point at a different parent
+        now: its fkey_columns are updated to the incoming values,
+        and rows whose keys haven't changed are left alone.
+        Requires Postgres 9.5 or later.
+        '''
+        query = '''INSERT INTO {table} ({columns}) SELECT {columns} FROM {table}_incoming ON CONFLICT ({pkey})'''.format(
+            table=table_schema['table_name'],
+            columns=', '.join(columns),
+            pkey=table_schema['pkey']
+        )
+
+        if not fkey_columns:
+            return query + ' DO NOTHING'
+
+        return query + ''' DO UPDATE SET {updates} WHERE ({current}) IS DISTINCT FROM ({incoming})'''.format(
+            updates=', '.join(
+                '{column} = EXCLUDED.{column}'.format(column=column) for column in fkey_columns
+            ),
+            current=', '.join(
+                '{table}.{column}'.format(table=table_schema['table_name'], column=column)
+                for column in fkey_columns
+            ),
+            incoming=', '.join('EXCLUDED.{column}'.format(column=column) for column in fkey_columns)
+        )
+
+    def foreign_key_exists(self, cursor, table, i=0):
+        '''
+        Checks whether the foreign key generated by
+        generate_foreign_key_query already exists, using the
+        name Postgres gives it by default
+        '''
+        cursor.execute(
+            'SELECT 1 FROM pg_constraint WHERE conname = %s',
+            ('{table}_{id}_fkey'.format(
+                table=table['table_name'], id=table['from_relations'][i] + '_id'
+            ),)
+        )
+        return cursor.fetchone() is not None
+
+    def generate_digest_table_query(self):
+        '''
+        Generates a query that creates the table that per-table
+        digests are kept in between loads
+        '''
+        return '''CREATE TABLE IF NOT EXISTS {digests} (table_name VARCHAR PRIMARY KEY, digest VARCHAR(32), row_count BIGINT, signature VARCHAR(40), loaded_at TIMESTAMP DEFAULT now())'''.format(
+            digests=DIGEST_TABLE
+        )
+
+    def table_digests(self, tables, add_pkey):
+        '''
+        Returns a (digest, row count, signature) tuple for each
+        table of transformed and deduplicated rows, see
+        wextractor.loaders.digest
+        '''
+        definitions = self.table_definitions(add_pkey)
+
+        return [
+            table_digest(rows, self.plan[ix].row_id_name(add_pkey), self.plan[ix].fkey_names) +
+            (table_signature(definitions[ix], add_pkey, self.hasher),)
+            for ix, rows in enumerate(tables)
+        ]
+
+    def changed_tables(self, cursor, digests):
+        '''
+        Compares digests with the ones stored by the last load and
+        returns the indexes of the tables that have to be loaded
+        again: tables that changed or don't exist, and every table
+        with a foreign key to one of those, since dropping a table
+        drops the foreign keys that point at it
+        '''
+        cursor.execute(self.generate_digest_table_query())
+        cursor.execute(
+            '''SELECT table_name, digest, row_count, signature FROM {digests} WHERE EXISTS ({exists})'''.format(
+                digests=DIGEST_TABLE, exists=self.generate_table_exists_query('table_name')
+            )
+        )
+        stored = dict((row[0], tuple(row[1:])) for row in cursor.fetchall())
+
+        changed = set()
+        for ix in dependency_order(self.plan):
+            table = self.plan[ix]
+            if stored.get(table.table_name) != digests[ix] or \
+                    [parent for parent in table.from_indexes if parent in changed]:
+                changed.add(ix)
+
+        return sorted(changed)
+
+    def store_digests(self, cursor, digests, indexes):
+        '''
+        Records the digests of the tables that were just loaded
+        '''
+        for ix in indexes:
+            table_name = self.plan[ix].table_name
+            cursor.execute(
+                '''DELETE FROM {digests} WHERE table_name = %s'''.format(digests=DIGEST_TABLE),
+                (table_name,)
+            )
+            cursor.execute(
+                '''INSERT INTO {digests} (table_name, digest, row_count, signature) VALUES (%s, %s, %s, %s)'''.format(
+                    digests=DIGEST_TABLE
+                ),
+                (table_name,) + tuple(digests[ix])
+            )
+
+    def generate_table_exists_query(self, table_name):
+        '''
+        Generates a query that selects a row if a table called
+        table_name (a column or placeholder) is on the search
+        path. Works on any Postgres, unlike to_regclass (9.4+).
+        '''
+        return '''SELECT 1 FROM pg_class WHERE relname = {table_name} AND relkind = 'r' AND pg_table_is_visible(oid)'''.format(
+            table_name=table_name
+        )
+
+    def forget_digests(self, cursor, tables):
+        '''
+        Removes the stored digests of tables that are loaded
+        without skip_unchanged, so that a later skip_unchanged
+        load can't compare against a digest that no longer
+        matches what the table holds.
+
+        This costs every load a round trip to check for the
+        digest table, until it is found (or created by a
+        skip_unchanged load) and remembered, and then one DELETE.
+        '''
+        if not self.digest_table_exists:
+            cursor.execute(self.generate_table_exists_query('%s'), (DIGEST_TABLE,))
+            if cursor.fetchone() is None:
+                return
+            self.digest_table_exists = True
+
+        cursor.execute(
+            '''DELETE FROM {digests} WHERE table_name = ANY(%s)'''.format(digests=DIGEST_TABLE),
+            ([table['table_name'] for table in tables],)
+        )
+
     def null_replace(self, field):
         '''
         Replaces empty string, None with 'NULL' for Postgres loading
@@ -109,92 +599,118 @@ class PostgresLoader(Loader):
 
         return field
 
-    def hash_row(self, row):
+    def null_normalize(self, field):
+        '''
+        Replaces empty strings with None, leaving every other
+        value as it is
+        '''
+        if field == '' and type(field) in [str, unicode]:
+            return None
+
+        return field
+
+    def hash_row(self, row, columns=None):
         '''
-        Return an md5 hash of a row's contents (minus its index). This hash
-        will turn into the table's new primary key.
+        Return a hash of a row's contents (minus its index), using
+        the loader's hasher. This hash will turn into the table's
+        new primary key.
         '''
-        return md5(json.dumps(row, sort_keys=True)).hexdigest()
+        return self.hasher.hash_row(row, columns)
 
-    def simple_dedupe(self, idx, table):
+    def simple_dedupe(self, idx, table, add_pkey=True):
         '''
         Takes in a table that has been transformed by the
         transform_to_schema method but not been deduplicated.
-        This method simply attempts to determine if the row
-        is an exact replica (minus fkeys). If it is, it checks to
-        make sure the fkeys are the same and handles the event that
-        the relationships are to different places and thus should
-        be different rows (by modifying the primary key). Returns
-        a deduplicated list.
+        This method simply drops rows that are exact replicas
+        of a row seen earlier, keyed on the row hash computed by
+        transform_line and the row's fkeys, see Deduper. Returns
+        a deduplicated list in first-seen order.
         '''
-        checker, output, pkey, fkey = {}, [], {}, {}
+        deduper = self.table_deduper(self.plan[idx], add_pkey)
+        return self.dedupe_rows(deduper, self.plan[idx].table_name, table)
 
-        pkey_name = self.schema[idx]['table_name'] + '_id'
-        fkeys_name = [i + '_id' for i in self.schema[idx].get('from_relations', [])]
+    def table_deduper(self, table, add_pkey, spill=False, **kwargs):
+        '''
+        Returns a Deduper (or with spill, a SpillingDeduper
+        taking kwargs) for one table of the compiled schema.
+        Rows that turn up under more than one parent are given
+        an id that hashes their fkeys as well.
+        '''
+        columns = table.hash_columns + table.fkey_names
 
-        for row in table:
-            # store the value of the primary key
-            pkey[pkey_name] = row.pop(pkey_name, None)
-            for key in fkeys_name:
-                # store the values of the primary key
-                fkey[key] = row.pop(key, None)
+        def rehash(row):
+            return self.hash_row(dict((column, row[column]) for column in columns if column in row), columns)
 
-            row_as_tuple = tuple(row.items())
+        deduper_class = SpillingDeduper if spill else Deduper
+        return deduper_class(table.row_id_name(add_pkey), table.fkey_names, rehash, **kwargs)
 
-            # Use try/except because it's faster than checking if
-            # the key is in the dictionary keys
-            try:
-                row_with_fkey = dict(row.items() + fkey.items())
+    def dedupe_rows(self, deduper, table_name, rows):
+        '''
+        Runs rows through a Deduper as one instrumented 'dedupe'
+        stage and returns the rows that are kept
+        '''
+        rows_in, rows_out = deduper.rows_in, deduper.rows_out
 
-                checker[row_as_tuple]['pkey'].add(
-                    (pkey_name, self.hash_row(row_with_fkey))
-                )
+        with self.instrumentation.stage('dedupe', table_name) as stats:
+            output = list(deduper.dedupe(rows))
+            stats.rows_in = deduper.rows_in - rows_in
+            stats.rows_out = deduper.rows_out - rows_out
 
-                checker[row_as_tuple]['fkey'].add(tuple(fkey.items()))
-
-            except KeyError:
-                # make a deep copy because calling .pop() will update
-                # every single one of these otherwise
-                fkey_copy = deepcopy(fkey)
-                # create a tuple of tuples for proper extraction later
-                pkey_tuple = ((pkey_name, self.hash_row(row)),)
-                checker[row_as_tuple] = {
-                    'pkey': set(pkey_tuple),
-                    'fkey': set(tuple(fkey_copy.items()))
-                }
-
-        # We should now have deduplicated everything, so we just
-        # reshape the checker dictionary into the list of dict format
-        # that the remainder should expect
-        for checker_row, table_keys in checker.items():
-
-            if len(table_keys['fkey']) == 0 or len(fkeys_name) == 0:
-                final_output = dict(checker_row)
-                final_output.update(dict(table_keys['pkey']))
-
-            elif len(table_keys['pkey']) == 1 and len(table_keys['fkey']) == 1:
-                final_output = dict(checker_row)
-                final_output.update(dict(table_keys['pkey']))
-                final_output.update(dict(table_keys['fkey']))
-
-            elif len(table_keys['pkey']) == len(table_keys['fkey']):
-                for fkey in table_keys['fkey']:
-                    new_pkey = self.hash_row(checker_row + fkey)
-
-                    final_output = dict(checker_row)
-                    final_output.update({pkey_name: new_pkey})
-                    try:
-                        final_output.update(dict((fkey,)))
-                    except:
-                        final_output.update(dict(fkey))
+        return output
 
-            else:
-                # TODO: Implement something to handle this
-                raise Exception('pkey/fkey mismatch.')
+    def transform_rows(self, lines, add_pkey, tables):
+        '''
+        Transforms lines as one instrumented 'transform' stage,
+        passing every new row to the add function for its table
+        in tables, e.g. a list's append
+        '''
+        with self.instrumentation.stage('transform') as stats:
+            rows_in = 0
+            transform_line = self.transform_line
 
-            output.append(final_output)
+            for line in lines:
+                rows_in += 1
+                for add, new_row in zip(tables, transform_line(line, add_pkey)):
+                    add(new_row)
 
-        return output
+            stats.rows_in = rows_in
+            stats.rows_out = rows_in * len(tables)
+
+    def transform_line(self, line, add_pkey):
+        '''
+        Transforms a single line of extracted data into one new
+        row per table in the schema. Values keep the types the
+        extractor gave them, except that empty strings become
+        None; they are only formatted by the COPY stream. Each
+        row gets its hashed id, and rows in tables with
+        to_relations get their id written into the related
+        tables' rows from the same line.
+        '''
+        rows, row_ids = [], []
+        null_normalize = self.null_normalize
+
+        for table in self.plan:
+
+            # initialize the new row to add to the final loaded data
+            new_row = dict()
+
+            for col_name in table.columns:
+                if col_name in line:
+                    # extend the new row with the value of the cell
+                    new_row[col_name] = null_normalize(line[col_name])
+
+            row_id = self.hash_row(new_row, table.hash_columns)
+            new_row[table.row_id_name(add_pkey)] = row_id
+
+            rows.append(new_row)
+            row_ids.append(row_id)
+
+        # once we have added all of the data fields, add the relationships
+        for table in self.plan:
+            for rel_index, id_name in table.relations:
+                rows[rel_index][id_name] = row_ids[table.index]
+
+        return rows
 
     def transform_to_schema(self, data, add_pkey):
         '''
@@ -222,52 +738,89 @@ class PostgresLoader(Loader):
         '''
         # start by generating the output list of lists
         output = [list() for i in range(len(self.schema))]
-        holder = [defaultdict(list) for i in range(len(self.schema))]
 
-        # initialize a dictionary to hold potential duplicates
-        deduper = {}
+        self.transform_rows(data, add_pkey, [table.append for table in output])
+
+        final_output = []
+        for table_ix, table in enumerate(output):
+            final_output.append(self.simple_dedupe(table_ix, table, add_pkey))
 
-        for ix, line in enumerate(data):
-            for table_idx, table in enumerate(self.schema):
+        return final_output
 
-                col_names = zip(*table['columns'])[0]
+    def iter_batches(self, data, add_pkey, batch_size):
+        '''
+        Streaming version of transform_to_schema. Takes any
+        iterable of rows, transforms and dedupes it batch_size
+        lines at a time and yields one list of tables per batch.
 
-                # initialize the new row to add to the final loaded data
-                new_row = dict()
+        Rows that were already yielded by an earlier batch are
+        dropped. The only state kept between batches is each
+        table's Deduper.
+        '''
+        if batch_size < 1:
+            raise Exception('batch_size must be a positive integer')
 
-                for cell in line.iteritems():
+        dedupers = [self.table_deduper(table, add_pkey) for table in self.plan]
 
-                    if cell[0] in col_names:
-                        # extend the new row with the value of the cell
-                        new_row[cell[0]] = str(self.null_replace(cell[1]))
-                    else:
-                        continue
+        data = iter(data)
 
-                row_id = self.hash_row(new_row)
-                if add_pkey or table.get('pkey', None) is None:
-                    new_row[table['table_name'] + '_id'] = row_id
-                else:
-                    new_row[table['pkey']] = row_id
+        while True:
+            batch = list(islice(data, batch_size))
+            if not batch:
+                break
 
-                # once we have added all of the data fields, add the relationships
-                for relationship in table.get('to_relations', []):
-                    # find the index of the matching relationship table
-                    rel_index = next(index for (index, d) in enumerate(self.schema) if d['table_name'] == relationship)
-                    output[rel_index][ix][self.schema[table_idx]['table_name'] + '_id'] = row_id
+            tables = [list() for i in range(len(self.schema))]
 
-                output[table_idx].extend([new_row])
+            self.transform_rows(batch, add_pkey, [table.append for table in tables])
 
-        final_output = []
-        for table_ix, table in enumerate(output):
-            final_output.append(self.simple_dedupe(table_ix, table))
+            yield [
+                self.dedupe_rows(dedupers[table_ix], self.plan[table_ix].table_name, table)
+                for table_ix, table in enumerate(tables)
+            ]
 
-        return final_output
+    def spill_transform(self, data, add_pkey, memory_limit=None):
+        '''
+        Out-of-core version of transform_to_schema. Transforms
+        every line of data, spilling each table's rows to
+        temporary run files as it goes (see SpillingDeduper), and
+        returns one generator of deduplicated rows per table.
+        memory_limit caps the bytes of dedupe state per table.
+        '''
+        kwargs = {}
+        if memory_limit is not None:
+            kwargs['memory_limit'] = memory_limit
+
+        dedupers = [self.table_deduper(table, add_pkey, spill=True, **kwargs) for table in self.plan]
+
+        self.transform_rows(data, add_pkey, [deduper.add for deduper in dedupers])
 
-    def generate_data_tempfile(self, data):
+        return [deduper.dedupe() for deduper in dedupers]
+
+    def transformed_batches(self, data, add_pkey, batch_size=None, dedupe='memory', memory_limit=None):
+        '''
+        Returns an iterable of batches, each holding one iterable
+        of transformed and deduplicated rows per table, for the
+        given batch_size and dedupe mode ('memory' or 'spill')
+        '''
+        if dedupe == 'spill':
+            if batch_size is not None:
+                raise Exception('batch_size can not be combined with spilled deduplication')
+            return [self.spill_transform(data, add_pkey, memory_limit)]
+        elif dedupe != 'memory':
+            raise Exception('dedupe must be either "memory" or "spill"')
+
+        if batch_size is None:
+            return [self.transform_to_schema(data, add_pkey)]
+        return self.iter_batches(data, add_pkey, batch_size)
+
+    def generate_data_tempfile(self, data, start=0):
         '''
         Takes in a list and generates a temporary tab-separated
         file. This file can then be consumed by the Postgres \COPY
-        function
+        function. row_id numbering begins after start, so that
+        several batches can be written to the same table.
+
+        NOTE: load streams data with generate_copy_stream instead
         '''
 
         tmp_file = tempfile.TemporaryFile(dir=os.getcwd())
@@ -275,33 +828,425 @@ class PostgresLoader(Loader):
         if len(data) == 0:
             return tmp_file, None
 
-        n = 0
+        n = start
+
+        with self.instrumentation.stage('tempfile', rows_in=len(data)) as stats:
+            for row in data:
+                row = sorted(row.items())
 
-        for row in data:
-            row = sorted(row.items())
+                n += 1
+                if n % 10000 == 0:
+                    logger.debug('Wrote {n} lines'.format(n=n))
 
-            n += 1
-            if n % 10000 == 0:
-                print 'Wrote {n} lines'.format(n=n)
+                rowstr = '\t'.join(
+                    [str(n)] + ['\\N' if i[1] is None else format_value(i[1]) for i in row]
+                ) + '\n'
 
-            rowstr = '\t'.join([str(n)] + [i[1] for i in row]) + '\n'
+                tmp_file.write(rowstr)
 
-            tmp_file.write(rowstr)
+            stats.rows_out = n - start
+            stats.bytes_written = tmp_file.tell()
 
         tmp_file.seek(0)
 
         return tmp_file, ['row_id'] + sorted(data[0].keys())
 
-    def load(self, data, add_pkey=True):
+    def generate_copy_stream(self, data, table_plan, add_pkey, start=0, format='text'):
+        '''
+        Takes in an iterable of transformed rows and returns a
+        CopyStream that formats them for the Postgres COPY
+        function as it is read, along with the list of columns
+        to copy into. Nothing is written to disk. Pass
+        format='binary' for a BinaryCopyStream instead.
+        '''
+        columns = table_plan.copy_columns(add_pkey)
+
+        column_types = self.column_types(table_plan, add_pkey)
+
+        if format == 'binary':
+            stream = BinaryCopyStream(data, columns, column_types, start)
+        else:
+            stream = CopyStream(data, columns, start, column_types)
+
+        return stream, ['row_id'] + columns
+
+    def column_types(self, table_plan, add_pkey):
+        '''
+        Returns the declared Postgres types of a table's COPY
+        columns, in the same order as copy_columns
+        '''
+        types = dict(self.table_definitions(add_pkey)[table_plan.index]['columns'])
+        return [types[column] for column in table_plan.copy_columns(add_pkey)]
+
+    def check_copy_format(self, format, add_pkey):
+        '''
+        Raises if format isn't 'text' or 'binary', or if it is
+        'binary' and a column has a type that binary COPY can't
+        encode, so that a load fails before touching any table
+        '''
+        if format == 'binary':
+            for table_plan in self.plan:
+                for column_type in self.column_types(table_plan, add_pkey):
+                    compile_encoder(column_type)
+        elif format != 'text':
+            raise Exception('format must be either "text" or "binary"')
+
+    def copy_rows(self, cursor, table_name, data, table_plan, add_pkey, start=0, format='text'):
+        '''
+        COPYs an iterable of transformed rows into table_name in
+        the given format and returns the stream they were read
+        through
+        '''
+        stream, column_names = self.generate_copy_stream(data, table_plan, add_pkey, start, format)
+
+        with self.instrumentation.stage('copy', table_name) as stats:
+            if format == 'binary':
+                cursor.copy_expert(
+                    '''COPY {table} ({columns}) FROM STDIN WITH (FORMAT binary)'''.format(
+                        table=table_name, columns=', '.join(column_names)
+                    ),
+                    stream, size=self.copy_buffer_size
+                )
+            else:
+                cursor.copy_from(
+                    stream, table_name, sep='\t',
+                    size=self.copy_buffer_size, columns=column_names
+                )
+
+            stats.rows_out = stream.rows_written
+            stats.bytes_written = stream.bytes_written
+
+        return stream
+
+    def table_definition(self, table_schema, add_pkey):
+        '''
+        Returns a copy of a table schema with the id column and
+        any foreign key columns added, ready to be passed to the
+        create table query generator
+        '''
+        table = dict(table_schema)
+
+        table['columns'] = ( (table['table_name'] + '_id', 'VARCHAR(32)'), ) + table['columns']
+
+        if add_pkey or table.get('pkey', None) is None:
+            table['pkey'] = table['table_name'] + '_id'
+
+        if table.get('from_relations', None):
+            for relationship in table['from_relations']:
+                table['columns'] += ( ( relationship + '_id', 'VARCHAR(32)' ), )
+
+        return table
+
+    def table_definitions(self, add_pkey):
+        '''
+        Returns the table definitions for every table in the
+        schema. They are only generated once per add_pkey value
+        and reused by later loads.
+        '''
+        if add_pkey not in self.prepared_tables:
+            self.prepared_tables[add_pkey] = [
+                self.table_definition(table, add_pkey) for table in self.schema
+            ]
+        return self.prepared_tables[add_pkey]
+
+    def copy_table(self, table_name, data, table_plan, add_pkey, session_settings=None, format='text'):
+        '''
+        Opens a connection of its own and COPYs one table's rows
+        into table_name, committing when done. Used by
+        parallel_load to load several tables at once.
+        '''
+        conn = None
+
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+
+            self.apply_session_settings(cursor, session_settings)
+
+            self.copy_rows(cursor, table_name, data, table_plan, add_pkey, format=format)
+
+            conn.commit()
+
+        except:
+            # roll back on any error, not just database ones, so
+            # that an injected connection isn't left mid-transaction
+            if conn:
+                conn.rollback()
+            raise
+
+        finally:
+            if conn:
+                self.release(conn)
+
+    def parallel_load(self, data, add_pkey, workers, dedupe='memory', memory_limit=None,
+                      bulk=False, unlogged=False, session_settings=None, index_workers=None, format='text'):
+        '''
+        Loads every table concurrently, each over its own
+        connection. Rows are first COPYed into fresh staging
+        tables; once every COPY has succeeded, the live tables
+        are swapped for the staging tables and the foreign keys
+        are added in a single transaction, so readers see either
+        the old data or all of the new data. If anything fails,
+        the staging tables are dropped and the live tables are
+        left untouched.
+
+        In bulk mode the primary keys and indexes are built in
+        that same transaction, after the swap. Otherwise the
+        indexes are built concurrently once it has committed.
+        '''
+        tables = self.table_definitions(add_pkey)
+        staging_names = [table['table_name'] + '_staging' for table in tables]
+
+        transformed = self.transformed_batches(data, add_pkey, None, dedupe, memory_limit)[0]
+
+        conn = None
+
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+
+            for table, staging_name in zip(tables, staging_names):
+                staging_table = dict(table, table_name=staging_name)
+                cursor.execute(self.generate_drop_table_query(staging_table))
+                cursor.execute(self.generate_create_table_query(
+                    staging_table, primary_key=not bulk, unlogged=unlogged
+                ))
+
+            conn.commit()
+
+            pool = ThreadPool(workers)
+            try:
+                pool.map(lambda ix: self.copy_table(
+                    staging_names[ix], transformed[ix], self.plan[ix], add_pkey, session_settings, format
+                ), range(len(tables)))
+            finally:
+                pool.close()
+                pool.join()
+
+            self.apply_session_settings(cursor, session_settings)
+            self.forget_digests(cursor, tables)
+
+            for table, staging_name in zip(tables, staging_names):
+                for query in self.generate_swap_queries(table, staging_name, primary_key=not bulk):
+                    cursor.execute(query)
+
+            self.add_constraints(cursor, tables, bulk)
+
+            conn.commit()
+
+        except:
+            if conn:
+                conn.rollback()
+                try:
+                    cursor = conn.cursor()
+                    for staging_name in staging_names:
+                        cursor.execute(self.generate_drop_table_query({'table_name': staging_name}))
+                    conn.commit()
+                except psycopg2.Error:
+                    # don't hide the original error behind a failed cleanup
+                    pass
+            raise
+
+        finally:
+            if conn:
+                self.release(conn)
+
+        if not bulk:
+            self.build_indexes(tables, index_workers, session_settings)
+
+    def incremental_load(self, data, add_pkey, batch_size=None, dedupe='memory', memory_limit=None,
+                         session_settings=None, index_workers=None, format='text'):
+        '''
+        Updates existing tables in place instead of dropping and
+        recreating them. Rows are COPYed into temporary incoming
+        tables, new ids are inserted, existing rows get their
+        foreign keys updated if they moved to another parent (see
+        generate_upsert_query), and rows whose ids have vanished
+        are deleted. Because ids are content hashes, unchanged
+        rows are never touched, and
+        dependent views and grants survive. Tables and foreign keys
+        and indexes are only created if they don't exist yet.
+        '''
+        tables = self.table_definitions(add_pkey)
+        order = dependency_order(self.plan)
+
+        conn = None
+
+        try:
+            conn = self.connect()
+            cursor = conn.cursor()
+
+            self.apply_session_settings(cursor, session_settings)
+            self.forget_digests(cursor, tables)
+
+            for table in tables:
+                cursor.execute(self.generate_create_table_query(table))
+                cursor.execute(self.generate_incoming_table_query(table))
+
+            batches = self.transformed_batches(data, add_pkey, batch_size, dedupe, memory_limit)
+
+            for batch in batches:
+                for ix, table in enumerate(tables):
+                    if isinstance(batch[ix], list) and len(batch[ix]) == 0:
+                        continue
+
+                    self.copy_rows(
+                        cursor, table['table_name'] + '_incoming', batch[ix], self.plan[ix], add_pkey,
+                        format=format
+                    )
+
+            # insert parents before the children that point to them,
+            # and only then delete vanished rows, children first, so
+            # that no child still points at a parent being deleted
+            for ix in order:
+                cursor.execute(self.generate_upsert_query(
+                    tables[ix], self.plan[ix].copy_columns(add_pkey), self.plan[ix].fkey_names
+                ))
+
+            for ix in reversed(order):
+                cursor.execute(self.generate_delete_vanished_query(tables[ix]))
+
+            for table in tables:
+                for ix, relationship in enumerate(table.get('from_relations', [])):
+                    if not self.foreign_key_exists(cursor, table, ix):
+                        cursor.execute(self.generate_foreign_key_query(table, ix))
+
+            conn.commit()
+
+        except:
+            if conn:
+                conn.rollback()
+            raise
+
+        finally:
+            if conn:
+                self.release(conn)
+
+        self.build_indexes(tables, index_workers, session_settings)
+
+    def load(self, data, add_pkey=True, batch_size=None, workers=None, incremental=False,
+             dedupe='memory', memory_limit=None, bulk=False, unlogged=False, session_settings=None,
+             index_workers=None, format='text', skip_unchanged=False, profile=None):
         '''
         Main method for final Postgres loading.
 
         Takes in data and a flag for adding a primary key and
         transforms the input data to the proper schema, generates
         relationships, does simple deduplcation on exact matches,
-        writes a tempfile with all of the data, boots up a
-         connection to Postgres, and loads everything in
+        boots up a connection to Postgres, and streams everything
+        in with COPY
+
+        If a batch_size is passed, data can be any iterable
+        (for example an extractor's iter_extract generator). It
+        is transformed, deduplicated and copied batch_size lines
+        at a time, so memory scales with the batch rather than
+        with the size of the input.
+
+        If workers is greater than one, tables are COPYed
+        concurrently over that many connections, see
+        parallel_load. When loading through a pool, the pool_size
+        must be at least workers + 1.
+
+        If incremental is set, existing tables are updated in
+        place rather than dropped and reloaded, see
+        incremental_load.
+
+        dedupe='spill' deduplicates out of core for inputs whose
+        distinct rows don't fit in memory, using temporary run
+        files and at most memory_limit bytes of state per table,
+        see spill_transform.
+
+        bulk=True creates the tables without primary keys, and
+        adds the primary keys, the indexes declared in the schema
+        and the foreign keys in one pass once everything has been
+        COPYed, then ANALYZEs the tables. unlogged=True creates
+        UNLOGGED tables, which are faster to load but are not
+        crash safe or replicated, and stay unlogged after the load.
+
+        session_settings is a dictionary of server settings, such
+        as {'maintenance_work_mem': '1GB', 'synchronous_commit': 'off'},
+        applied with SET LOCAL for the duration of the load.
+
+        Every table gets the indexes declared by its schema's
+        'index' key plus one on each foreign key column. Outside
+        of bulk mode they are built with CREATE INDEX CONCURRENTLY
+        after the data has been committed, index_workers tables
+        at a time (defaulting to workers). How long each index
+        took to build is kept in index_timings.
+
+        format='binary' sends the data in Postgres' binary COPY
+        format, encoding every value according to the type of its
+        column in the schema (see wextractor.loaders.binary_copy),
+        so the server doesn't have to parse it. Loads with column
+        types binary COPY can't encode raise before they start.
+
+        skip_unchanged=True computes an order-independent digest
+        of every deduplicated table before touching the database
+        and compares it with the digest stored by the previous
+        load in the wextractor_table_digests table. Tables whose
+        digest, row count and definition are unchanged are left
+        alone entirely, along with their indexes and foreign
+        keys; the rest are reloaded, as is every table with a
+        foreign key to a reloaded table. It needs the whole input
+        in memory, so it can't be combined with batch_size,
+        workers, incremental, dedupe='spill' or unlogged tables.
+
+        profile=True profiles the load and writes a .pstats file
+        and a summary of where the time went, by stage and by
+        function, to the current directory. profile can also be
+        an output path or a wextractor.profiling.Profiler, and
+        the WEXTRACTOR_PROFILE environment variable turns it on
+        for loads that don't pass it, see get_profiler.
+        '''
+        with profiled(profile, 'load', self.instrumentation):
+            return self.run_load(
+                data, add_pkey, batch_size, workers, incremental, dedupe, memory_limit, bulk,
+                unlogged, session_settings, index_workers, format, skip_unchanged
+            )
+
+    def run_load(self, data, add_pkey, batch_size, workers, incremental, dedupe, memory_limit,
+                 bulk, unlogged, session_settings, index_workers, format, skip_unchanged):
+        '''
+        Does the work of load, see load
         '''
+        self.index_timings = {}
+
+        if skip_unchanged and (batch_size is not None or (workers is not None and workers > 1) or
+                               incremental or dedupe != 'memory' or unlogged):
+            raise Exception(
+                'skip_unchanged can only be used for in memory loads of logged tables'
+            )
+
+        if self.schema:
+            self.check_copy_format(format, add_pkey)
+
+        if index_workers is None:
+            index_workers = workers
+
+        if bulk and incremental:
+            raise Exception('bulk can not be combined with incremental loading')
+
+        if workers is not None and workers > 1:
+            if not self.schema:
+                raise Exception('Schemaless loading is not supported by PostgresLoader')
+            if batch_size is not None:
+                raise Exception('batch_size can not be combined with parallel loading')
+            if incremental:
+                raise Exception('incremental can not be combined with parallel loading')
+            if self.connection is not None:
+                raise Exception('Parallel loading needs a connection per table, not an injected connection')
+            return self.parallel_load(
+                data, add_pkey, workers, dedupe, memory_limit, bulk, unlogged, session_settings,
+                index_workers, format
+            )
+
+        if incremental:
+            if not self.schema:
+                raise Exception('Schemaless loading is not supported by PostgresLoader')
+            return self.incremental_load(
+                data, add_pkey, batch_size, dedupe, memory_limit, session_settings, index_workers, format
+            )
+
         conn = None
 
         try:
@@ -311,39 +1256,62 @@ class PostgresLoader(Loader):
             if not self.schema:
                 raise Exception('Schemaless loading is not supported by PostgresLoader')
 
-            tables = self.transform_to_schema(data, add_pkey)
+            tables = self.table_definitions(add_pkey)
 
-            for ix, table in enumerate(self.schema):
-                table['columns'] = ( (table['table_name'] + '_id', 'VARCHAR(32)'), ) + table['columns']
+            self.apply_session_settings(cursor, session_settings)
 
-                if add_pkey or table.get('pkey', None) is None:
-                    table['pkey'] = table['table_name'] + '_id'
+            batches = self.transformed_batches(data, add_pkey, batch_size, dedupe, memory_limit)
 
-                if table.get('from_relations', None):
-                    for relationship in table['from_relations']:
-                        table['columns'] += ( ( relationship + '_id', 'VARCHAR(32)' ), )
+            if skip_unchanged:
+                digests = self.table_digests(batches[0], add_pkey)
+                loading = self.changed_tables(cursor, digests)
+            else:
+                self.forget_digests(cursor, tables)
+                loading = range(len(tables))
 
-                drop_table = self.generate_drop_table_query(table)
+            for ix in loading:
+                drop_table = self.generate_drop_table_query(tables[ix])
                 cursor.execute(drop_table)
 
-                create_table = self.generate_create_table_query(table)
+                create_table = self.generate_create_table_query(
+                    tables[ix], primary_key=not bulk, unlogged=unlogged
+                )
                 cursor.execute(create_table)
-                tmp_file, column_names = self.generate_data_tempfile(tables[ix])
 
-                cursor.copy_from(tmp_file, table['table_name'], null='NULL', sep='\t', columns=column_names)
+            row_counts = [0 for table in tables]
 
-            for table in self.schema:
-                for ix, relationship in enumerate(table.get('from_relations', [])):
-                    fk_query = self.generate_foreign_key_query(table, ix)
-                    cursor.execute(fk_query)
+            for batch in batches:
+                for ix in loading:
+                    table = tables[ix]
+                    if isinstance(batch[ix], list) and len(batch[ix]) == 0:
+                        continue
+
+                    stream = self.copy_rows(
+                        cursor, table['table_name'], batch[ix], self.plan[ix], add_pkey,
+                        row_counts[ix], format
+                    )
+
+                    row_counts[ix] = stream.row_id
+
+            loaded = [tables[ix] for ix in loading]
+            self.add_constraints(cursor, loaded, bulk)
+
+            if skip_unchanged:
+                self.store_digests(cursor, digests, loading)
 
             conn.commit()
 
-        except psycopg2.Error, e:
+            if skip_unchanged:
+                self.digest_table_exists = True
+
+        except:
             if conn:
                 conn.rollback()
-            raise e
+            raise
 
         finally:
             if conn:
-                conn.close()
+                self.release(conn)
+
+        if not bulk:
+            self.build_indexes(loaded, index_workers, session_settings)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import time
+import thread
+import pstats
+import marshal
+import cProfile
+import logging
+import threading
+from StringIO import StringIO
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# set to a path (or 1 for the current directory) to profile every
+# load and extract that doesn't pass profile itself
+ENVIRONMENT_VARIABLE = 'WEXTRACTOR_PROFILE'
+# 'cprofile' (the default) or 'sample'
+MODE_VARIABLE = 'WEXTRACTOR_PROFILE_MODE'
+
+TRUE_STRINGS = ('1', 'true', 'yes', 'on')
+FALSE_STRINGS = ('', '0', 'false', 'no', 'off')
+
+# only one run is profiled at a time, so that a profiled load
+# doesn't try to profile the extracts inside it as well
+_lock = threading.Lock()
+_active = []
+
+def frame_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+class Sampler(object):
+    def __init__(self, interval=0.005):
+        '''
+        A statistical profiler. A background thread looks at the
+        stack of every other thread each interval seconds, and
+        the wall time since the last sample is charged to every
+        function on those stacks. Unlike cProfile it sees work
+        done in worker threads, such as parallel COPYs and index
+        builds, and barely slows the run down, but time spent
+        waiting is counted too.
+        '''
+        self.interval = interval
+        self.self_time = {}
+        self.total_time = {}
+        self.samples = {}
+        self.callers = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self, elapsed, ignore):
+        for ident, frame in sys._current_frames().items():
+            if ident == ignore:
+                continue
+
+            leaf = frame_key(frame.f_code)
+            self.self_time[leaf] = self.self_time.get(leaf, 0) + elapsed
+
+            seen = set()
+            callee = None
+            while frame is not None:
+                key = frame_key(frame.f_code)
+
+                if key not in seen:
+                    seen.add(key)
+                    self.total_time[key] = self.total_time.get(key, 0) + elapsed
+                    self.samples[key] = self.samples.get(key, 0) + 1
+
+                if callee is not None:
+                    callers = self.callers.setdefault(callee, {})
+                    callers[key] = callers.get(key, 0) + 1
+
+                callee = key
+                frame = frame.f_back
+
+    def run(self):
+        ignore = thread.get_ident()
+        last = time.time()
+
+        while True:
+            # wakes up early when disabled, which must not sample
+            self.stopped.wait(self.interval)
+            if self.stopped.is_set():
+                break
+
+            now = time.time()
+            self.sample(now - last, ignore)
+            last = now
+
+    def enable(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def disable(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def dump_stats(self, path):
+        '''
+        Writes the samples in the format pstats reads, with sample
+        counts standing in for call counts
+        '''
+        stats = {}
+
+        for key, total in self.total_time.items():
+            samples = self.samples[key]
+            callers = dict(
+                (caller, (count, count, 0.0, count * self.interval))
+                for caller, count in self.callers.get(key, {}).items()
+            )
+            stats[key] = (samples, samples, self.self_time.get(key, 0.0), total, callers)
+
+        with open(path, 'wb') as output:
+            marshal.dump(stats, output)
+
+class Profiler(object):
+    def __init__(self, output=None, mode='cprofile', top=25, interval=0.005):
+        '''
+        Profiles loads and extracts. Each profiled run writes a
+        .pstats file, which can be opened with pstats or tools
+        like snakeviz, and a .txt summary next to it. The summary
+        breaks the run down by wextractor stage (see
+        wextractor.instrumentation) and lists the top functions
+        by cumulative and by internal time.
+
+        output is a .pstats path, which every run overwrites, or
+        a directory to write one timestamped file per run to,
+        defaulting to the current directory. mode is 'cprofile',
+        which times every call in the thread that started the
+        run, or 'sample', see Sampler. top is the number of
+        functions listed in the summary.
+
+        After a run, pstats_path, summary_path and summary
+        describe what was written.
+        '''
+        if mode not in ('cprofile', 'sample'):
+            raise Exception('mode must be either "cprofile" or "sample"')
+
+        self.output = output or os.getcwd()
+        self.mode = mode
+        self.top = top
+        self.interval = interval
+
+        self.pstats_path = None
+        self.summary_path = None
+        self.summary = None
+
+    def paths(self, name):
+        '''
+        Returns the .pstats and summary paths for a run
+        '''
+        if self.output.endswith('.pstats'):
+            path = self.output
+        else:
+            if not os.path.isdir(self.output):
+                os.makedirs(self.output)
+            path = os.path.join(self.output, '{name}-{time}-{pid}.pstats'.format(
+                name=re.sub(r'[^\w.-]+', '_', name), time=time.strftime('%Y%m%d-%H%M%S'), pid=os.getpid()
+            ))
+
+        return path, os.path.splitext(path)[0] + '.txt'
+
+    @contextmanager
+    def run(self, name, instrumentation=None):
+        '''
+        Profiles the code in a with block as one run called name.
+        Stages recorded by instrumentation while it runs are
+        summarized by stage. Runs inside another profiled run
+        aren't profiled on their own.
+        '''
+        with _lock:
+            nested = bool(_active)
+            _active.append(self)
+
+        try:
+            if nested:
+                yield self
+                return
+
+            stages = []
+            if instrumentation is not None:
+                instrumentation.add_callback(stages.append)
+
+            profile = Sampler(self.interval) if self.mode == 'sample' else cProfile.Profile()
+
+            start = time.time()
+            profile.enable()
+
+            try:
+                yield self
+            finally:
+                profile.disable()
+                elapsed = time.time() - start
+
+                if instrumentation is not None:
+                    instrumentation.remove_callback(stages.append)
+
+                self.write(name, profile, elapsed, stages)
+
+        finally:
+            with _lock:
+                _active.remove(self)
+
+    def write(self, name, profile, elapsed, stages):
+        self.pstats_path, self.summary_path = self.paths(name)
+
+        profile.dump_stats(self.pstats_path)
+
+        # pstats can't read a run that ended before the first sample
+        sampled = not isinstance(profile, Sampler) or bool(profile.total_time)
+
+        self.summary = self.summarize(name, elapsed, stages, sampled)
+        with open(self.summary_path, 'w') as output:
+            output.write(self.summary)
+
+        logger.info('Profiled {name} in {seconds:.3f}s, wrote {path}'.format(
+            name=name, seconds=elapsed, path=self.pstats_path
+        ))
+
+    def summarize(self, name, elapsed, stages, sampled=True):
+        '''
+        Returns the text of a run's summary
+        '''
+        lines = [
+            '{name}: {seconds:.3f}s, profiled with {mode}'.format(name=name, seconds=elapsed, mode=self.mode),
+            'stats: {path}'.format(path=self.pstats_path),
+            '',
+            '{stage:<16} {runs:>6} {seconds:>10} {share:>7} {rows:>12}'.format(
+                stage='stage', runs='runs', seconds='seconds', share='share', rows='rows'
+            ),
+        ]
+
+        totals, order = {}, []
+        for stats in stages:
+            if stats.stage not in totals:
+                order.append(stats.stage)
+                totals[stats.stage] = [0, 0.0, None]
+            total = totals[stats.stage]
+            total[0] += 1
+            total[1] += stats.seconds
+            rows = stats.rows_in if stats.rows_in is not None else stats.rows_out
+            if rows is not None:
+                total[2] = (total[2] or 0) + rows
+
+        for stage in order:
+            runs, seconds, rows = totals[stage]
+            lines.append('{stage:<16} {runs:>6} {seconds:>10.3f} {share:>6.1f}% {rows:>12}'.format(
+                stage=stage, runs=runs, seconds=seconds,
+                share=seconds / elapsed * 100 if elapsed else 0, rows='' if rows is None else rows
+            ))
+
+        # stages can be nested (e.g. copy within a load's COPY
+        # phase) or run side by side in threads, so this is only
+        # a rough measure of the time no stage accounts for
+        attributed = sum(totals[stage][1] for stage in order)
+        lines.append('{stage:<16} {runs:>6} {seconds:>10.3f}'.format(
+            stage='(other)', runs='', seconds=max(elapsed - attributed, 0)
+        ))
+
+        if not sampled:
+            lines.extend(['', 'no samples were taken, the run was shorter than the sampling interval'])
+            return '\n'.join(lines) + '\n'
+
+        for sort, title in (('cumulative', 'cumulative'), ('time', 'internal')):
+            stream = StringIO()
+            pstats.Stats(self.pstats_path, stream=stream).sort_stats(sort).print_stats(self.top)
+            lines.extend(['', 'top {top} functions by {title} time:'.format(top=self.top, title=title)])
+            lines.append(stream.getvalue().strip('\n'))
+
+        return '\n'.join(lines) + '\n'
+
+def get_profiler(profile=None):
+    '''
+    Turns the profile argument of load or extract into a
+    Profiler, or None for no profiling. profile can be a
+    Profiler, True, an output path (see Profiler) or False.
+    None falls back to the WEXTRACTOR_PROFILE and
+    WEXTRACTOR_PROFILE_MODE environment variables.
+    '''
+    if isinstance(profile, Profiler):
+        return profile
+    elif profile is False:
+        return None
+    elif profile is True:
+        return Profiler()
+    elif profile is not None:
+        return Profiler(profile)
+
+    setting = os.environ.get(ENVIRONMENT_VARIABLE, '').strip()
+    if setting.lower() in FALSE_STRINGS:
+        return None
+
+    return Profiler(
+        None if setting.lower() in TRUE_STRINGS else setting,
+        os.environ.get(MODE_VARIABLE, 'cprofile').strip().lower() or 'cprofile'
+    )
+
+@contextmanager
+def profiled(profile, name, instrumentation=None):
+    '''
+    Profiles the code in a with block if profile (or the
+    environment, see get_profiler) asks for it. Yields the
+    Profiler or None.
+    '''
+    profiler = get_profiler(profile)
+
+    if profiler is None:
+        yield None
+    else:
+        with profiler.run(name, instrumentation):
+            yield profiler